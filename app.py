@@ -1,27 +1,42 @@
+# First, so the startup report covers every other import
+import startup
 import os
 import base64
-from flask import Flask, render_template, request, jsonify, make_response, redirect, url_for, session, flash, Response
+from flask import Flask, render_template, request, jsonify, make_response, redirect, url_for, session, flash, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from models import db, Character, UserProgress, get_next_character, update_progress, User, CharacterAIDescription, UserCharacterTuning
+from werkzeug.wsgi import wrap_file
+from models import db, Character, UserProgress, get_next_character, get_next_characters, update_progress, bulk_update_progress, User, CharacterAIDescription, UserCharacterTuning, scheduler_states, get_catalog, reset_catalog, get_familiarity_vector, get_user_stats, recompute_user_stats, review_queue, rollup_reviews, get_review_history, sync_reviews, get_character_page, compile_catalog_from_db
+from progress_import import import_progress, import_snapshot, ProgressFormatError
+from progress_export import export_progress, export_snapshot, encode_chunks, spool_chunks
+import snapshot
+import jobs
+from character_seed import parse_characters
+from migrations import migrate, pending_migrations
+from catalog import CatalogEntry, compile_catalog
+import models
+import io
+import itertools
 import random
+import threading
+import time
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 import json
-from datetime import datetime, timedelta
+import click
+from datetime import date, datetime, timedelta, timezone
 from dotenv import load_dotenv
 import hashlib
 import string
-from authlib.integrations.flask_client import OAuth
-import requests
 import re as re_module
-import jieba
-from pycccedict.cccedict import CcCedict
-from cryptography.fernet import Fernet
+import cedict
+from cedict import get_dictionary, numbered_to_tonemarks
 
-# Initialize CC-CEDICT dictionary once at module level
-_cccedict = CcCedict()
+# jieba, authlib, cryptography and requests take a while to import, so they
+# are imported where they are used, and warmup() preloads jieba
+startup.mark('import modules')
 
 def _get_fernet():
     """Derive a Fernet key from the app's SECRET_KEY."""
+    from cryptography.fernet import Fernet
     secret = os.environ.get('SECRET_KEY', 'dev-secret-key')
     key = base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest())
     return Fernet(key)
@@ -41,35 +56,12 @@ def _get_api_key(user=None):
             pass
     return None
 
-def _numbered_to_tonemarks(s: str) -> str:
-    """Convert numbered pinyin like 'bei3 jing1' to tone marks like 'běi jīng'."""
-    _tone_marks = {
-        'a': 'āáǎà', 'e': 'ēéěè', 'i': 'īíǐì',
-        'o': 'ōóǒò', 'u': 'ūúǔù', 'ü': 'ǖǘǚǜ',
-    }
-    def _convert_syllable(m):
-        syllable = m.group(1).lower()
-        tone = int(m.group(2))
-        if tone == 5 or tone == 0:
-            return syllable
-        for v in ('a', 'e'):
-            if v in syllable:
-                return syllable.replace(v, _tone_marks[v][tone - 1])
-        if 'ou' in syllable:
-            return syllable.replace('o', _tone_marks['o'][tone - 1])
-        for idx in range(len(syllable) - 1, -1, -1):
-            ch = syllable[idx]
-            if ch in _tone_marks:
-                return syllable[:idx] + _tone_marks[ch][tone - 1] + syllable[idx + 1:]
-        return syllable
-    s = s.replace('v', 'ü')
-    return re_module.sub(r'([a-züA-ZÜ]+)([0-5])', _convert_syllable, s)
-
 def _is_chinese_token(s: str) -> bool:
     return any('\u4e00' <= ch <= '\u9fff' for ch in s)
 
 def _translate_zh_to_en(text: str) -> str:
     """Translate Chinese text to English using the free Google Translate API."""
+    import requests
     try:
         resp = requests.get(
             'https://translate.googleapis.com/translate_a/single',
@@ -91,39 +83,27 @@ def _translate_zh_to_en(text: str) -> str:
 
 def _annotate_tokens(text: str) -> list:
     """Tokenize a Chinese string with jieba and look up each token in CC-CEDICT.
+    Tokens that are not headwords are split into the longest headwords they contain.
     Returns a list of token dicts suitable for the frontend."""
-    tokens = list(jieba.cut(text))
+    import jieba
+    dictionary = get_dictionary()
     result = []
-    for tok in tokens:
+    for tok in jieba.cut(text):
         if not _is_chinese_token(tok):
             result.append({'token': tok, 'type': 'punctuation'})
             continue
-        entry = _cccedict.get_entry(tok)
-        if entry:
-            pinyin_raw = entry.get('pinyin', '')
-            pinyin = _numbered_to_tonemarks(pinyin_raw) if pinyin_raw else ''
-            result.append({
-                'token': tok, 'type': 'chinese',
-                'pinyin': pinyin, 'definitions': entry.get('definitions', [])
-            })
-        else:
-            if len(tok) > 1:
-                for ch in tok:
-                    if not _is_chinese_token(ch):
-                        result.append({'token': ch, 'type': 'punctuation'})
-                        continue
-                    ch_entry = _cccedict.get_entry(ch)
-                    if ch_entry:
-                        ch_pinyin_raw = ch_entry.get('pinyin', '')
-                        ch_pinyin = _numbered_to_tonemarks(ch_pinyin_raw) if ch_pinyin_raw else ''
-                        result.append({
-                            'token': ch, 'type': 'chinese',
-                            'pinyin': ch_pinyin, 'definitions': ch_entry.get('definitions', [])
-                        })
-                    else:
-                        result.append({'token': ch, 'type': 'chinese', 'pinyin': '', 'definitions': []})
+        entry = dictionary.get(tok)
+        pieces = [(tok, entry)] if entry is not None or len(tok) == 1 else dictionary.segment(tok)
+        for piece, entry in pieces:
+            if not _is_chinese_token(piece):
+                result.append({'token': piece, 'type': 'punctuation'})
+            elif entry is None:
+                result.append({'token': piece, 'type': 'chinese', 'pinyin': '', 'definitions': []})
             else:
-                result.append({'token': tok, 'type': 'chinese', 'pinyin': '', 'definitions': []})
+                result.append({
+                    'token': piece, 'type': 'chinese',
+                    'pinyin': entry.pinyin, 'definitions': entry.definitions
+                })
     return result
 
 # Load environment variables from .env file
@@ -132,28 +112,31 @@ load_dotenv()
 # Import configuration from config.py
 try:
     import config
-    print("Successfully imported configuration from config.py")
 except ImportError:
-    print("Warning: config.py not found, using environment variables only")
     config = None
 
-# Debug environment variables
-print("Environment variables and configuration loaded:")
 client_id = os.environ.get('GOOGLE_CLIENT_ID') or (config.GOOGLE_CLIENT_ID if config else None)
 client_secret = os.environ.get('GOOGLE_CLIENT_SECRET') or (config.GOOGLE_CLIENT_SECRET if config else None)
-print(f"GOOGLE_CLIENT_ID: {client_id[:10] + '...' if client_id else 'Not set'} (length: {len(client_id) if client_id else 0})")
-print(f"GOOGLE_CLIENT_SECRET: {client_secret[:5] + '...' if client_secret else 'Not set'} (length: {len(client_secret) if client_secret else 0})")
 
 # Determine if we're running in production
 is_production = os.environ.get('RAILWAY_STATIC_URL') is not None
-print(f"Running in production mode: {is_production}")
+
+# Configuration summary, only printed with STARTUP_REPORT=true
+if startup.STARTUP_REPORT:
+    print("Successfully imported configuration from config.py" if config else
+          "Warning: config.py not found, using environment variables only")
+    print("Environment variables and configuration loaded:")
+    print(f"GOOGLE_CLIENT_ID: {client_id[:10] + '...' if client_id else 'Not set'} (length: {len(client_id) if client_id else 0})")
+    print(f"GOOGLE_CLIENT_SECRET: {client_secret[:5] + '...' if client_secret else 'Not set'} (length: {len(client_secret) if client_secret else 0})")
+    print(f"Running in production mode: {is_production}")
 
 app = Flask(__name__)
 
 # Configure database
 _raw_db_url = os.environ.get('DATABASE_URL', '')
 if _raw_db_url:
-    print(f"DATABASE_URL is set (starts with: {_raw_db_url[:30]}...)")
+    if startup.STARTUP_REPORT:
+        print(f"DATABASE_URL is set (starts with: {_raw_db_url[:30]}...)")
 else:
     print("WARNING: DATABASE_URL is NOT set, falling back to SQLite (data will be lost on redeploy!)")
     _raw_db_url = 'sqlite:///chinchar.db'
@@ -162,8 +145,10 @@ app.config['SQLALCHEMY_DATABASE_URI'] = _raw_db_url
 # Replace postgres:// with postgresql:// in the DATABASE_URL (Railway specific)
 if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):
     app.config['SQLALCHEMY_DATABASE_URI'] = app.config['SQLALCHEMY_DATABASE_URI'].replace('postgres://', 'postgresql://', 1)
-    print("Replaced postgres:// with postgresql:// in DATABASE_URL")
-print(f"Final DB URI scheme: {app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0]}://")
+    if startup.STARTUP_REPORT:
+        print("Replaced postgres:// with postgresql:// in DATABASE_URL")
+if startup.STARTUP_REPORT:
+    print(f"Final DB URI scheme: {app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0]}://")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Set a secret key for session management
@@ -188,19 +173,22 @@ app.config['REMEMBER_COOKIE_HTTPONLY'] = True
 # Force HTTPS for external URLs when running on Railway
 if is_production:
     app.config['PREFERRED_URL_SCHEME'] = 'https'
-    print("Forcing HTTPS for external URLs in production mode")
+    if startup.STARTUP_REPORT:
+        print("Forcing HTTPS for external URLs in production mode")
+
+startup.mark('configuration')
 
 # Initialize database
 db.init_app(app)
 
+# Background jobs for long imports (JOB_WORKERS, see jobs.py)
+job_runner = jobs.from_env()
+
 # Initialize login manager
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-# Initialize OAuth
-oauth = OAuth(app)
-
 # Helper function to get the correct redirect URI with HTTPS in production
 def get_redirect_uri(endpoint):
     uri = url_for(endpoint, _external=True)
@@ -225,10 +213,21 @@ google_config = {
 }
 
 # Log the OAuth configuration (without sensitive data)
-print(f"OAuth configuration: client_id exists: {bool(google_config['client_id'])}, "
-      f"client_secret exists: {bool(google_config['client_secret'])}")
+if startup.STARTUP_REPORT:
+    print(f"OAuth configuration: client_id exists: {bool(google_config['client_id'])}, "
+          f"client_secret exists: {bool(google_config['client_secret'])}")
+
+_google = None
+
+def get_google():
+    """The Google OAuth client, registered on first use so authlib is only imported when someone logs in with Google."""
+    global _google
+    if _google is None:
+        from authlib.integrations.flask_client import OAuth
+        _google = OAuth(app).register(**google_config)
+    return _google
 
-google = oauth.register(**google_config)
+startup.mark('extensions')
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -298,7 +297,7 @@ def google_login():
     print(f"HOST: {os.environ.get('HOST')}")
     
     try:
-        return google.authorize_redirect(redirect_uri)
+        return get_google().authorize_redirect(redirect_uri)
     except Exception as e:
         print(f"Error during Google OAuth redirect: {e}")
         return render_template('login.html', error=f'Error initiating Google login: {str(e)}')
@@ -312,7 +311,7 @@ def google_auth():
        
         # Get the token with more detailed error handling
         try:
-            token = google.authorize_access_token()
+            token = get_google().authorize_access_token()
             print("Successfully obtained access token")
         except Exception as token_error:
             print(f"Error obtaining access token: {token_error}")
@@ -320,7 +319,7 @@ def google_auth():
         
         # Get user info directly from userinfo endpoint with more detailed error handling
         try:
-            userinfo_response = google.get('userinfo')
+            userinfo_response = get_google().get('userinfo')
             print(f"Userinfo response status: {userinfo_response.status_code}")
             
             if userinfo_response.status_code != 200:
@@ -443,98 +442,54 @@ def index():
     """Render the main page"""
     return render_template('index.html')
 
+# Characters rendered with a list page; further pages come from /api/characters/<category>
+CHARACTER_PAGE_SIZE = 60
+
+def _character_list_page(category, title):
+    characters, next_cursor = get_character_page(current_user.id, category, limit=CHARACTER_PAGE_SIZE)
+    return render_template('character_list.html',
+                          title=title,
+                          characters=characters,
+                          next_cursor=next_cursor,
+                          category=category)
+
 @app.route('/known')
 @login_required
 def known_characters():
-    """Render the page showing known characters"""
-    # Get all characters with familiarity level 2 (Know)
-    progress = UserProgress.query.filter_by(user_id=current_user.id, familiarity=2).all()
-    characters = []
-    
-    for p in progress:
-        character = Character.query.get(p.character_id)
-        if character:
-            characters.append({
-                'id': character.id,
-                'hanzi': character.hanzi,
-                'pinyin': character.pinyin,
-                'meaning': character.meaning,
-                'last_reviewed': p.last_reviewed,
-                'review_count': p.review_count,
-                'know_count': p.know_count,
-                'unsure_count': p.unsure_count,
-                'dont_know_count': p.dont_know_count
-            })
-    
-    # Sort by dont_know_count and unsure_count (descending), then by last_reviewed
-    characters.sort(key=lambda x: (-(x['dont_know_count'] + x['unsure_count']), -x['last_reviewed'].timestamp()))
-    
-    return render_template('character_list.html', 
-                          title='Characters You Know', 
-                          characters=characters, 
-                          category='known')
+    """Render the page showing known characters, most often missed first"""
+    return _character_list_page('known', 'Characters You Know')
 
 @app.route('/unsure')
 @login_required
 def unsure_characters():
-    """Render the page showing unsure characters"""
-    # Get all characters with familiarity level 1 (Unsure)
-    progress = UserProgress.query.filter_by(user_id=current_user.id, familiarity=1).all()
-    characters = []
-    
-    for p in progress:
-        character = Character.query.get(p.character_id)
-        if character:
-            characters.append({
-                'id': character.id,
-                'hanzi': character.hanzi,
-                'pinyin': character.pinyin,
-                'meaning': character.meaning,
-                'last_reviewed': p.last_reviewed,
-                'review_count': p.review_count,
-                'know_count': p.know_count,
-                'unsure_count': p.unsure_count,
-                'dont_know_count': p.dont_know_count
-            })
-    
-    # Sort by unsure_count (descending), then by last_reviewed
-    characters.sort(key=lambda x: (-x['unsure_count'], -x['last_reviewed'].timestamp()))
-    
-    return render_template('character_list.html', 
-                          title='Characters You\'re Unsure About', 
-                          characters=characters, 
-                          category='unsure')
+    """Render the page showing unsure characters, most often unsure first"""
+    return _character_list_page('unsure', 'Characters You\'re Unsure About')
 
 @app.route('/unknown')
 @login_required
 def unknown_characters():
-    """Render the page showing unknown characters"""
-    # Get all characters with familiarity level 0 (Don't Know)
-    progress = UserProgress.query.filter_by(user_id=current_user.id, familiarity=0).all()
-    characters = []
-    
-    for p in progress:
-        character = Character.query.get(p.character_id)
-        if character:
-            characters.append({
-                'id': character.id,
-                'hanzi': character.hanzi,
-                'pinyin': character.pinyin,
-                'meaning': character.meaning,
-                'last_reviewed': p.last_reviewed,
-                'review_count': p.review_count,
-                'know_count': p.know_count,
-                'unsure_count': p.unsure_count,
-                'dont_know_count': p.dont_know_count
-            })
-    
-    # Sort by dont_know_count (descending), then by last_reviewed
-    characters.sort(key=lambda x: (-x['dont_know_count'], -x['last_reviewed'].timestamp()))
-    
-    return render_template('character_list.html', 
-                          title='Characters You Don\'t Know', 
-                          characters=characters, 
-                          category='unknown')
+    """Render the page showing unknown characters, most often not known first"""
+    return _character_list_page('unknown', 'Characters You Don\'t Know')
+
+@app.route('/api/characters/<category>', methods=['GET'])
+@login_required
+def get_character_list(category):
+    """One page of the known/unsure/unknown character list.
+
+    Query parameters:
+        cursor: next_cursor from the previous page (omit for the first page)
+        limit: characters per page (1-200, default 60)
+    """
+    limit = max(1, min(200, request.args.get('limit', CHARACTER_PAGE_SIZE, type=int)))
+    try:
+        characters, next_cursor = get_character_page(
+            current_user.id, category, cursor=request.args.get('cursor'), limit=limit
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    for character in characters:
+        character['last_reviewed'] = character['last_reviewed'].isoformat()
+    return jsonify({'characters': characters, 'next_cursor': next_cursor})
 
 @app.route('/api/character/next', methods=['GET'])
 @login_required
@@ -559,12 +514,54 @@ def next_character():
         app.logger.error(f"Error in next_character: {e}")
         return jsonify({'error': 'An error occurred while retrieving the next character'}), 500
 
+@app.route('/api/character/queue', methods=['GET'])
+@login_required
+def character_queue():
+    """Get a batch of upcoming characters with their details inline.
+
+    Query parameters:
+      n: number of cards to return (1-50, default 10)
+      exclude: comma-separated character IDs the client already has queued
+    """
+    try:
+        count = max(1, min(request.args.get('n', 10, type=int), 50))
+
+        exclude_ids = set()
+        for part in request.args.get('exclude', '').split(','):
+            if part.strip().isdigit():
+                exclude_ids.add(int(part))
+
+        characters = get_next_characters(current_user.id, count, exclude_ids=exclude_ids)
+
+        if not characters:
+            return jsonify({'error': 'No characters available'}), 404
+
+        ids = [c.id for c in characters]
+        cached_ids = {
+            row[0] for row in db.session.query(CharacterAIDescription.character_id).filter(
+                CharacterAIDescription.character_id.in_(ids)
+            )
+        }
+
+        return jsonify({
+            'cards': [{
+                'id': c.id,
+                'hanzi': c.hanzi,
+                'pinyin': c.pinyin,
+                'meaning': c.meaning,
+                'has_ai_description': c.id in cached_ids
+            } for c in characters]
+        })
+    except Exception as e:
+        app.logger.error(f"Error in character_queue: {e}")
+        return jsonify({'error': 'An error occurred while retrieving the card queue'}), 500
+
 @app.route('/api/character/<int:character_id>', methods=['GET'])
 @login_required
 def get_character(character_id):
     """Get details for a specific character"""
     try:
-        character = Character.query.get(character_id)
+        character = get_catalog().get(character_id)
         
         if not character:
             return jsonify({'error': 'Character not found'}), 404
@@ -585,8 +582,9 @@ def get_character(character_id):
 @app.route('/api/character/<int:character_id>/ai-description', methods=['GET'])
 @login_required
 def get_ai_description(character_id):
+    import requests
     try:
-        character = Character.query.get(character_id)
+        character = get_catalog().get(character_id)
         if not character:
             return jsonify({'error': 'Character not found'}), 404
 
@@ -658,11 +656,13 @@ def demote_character():
         if not data:
             return jsonify({'error': 'No data provided'}), 400
 
-        character_id = data.get('character_id')
-        if not character_id:
+        if not data.get('character_id'):
             return jsonify({'error': 'No character_id provided'}), 400
+        character_id = _character_id(data['character_id'])
+        if character_id is None:
+            return jsonify({'error': 'Invalid character_id'}), 400
 
-        character = Character.query.get(character_id)
+        character = get_catalog().get(character_id)
         if not character:
             return jsonify({'error': 'Character not found'}), 404
 
@@ -677,6 +677,7 @@ def demote_character():
 
         tuning.rank_penalty += 50
         db.session.commit()
+        scheduler_states.set_rank_penalty(current_user.id, character_id, tuning.rank_penalty)
 
         return jsonify({'success': True, 'rank_penalty': tuning.rank_penalty})
     except Exception as e:
@@ -684,6 +685,21 @@ def demote_character():
         db.session.rollback()
         return jsonify({'error': 'An error occurred while updating character tuning'}), 500
 
+def _character_id(value):
+    """Parse a character id from a JSON body (an int, or a string such as "101"); None if it is not one."""
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _latency_ms(value):
+    """Validate a client-reported answer time, dropping anything implausible."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value < 3600000:
+        return None
+    return int(value)
+
 @app.route('/api/progress', methods=['POST'])
 @login_required
 def update_user_progress():
@@ -705,6 +721,11 @@ def update_user_progress():
         if not character_id:
             print("Error: No character_id provided in request")
             return jsonify({'error': 'No character_id provided'}), 400
+
+        character_id = _character_id(character_id)
+        if character_id is None:
+            print("Error: Invalid character_id in request")
+            return jsonify({'error': 'Invalid character_id'}), 400
         
         if familiarity is None:
             print("Error: No familiarity provided in request")
@@ -714,13 +735,25 @@ def update_user_progress():
         if familiarity not in [0, 1, 2]:
             print(f"Error: Invalid familiarity value: {familiarity}")
             return jsonify({'error': 'Invalid familiarity value'}), 400
+
+        latency_ms = _latency_ms(data.get('latency_ms'))
         
         # Get user_id from current_user
         user_id = current_user.id
         print(f"User ID: {user_id}")
         
-        # Update progress
-        success = update_progress(user_id, character_id, familiarity)
+        if review_queue is not None:
+            # Write-behind mode: acknowledge once the review is on disk and let
+            # the flusher apply it; the scheduler sees it right away.
+            if not get_catalog().get(character_id):
+                return jsonify({'error': 'Character not found'}), 404
+            review_queue.start(app)  # No-op once warmup() or an earlier review started it
+            review_queue.submit(user_id, character_id, familiarity, latency_ms)
+            scheduler_states.record_review(user_id, character_id, familiarity)
+            success = True
+        else:
+            # Update progress
+            success = update_progress(user_id, character_id, familiarity, latency_ms)
         
         if not success:
             print(f"Error: Failed to update progress for character_id={character_id}")
@@ -760,18 +793,21 @@ def batch_update_user_progress():
             'total': len(updates),
         }
 
+        catalog = get_catalog()
+        reviews = []
         for item in updates:
-            character_id = item.get('character_id')
+            character_id = _character_id(item.get('character_id'))
             familiarity = item.get('familiarity')
-            if not character_id or familiarity not in [0, 1, 2]:
+            if not character_id or familiarity not in [0, 1, 2] or not catalog.get(character_id):
                 results['failed'] += 1
                 continue
+            reviews.append((character_id, familiarity, None, _latency_ms(item.get('latency_ms'))))
 
-            ok = update_progress(user_id, character_id, familiarity)
-            if ok:
-                results['success'] += 1
-            else:
-                results['failed'] += 1
+        # All valid updates are written together in one transaction
+        if bulk_update_progress(user_id, reviews):
+            results['success'] += len(reviews)
+        else:
+            results['failed'] += len(reviews)
 
         if results['success'] == 0 and results['total'] > 0:
             return jsonify({'error': 'Failed to update progress', 'results': results}), 500
@@ -782,10 +818,172 @@ def batch_update_user_progress():
         db.session.rollback()
         return jsonify({'error': 'An error occurred while batch updating progress'}), 500
 
+# Largest number of events accepted by one /api/sync request
+SYNC_MAX_EVENTS = 1000
+
+def _parse_client_time(value, now):
+    """Parse an ISO 8601 string or epoch milliseconds into naive UTC, capped at now."""
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            parsed = datetime.fromtimestamp(value / 1000.0, timezone.utc).replace(tzinfo=None)
+        elif isinstance(value, str):
+            parsed = datetime.fromisoformat(value)
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        else:
+            return None
+    except (ValueError, OverflowError, OSError):
+        return None
+    return min(parsed, now)
+
+@app.route('/api/sync', methods=['POST'])
+@login_required
+def sync_offline_reviews():
+    """Apply reviews recorded while offline. Safe to retry.
+
+    Expected JSON body:
+      {"events": [{"id": "client-generated id", "character_id": 123, "familiarity": 2,
+                   "reviewed_at": "2024-05-01T08:30:00Z", "latency_ms": 1800}, ...],
+       "snapshot": "all"}
+
+    Events whose id was already synced are skipped. Events that are invalid
+    are listed in rejected by id, or only counted in invalid when they have
+    no usable id; either way the client should drop them. The response
+    includes the resulting familiarity of every character in the batch, or
+    of every reviewed character when snapshot is "all".
+    """
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('events'), list):
+            return jsonify({'error': 'Expected JSON body with an events list'}), 400
+        if len(data['events']) > SYNC_MAX_EVENTS:
+            return jsonify({'error': f'At most {SYNC_MAX_EVENTS} events per sync'}), 413
+
+        user_id = current_user.id
+        catalog = get_catalog()
+        now = datetime.utcnow()
+
+        events = []
+        rejected = []
+        invalid = 0
+        for item in data['events']:
+            if not isinstance(item, dict):
+                invalid += 1
+                continue
+            event_id = item.get('id')
+            character_id = _character_id(item.get('character_id'))
+            familiarity = item.get('familiarity')
+            reviewed_at = _parse_client_time(item.get('reviewed_at'), now)
+            if not isinstance(event_id, str) or not 0 < len(event_id) <= 64:
+                invalid += 1
+                continue
+            if familiarity not in [0, 1, 2] or not catalog.get(character_id) or reviewed_at is None:
+                rejected.append(event_id)
+                continue
+            events.append((event_id, character_id, familiarity, reviewed_at, _latency_ms(item.get('latency_ms'))))
+
+        result = sync_reviews(user_id, events)
+        if result is None:
+            return jsonify({'error': 'Failed to sync reviews'}), 500
+        applied, duplicates = result
+
+        vector = get_familiarity_vector(user_id)
+        if data.get('snapshot') == 'all':
+            character_ids = vector.ids_with(0) + vector.ids_with(1) + vector.ids_with(2)
+        else:
+            character_ids = {event[1] for event in events}
+        familiarity = {str(character_id): vector.get(character_id) for character_id in character_ids}
+
+        return jsonify({
+            'success': True,
+            'applied': applied,
+            'duplicates': duplicates,
+            'rejected': rejected,
+            'invalid': invalid,
+            'familiarity': familiarity
+        })
+    except Exception as e:
+        app.logger.error(f"Error in sync_offline_reviews: {e}")
+        db.session.rollback()
+        return jsonify({'error': 'An error occurred while syncing reviews'}), 500
+
+def _import_characters(user_id, characters, familiarity):
+    """Mark a list of hanzi with one familiarity level in a single bulk write.
+
+    Returns success/failed/not_found counts and per-character details in the
+    shape the import endpoints report.
+    """
+    catalog = get_catalog()
+    results = {'success': 0, 'failed': 0, 'not_found': 0, 'details': []}
+
+    found = []
+    for char in characters:
+        character = catalog.by_hanzi(char)
+        if not character:
+            results['not_found'] += 1
+            results['details'].append({'character': char, 'status': 'not_found'})
+            continue
+        found.append((char, character.id))
+
+    reviews = [(char_id, familiarity) for _, char_id in found]
+    status = 'success' if bulk_update_progress(user_id, reviews, log_events=False) else 'failed'
+    results[status] += len(found)
+    results['details'].extend({'character': char, 'status': status} for char, _ in found)
+    return results
+
+def _character_import_events(user_id, characters, familiarity):
+    """Background job for the character list imports, reporting like the endpoints do."""
+    results = _import_characters(user_id, characters, familiarity)
+    yield {
+        'type': 'result',
+        'success': True,
+        'message': f"Successfully imported {results['success']} characters. {results['not_found']} not found, {results['failed']} failed.",
+        'results': results
+    }
+
+def _import_file_events(user_id, path, details, binary):
+    """Background job for /api/import-progress, reading the saved upload."""
+    with open(path, 'rb') as f:
+        if binary:
+            yield from import_snapshot(user_id, f.read(), details=details)
+        else:
+            yield from import_progress(user_id, f, details=details)
+
+def _enqueue_job(kind, task, upload=None):
+    """Run an import as a background job if the client asked for one with ?async=1.
+
+    Returns a 202 response with the job id, a 503 if this worker already has
+    too many jobs, or None to run the request inline (not requested, or
+    background jobs are disabled with JOB_WORKERS=0).
+    """
+    if request.args.get('async') != '1' or job_runner is None:
+        return None
+    # Under `flask run` nothing calls warmup(), so the runner starts with the first job
+    job_runner.start(app)
+    job = job_runner.submit(current_user.id, kind, task, upload=upload)
+    if job is None:
+        return jsonify({'error': 'Too many imports are in progress, please try again shortly'}), 503
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('get_job_status', job_id=job.id)
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job_status(job_id):
+    """Status of a background job: queued/running/succeeded/failed, processed count, and the result once done"""
+    if job_runner is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job = job_runner.status(job_id, current_user.id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
 @app.route('/api/bulk-import', methods=['POST'])
 @login_required
 def bulk_import_characters():
-    """Bulk import characters from text"""
+    """Bulk import characters from text (?async=1 runs it as a background job)"""
     try:
         data = request.get_json()
         
@@ -818,34 +1016,12 @@ def bulk_import_characters():
         
         # Remove duplicates
         unique_chars = list(set(unique_chars))
-        
-        for char in unique_chars:
-            # Find the character in the database
-            character = Character.query.filter_by(hanzi=char).first()
-            
-            if not character:
-                results['not_found'] += 1
-                results['details'].append({
-                    'character': char,
-                    'status': 'not_found'
-                })
-                continue
-            
-            # Update progress with the specified familiarity level
-            success = update_progress(user_id, character.id, familiarity)
-            
-            if success:
-                results['success'] += 1
-                results['details'].append({
-                    'character': char,
-                    'status': 'success'
-                })
-            else:
-                results['failed'] += 1
-                results['details'].append({
-                    'character': char,
-                    'status': 'failed'
-                })
+
+        queued = _enqueue_job('bulk-import', lambda path: _character_import_events(user_id, unique_chars, familiarity))
+        if queued:
+            return queued
+
+        results.update(_import_characters(user_id, unique_chars, familiarity))
         
         return jsonify({
             'success': True,
@@ -859,59 +1035,36 @@ def bulk_import_characters():
 @app.route('/api/export-progress')
 @login_required
 def export_character_progress():
-    """Export character progress as a JSON file including all states"""
-    try:
-        # Get all characters that have been reviewed
-        progress = UserProgress.query.filter_by(user_id=current_user.id).all()
+    """Export character progress as a JSON file including all states
 
-        tuning_records = UserCharacterTuning.query.filter_by(user_id=current_user.id).all()
-        tuning_by_character_id = {t.character_id: t.rank_penalty for t in tuning_records}
-        
-        # Create a dictionary to store character progress
-        progress_data = {
-            "know": [],
-            "unsure": [],
-            "dont_know": [],
-            "detailed": {},  # New section for detailed progress info
-            "tuning": {}
-        }
-        
-        for p in progress:
-            character = Character.query.get(p.character_id)
-            if character:
-                # Add to the appropriate list based on familiarity
-                if p.familiarity == 2:  # Know
-                    progress_data["know"].append(character.hanzi)
-                elif p.familiarity == 1:  # Unsure
-                    progress_data["unsure"].append(character.hanzi)
-                elif p.familiarity == 0:  # Don't Know
-                    progress_data["dont_know"].append(character.hanzi)
-                
-                # Add detailed progress information
-                progress_data["detailed"][character.hanzi] = {
-                    "familiarity": p.familiarity,
-                    "review_count": p.review_count,
-                    "know_count": p.know_count,
-                    "unsure_count": p.unsure_count,
-                    "dont_know_count": p.dont_know_count,
-                    "last_reviewed": p.last_reviewed.isoformat(),
-                    "rank_penalty": tuning_by_character_id.get(character.id, 0)
-                }
-
-        for t in tuning_records:
-            character = Character.query.get(t.character_id)
-            if character:
-                progress_data["tuning"][character.hanzi] = {
-                    "rank_penalty": t.rank_penalty
-                }
-        
-        # Convert to JSON
-        progress_json = json.dumps(progress_data, ensure_ascii=False, indent=2)
-        
-        # Create a response with the JSON file
-        response = make_response(progress_json)
-        response.headers['Content-Disposition'] = 'attachment; filename=character_progress.json'
-        response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    The file is generated into a temporary file first (see progress_export.py),
+    so a failure part way through returns a 500 instead of a truncated file.
+
+    Query parameters:
+        gzip: 1 to download a gzip-compressed file (character_progress.json.gz),
+            which /api/import-progress also accepts
+        format: binary to download a compact binary snapshot instead (see
+            snapshot.py); also chosen by an Accept header naming its media type
+    """
+    try:
+        if request.args.get('format') == 'binary' or (
+                request.accept_mimetypes.best_match(['application/json', snapshot.MIMETYPE]) == snapshot.MIMETYPE):
+            response = make_response(export_snapshot(current_user.id))
+            response.headers['Content-Disposition'] = 'attachment; filename=character_progress.ccsnap'
+            response.headers['Content-Type'] = snapshot.MIMETYPE
+            return response
+
+        compress = request.args.get('gzip') == '1'
+        body, size = spool_chunks(encode_chunks(export_progress(current_user.id), gzip=compress))
+
+        response = Response(wrap_file(request.environ, body), direct_passthrough=True)
+        response.content_length = size
+        if compress:
+            response.headers['Content-Disposition'] = 'attachment; filename=character_progress.json.gz'
+            response.headers['Content-Type'] = 'application/gzip'
+        else:
+            response.headers['Content-Disposition'] = 'attachment; filename=character_progress.json'
+            response.headers['Content-Type'] = 'application/json; charset=utf-8'
         
         return response
     except Exception as e:
@@ -927,23 +1080,17 @@ def export_known_characters():
         progress = UserProgress.query.filter_by(user_id=current_user.id, familiarity=2).all()
         characters = []
         
+        catalog = get_catalog()
         for p in progress:
-            character = Character.query.get(p.character_id)
+            character = catalog.get(p.character_id)
             if character:
-                characters.append(character.hanzi)
+                characters.append(character)
         
         # Sort characters by frequency (most common first)
-        characters_with_rank = []
-        for char in characters:
-            character = Character.query.filter_by(hanzi=char).first()
-            if character:
-                characters_with_rank.append((char, character.rank))
-        
-        # Sort by rank (ascending)
-        characters_with_rank.sort(key=lambda x: x[1])
+        characters.sort(key=lambda c: c.rank)
         
         # Extract just the characters
-        sorted_characters = [char for char, _ in characters_with_rank]
+        sorted_characters = [c.hanzi for c in characters]
         
         # Create a text file with the characters
         characters_text = ''.join(sorted_characters)
@@ -958,239 +1105,116 @@ def export_known_characters():
         app.logger.error(f"Error exporting known characters: {e}")
         return jsonify({'error': 'An error occurred while exporting known characters'}), 500
 
+def _import_error(e):
+    """The 400 error message for an import that failed on the file's contents, or None for other errors."""
+    if isinstance(e, ProgressFormatError):
+        return 'Invalid progress data format'
+    if isinstance(e, snapshot.SnapshotError):
+        return f'Invalid snapshot: {e}'
+    if isinstance(e, ValueError):
+        return 'Invalid JSON format'
+    return None
+
 @app.route('/api/import-progress', methods=['POST'])
 @login_required
 def import_character_progress():
-    """Import character progress from a JSON file including all states"""
+    """Import character progress from a JSON file including all states
+
+    The file is parsed and written incrementally (see progress_import.py).
+    Binary snapshots from /api/export-progress?format=binary are accepted as
+    an uploaded file, or as the raw request body with their media type.
+
+    Query parameters:
+        async: 1 to run the import as a background job and get its id
+            (202) to poll at /api/jobs/<id>
+        stream: 1 to get newline-delimited JSON progress events instead of a single response
+        details: 0 to leave out the per-character results
+
+    With stream=1, a file that is invalid from the start (header or first
+    record) gets the same 400 JSON error as without it. Once the 200 stream
+    has started, every line is an event object; the last line is either a
+    "result" event (the import was committed) or {"type": "error", "error": ...}
+    (nothing was imported). A stream that ends without either was cut off and
+    must be treated as failed.
+    """
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file part'}), 400
-            
-        file = request.files['file']
-        
-        if file.filename == '':
-            return jsonify({'error': 'No selected file'}), 400
-            
-        if file:
-            # Read the file content
-            content = file.read().decode('utf-8')
-            
-            # Parse JSON
-            try:
-                progress_data = json.loads(content)
-            except json.JSONDecodeError:
-                return jsonify({'error': 'Invalid JSON format'}), 400
-            
-            # Validate format
-            if not isinstance(progress_data, dict):
-                return jsonify({'error': 'Invalid progress data format'}), 400
-            
-            # Get user_id from current_user
-            user_id = current_user.id
-
-            def apply_tuning_if_present():
-                tuning_data = progress_data.get("tuning")
-                if not tuning_data or not isinstance(tuning_data, dict):
-                    return
-
-                for hanzi, tuning in tuning_data.items():
-                    character = Character.query.filter_by(hanzi=hanzi).first()
-                    if not character:
-                        continue
-
-                    if isinstance(tuning, dict):
-                        rank_penalty = tuning.get("rank_penalty", 0)
-                    else:
-                        rank_penalty = tuning
-
-                    try:
-                        rank_penalty = int(rank_penalty)
-                    except (TypeError, ValueError):
-                        rank_penalty = 0
+        user_id = current_user.id
+        details = request.args.get('details', '1') != '0'
+        data = None  # Set to the snapshot bytes for binary imports
 
-                    record = UserCharacterTuning.query.filter_by(user_id=user_id, character_id=character.id).first()
-                    if not record:
-                        record = UserCharacterTuning(user_id=user_id, character_id=character.id, rank_penalty=0)
-                        db.session.add(record)
+        if request.mimetype == snapshot.MIMETYPE:
+            if (request.content_length or 0) > snapshot.MAX_BYTES:
+                return jsonify({'error': 'Snapshot is too large'}), 400
+            data = request.get_data()
+        else:
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file part'}), 400
+
+            file = request.files['file']
+
+            if file.filename == '':
+                return jsonify({'error': 'No selected file'}), 400
+
+            prefix = file.stream.read(len(snapshot.MAGIC))
+            file.stream.seek(0)
+            if (request.args.get('format') == 'binary' or file.mimetype == snapshot.MIMETYPE
+                    or snapshot.is_snapshot(prefix)):
+                data = file.stream.read(snapshot.MAX_BYTES + 1)
+                if len(data) > snapshot.MAX_BYTES:
+                    return jsonify({'error': 'Snapshot is too large'}), 400
+
+        binary = data is not None
+        queued = _enqueue_job('import-progress', lambda path: _import_file_events(user_id, path, details, binary),
+                              upload=io.BytesIO(data) if binary else file.stream)
+        if queued:
+            return queued
+
+        if binary:
+            events = import_snapshot(user_id, data, details=details)
+        else:
+            events = import_progress(user_id, file.stream, details=details)
 
-                    record.rank_penalty = rank_penalty
-            
-            # Process results
-            results = {
-                'success': 0,
-                'failed': 0,
-                'not_found': 0,
-                'know': 0,
-                'unsure': 0,
-                'dont_know': 0,
-                'details': []
-            }
-            
-            # Process detailed progress if available
-            if "detailed" in progress_data and isinstance(progress_data["detailed"], dict):
-                for hanzi, details in progress_data["detailed"].items():
-                    character = Character.query.filter_by(hanzi=hanzi).first()
-                    if not character:
-                        results['not_found'] += 1
-                        results['details'].append({
-                            'character': hanzi,
-                            'status': 'not_found'
-                        })
-                        continue
-                    
-                    try:
-                        # Find existing progress record or create a new one
-                        progress = UserProgress.query.filter_by(user_id=user_id, character_id=character.id).first()
-                        
-                        if not progress:
-                            progress = UserProgress(
-                                user_id=user_id,
-                                character_id=character.id
-                            )
-                            db.session.add(progress)
-                        
-                        # Update with detailed information
-                        progress.familiarity = details.get("familiarity", 0)
-                        progress.review_count = details.get("review_count", 0)
-                        progress.know_count = details.get("know_count", 0)
-                        progress.unsure_count = details.get("unsure_count", 0)
-                        progress.dont_know_count = details.get("dont_know_count", 0)
-                        
-                        # Parse last_reviewed if available
-                        if "last_reviewed" in details:
-                            try:
-                                progress.last_reviewed = datetime.fromisoformat(details["last_reviewed"])
-                            except ValueError:
-                                progress.last_reviewed = datetime.utcnow()
-                        else:
-                            progress.last_reviewed = datetime.utcnow()
-                        
-                        results['success'] += 1
-                        
-                        # Increment the appropriate category counter
-                        if progress.familiarity == 2:
-                            results['know'] += 1
-                        elif progress.familiarity == 1:
-                            results['unsure'] += 1
-                        elif progress.familiarity == 0:
-                            results['dont_know'] += 1
-                            
-                        results['details'].append({
-                            'character': hanzi,
-                            'status': 'success',
-                            'familiarity': progress.familiarity
-                        })
-                    except Exception as e:
-                        app.logger.error(f"Error importing detailed progress for {hanzi}: {e}")
-                        results['failed'] += 1
-                        results['details'].append({
-                            'character': hanzi,
-                            'status': 'failed'
-                        })
-
-                apply_tuning_if_present()
-                db.session.commit()
-                
-                # If detailed progress was processed, return early
-                return jsonify({
-                    'success': True,
-                    'message': f"Successfully imported {results['success']} characters ({results['know']} known, {results['unsure']} unsure, {results['dont_know']} don't know). {results['not_found']} not found, {results['failed']} failed.",
-                    'results': results
-                })
-            
-            # Fall back to processing simple lists if no detailed information
-            # Process "know" characters (familiarity = 2)
-            if "know" in progress_data and isinstance(progress_data["know"], list):
-                for char in progress_data["know"]:
-                    character = Character.query.filter_by(hanzi=char).first()
-                    if not character:
-                        results['not_found'] += 1
-                        results['details'].append({
-                            'character': char,
-                            'status': 'not_found'
-                        })
-                        continue
-                    
-                    success = update_progress(user_id, character.id, 2)
-                    if success:
-                        results['success'] += 1
-                        results['know'] += 1
-                        results['details'].append({
-                            'character': char,
-                            'status': 'success',
-                            'familiarity': 'know'
-                        })
-                    else:
-                        results['failed'] += 1
-                        results['details'].append({
-                            'character': char,
-                            'status': 'failed'
-                        })
-            
-            # Process "unsure" characters (familiarity = 1)
-            if "unsure" in progress_data and isinstance(progress_data["unsure"], list):
-                for char in progress_data["unsure"]:
-                    character = Character.query.filter_by(hanzi=char).first()
-                    if not character:
-                        results['not_found'] += 1
-                        results['details'].append({
-                            'character': char,
-                            'status': 'not_found'
-                        })
-                        continue
-                    
-                    success = update_progress(user_id, character.id, 1)
-                    if success:
-                        results['success'] += 1
-                        results['unsure'] += 1
-                        results['details'].append({
-                            'character': char,
-                            'status': 'success',
-                            'familiarity': 'unsure'
-                        })
-                    else:
-                        results['failed'] += 1
-                        results['details'].append({
-                            'character': char,
-                            'status': 'failed'
-                        })
-            
-            # Process "dont_know" characters (familiarity = 0)
-            if "dont_know" in progress_data and isinstance(progress_data["dont_know"], list):
-                for char in progress_data["dont_know"]:
-                    character = Character.query.filter_by(hanzi=char).first()
-                    if not character:
-                        results['not_found'] += 1
-                        results['details'].append({
-                            'character': char,
-                            'status': 'not_found'
-                        })
-                        continue
-                    
-                    success = update_progress(user_id, character.id, 0)
-                    if success:
-                        results['success'] += 1
-                        results['dont_know'] += 1
-                        results['details'].append({
-                            'character': char,
-                            'status': 'success',
-                            'familiarity': 'dont_know'
-                        })
-                    else:
-                        results['failed'] += 1
-                        results['details'].append({
-                            'character': char,
-                            'status': 'failed'
-                        })
-
-            apply_tuning_if_present()
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': f"Successfully imported {results['success']} characters ({results['know']} known, {results['unsure']} unsure, {results['dont_know']} don't know). {results['not_found']} not found, {results['failed']} failed.",
-                'results': results
-            })
+        # Reading the first event parses the header and first record (or the
+        # whole snapshot header), so a bad file is rejected before any response starts
+        try:
+            first = next(events)
+        except Exception as e:
+            error = _import_error(e)
+            if error is None:
+                raise
+            return jsonify({'error': error}), 400
+        events = itertools.chain([first], events)
+
+        if request.args.get('stream') == '1':
+            def generate():
+                try:
+                    for event in events:
+                        yield json.dumps(event, ensure_ascii=False) + '\n'
+                except ValueError as e:
+                    yield json.dumps({'type': 'error', 'error': f'Invalid progress file: {e}'}) + '\n'
+                except Exception as e:
+                    app.logger.error(f"Error importing character progress: {e}")
+                    yield json.dumps({'type': 'error', 'error': 'An error occurred during progress import'}) + '\n'
+
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        detail_list = []
+        result = None
+        try:
+            for event in events:
+                if event['type'] == 'detail':
+                    detail_list.append({k: v for k, v in event.items() if k != 'type'})
+                elif event['type'] == 'result':
+                    result = event
+        except ValueError as e:
+            return jsonify({'error': _import_error(e)}), 400
+
+        result['results']['details'] = detail_list
+        return jsonify({
+            'success': True,
+            'message': result['message'],
+            'results': result['results']
+        })
     except Exception as e:
         app.logger.error(f"Error importing character progress: {e}")
         return jsonify({'error': 'An error occurred during progress import'}), 500
@@ -1198,7 +1222,7 @@ def import_character_progress():
 @app.route('/api/import-file', methods=['POST'])
 @login_required
 def import_characters_from_file():
-    """Import characters from an uploaded text file"""
+    """Import characters from an uploaded text file (?async=1 runs it as a background job)"""
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file part'}), 400
@@ -1231,34 +1255,13 @@ def import_characters_from_file():
             
             # Remove duplicates
             unique_characters = list(set(characters))
-            
-            for char in unique_characters:
-                # Find the character in the database
-                character = Character.query.filter_by(hanzi=char).first()
-                
-                if not character:
-                    results['not_found'] += 1
-                    results['details'].append({
-                        'character': char,
-                        'status': 'not_found'
-                    })
-                    continue
-                
-                # Mark as known (familiarity = 2)
-                success = update_progress(user_id, character.id, 2)
-                
-                if success:
-                    results['success'] += 1
-                    results['details'].append({
-                        'character': char,
-                        'status': 'success'
-                    })
-                else:
-                    results['failed'] += 1
-                    results['details'].append({
-                        'character': char,
-                        'status': 'failed'
-                    })
+
+            queued = _enqueue_job('import-file', lambda path: _character_import_events(user_id, unique_characters, 2))
+            if queued:
+                return queued
+
+            # Mark as known (familiarity = 2)
+            results.update(_import_characters(user_id, unique_characters, 2))
             
             return jsonify({
                 'success': True,
@@ -1273,21 +1276,27 @@ def import_characters_from_file():
 @login_required
 def get_stats():
     """Get user statistics"""
-    total_characters = Character.query.count()
-    reviewed_characters = UserProgress.query.filter_by(user_id=current_user.id).count()
-    
-    know_count = UserProgress.query.filter_by(user_id=current_user.id, familiarity=2).count()
-    unsure_count = UserProgress.query.filter_by(user_id=current_user.id, familiarity=1).count()
-    dont_know_count = UserProgress.query.filter_by(user_id=current_user.id, familiarity=0).count()
+    stats = get_user_stats(current_user.id)
     
     return jsonify({
-        'total_characters': total_characters,
-        'reviewed_characters': reviewed_characters,
-        'know_count': know_count,
-        'unsure_count': unsure_count,
-        'dont_know_count': dont_know_count
+        'total_characters': len(get_catalog()),
+        'reviewed_characters': stats.reviewed_count,
+        'know_count': stats.know_count,
+        'unsure_count': stats.unsure_count,
+        'dont_know_count': stats.dont_know_count
     })
 
+@app.route('/api/review-history', methods=['GET'])
+@login_required
+def get_review_history_endpoint():
+    """Daily review counts for learning-curve and retention charts.
+
+    Query parameters:
+        days: number of days to return, ending today (1-365, default 90)
+    """
+    days = max(1, min(365, request.args.get('days', 90, type=int)))
+    return jsonify({'days': get_review_history(current_user.id, days)})
+
 @app.route('/import-export')
 @login_required
 def import_export_page():
@@ -1312,6 +1321,7 @@ def test_unknown_chars_page():
 def grammar_analysis():
     """Stream Chinese text grammar analysis: each annotated chunk is sent as newline-delimited JSON."""
     import json as json_module
+    import requests
 
     data = request.get_json()
     if not data or not data.get('text', '').strip():
@@ -1417,7 +1427,7 @@ def grammar_analysis():
                 if info:
                     familiarity = progress_map.get(info['id'], 0)
                     raw_pinyin = info['pinyin']
-                    converted_pinyin = '/'.join(_numbered_to_tonemarks(p.strip()) for p in raw_pinyin.split('/')) if raw_pinyin else ''
+                    converted_pinyin = '/'.join(numbered_to_tonemarks(p.strip()) for p in raw_pinyin.split('/')) if raw_pinyin else ''
                     chars.append({'id': info['id'], 'hanzi': ch, 'pinyin': converted_pinyin, 'meaning': info['meaning'], 'familiarity': familiarity})
                 else:
                     chars.append({'id': None, 'hanzi': ch, 'pinyin': '', 'meaning': '', 'familiarity': 0})
@@ -1425,22 +1435,18 @@ def grammar_analysis():
         return chunk
 
     # Pre-load character and progress data within request context
-    from models import Character as CharModel, UserProgress
     user_id = current_user.id
 
-    # We need all hanzi from the text to pre-fetch DB rows
+    # We need all hanzi from the text to pre-fetch catalog rows
     all_hanzi = set()
     for ch in text:
         if '\u4e00' <= ch <= '\u9fff':
             all_hanzi.add(ch)
-    char_rows = CharModel.query.filter(CharModel.hanzi.in_(all_hanzi)).all() if all_hanzi else []
+    catalog = get_catalog()
+    char_rows = [c for c in (catalog.by_hanzi(h) for h in all_hanzi) if c]
     char_map = {c.hanzi: {'id': c.id, 'pinyin': c.pinyin, 'meaning': c.meaning} for c in char_rows}
-    char_ids = [info['id'] for info in char_map.values()]
-    progress_rows = UserProgress.query.filter(
-        UserProgress.user_id == user_id,
-        UserProgress.character_id.in_(char_ids)
-    ).all() if char_ids else []
-    progress_map = {p.character_id: p.familiarity for p in progress_rows}
+    familiarity = get_familiarity_vector(user_id)
+    progress_map = {c.id: familiarity[c.id] for c in char_rows if c.id in familiarity}
 
     batches = _split_into_batches(text)
     app.logger.info(f"Grammar analysis (streaming): {len(text)} chars → {len(batches)} batch(es)")
@@ -1487,12 +1493,15 @@ def character_familiarity():
         ids = data.get('ids', []) if data else []
         if not ids:
             return jsonify({'familiarity': {}})
-        from models import UserProgress
-        rows = UserProgress.query.filter(
-            UserProgress.user_id == current_user.id,
-            UserProgress.character_id.in_(ids)
-        ).all()
-        result = {str(r.character_id): r.familiarity for r in rows}
+        character_ids = [_character_id(char_id) for char_id in ids]
+        if None in character_ids:
+            return jsonify({'error': 'Invalid character id'}), 400
+        familiarity = get_familiarity_vector(current_user.id)
+        result = {}
+        for char_id, character_id in zip(ids, character_ids):
+            value = familiarity.get(character_id)
+            if value is not None:
+                result[str(char_id)] = value
         return jsonify({'familiarity': result})
     except Exception as e:
         app.logger.error(f"Error fetching familiarity: {e}")
@@ -1507,59 +1516,7 @@ def annotate_text():
         if not data or not data.get('text', '').strip():
             return jsonify({'error': 'Please enter some Chinese text'}), 400
 
-        text = data['text'].strip()
-        tokens = list(jieba.cut(text))
-        result = []
-
-        for tok in tokens:
-            if not _is_chinese_token(tok):
-                result.append({'token': tok, 'type': 'punctuation'})
-                continue
-
-            entry = _cccedict.get_entry(tok)
-            if entry:
-                pinyin_raw = entry.get('pinyin', '')
-                pinyin = _numbered_to_tonemarks(pinyin_raw) if pinyin_raw else ''
-                defs = entry.get('definitions', [])
-                result.append({
-                    'token': tok,
-                    'type': 'chinese',
-                    'pinyin': pinyin,
-                    'definitions': defs
-                })
-            else:
-                # No entry for the whole token — split into individual characters
-                if len(tok) > 1:
-                    for ch in tok:
-                        if not _is_chinese_token(ch):
-                            result.append({'token': ch, 'type': 'punctuation'})
-                            continue
-                        ch_entry = _cccedict.get_entry(ch)
-                        if ch_entry:
-                            ch_pinyin_raw = ch_entry.get('pinyin', '')
-                            ch_pinyin = _numbered_to_tonemarks(ch_pinyin_raw) if ch_pinyin_raw else ''
-                            result.append({
-                                'token': ch,
-                                'type': 'chinese',
-                                'pinyin': ch_pinyin,
-                                'definitions': ch_entry.get('definitions', [])
-                            })
-                        else:
-                            result.append({
-                                'token': ch,
-                                'type': 'chinese',
-                                'pinyin': '',
-                                'definitions': []
-                            })
-                else:
-                    result.append({
-                        'token': tok,
-                        'type': 'chinese',
-                        'pinyin': '',
-                        'definitions': []
-                    })
-
-        return jsonify({'tokens': result})
+        return jsonify({'tokens': _annotate_tokens(data['text'].strip())})
     except Exception as e:
         app.logger.error(f"Error annotating text: {e}")
         return jsonify({'error': 'An error occurred while annotating text'}), 500
@@ -1598,54 +1555,31 @@ def debug_db_status():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/debug/query-plans')
+def debug_query_plans():
+    """Debug route showing whether the hot queries are served by an index"""
+    from query_plans import check_query_plans
+    try:
+        results = check_query_plans(db.session)
+        return jsonify({
+            'dialect': db.engine.dialect.name,
+            'all_indexed': all(r['uses_index'] for r in results),
+            'queries': results
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/debug/load-characters')
 def debug_load_characters():
-    """Manually trigger character loading from characters.txt into the database."""
-    from sqlalchemy import text
+    """Apply pending migrations, which seed an empty character table from characters.txt."""
     try:
-        db.create_all()
-        # Widen columns if they are still VARCHAR(100)/VARCHAR(50) from old schema
-        try:
-            db.session.execute(text('ALTER TABLE character ALTER COLUMN meaning TYPE TEXT'))
-            db.session.execute(text('ALTER TABLE character ALTER COLUMN pinyin TYPE VARCHAR(200)'))
-            db.session.commit()
-        except Exception:
-            db.session.rollback()  # already the right type, ignore
-        char_count = Character.query.count()
-        if char_count > 0:
-            return jsonify({'message': f'Database already has {char_count} characters, no action needed.'})
-
-        characters_file = os.path.join(os.path.dirname(__file__), 'characters.txt')
-        if not os.path.exists(characters_file):
-            return jsonify({'error': f'characters.txt not found at {characters_file}'}), 404
-
-        with open(characters_file, 'r', encoding='utf-8') as f:
-            count = 0
-            for line in f:
-                parts = line.strip().split('\t')
-                if len(parts) >= 5:
-                    try:
-                        rank = int(parts[0])
-                        hanzi = parts[1]
-                        frequency = int(float(parts[2]))
-                        pinyin_with_meaning = parts[4:]
-                        pinyin = pinyin_with_meaning[0].split()[0]
-                        meaning = ' '.join(pinyin_with_meaning[0].split()[1:])
-                        if len(pinyin_with_meaning) > 1:
-                            meaning += ' ' + ' '.join(pinyin_with_meaning[1:])
-                        meaning = meaning.strip()
-                        character = Character(
-                            hanzi=hanzi, pinyin=pinyin, meaning=meaning,
-                            frequency=frequency, rank=rank
-                        )
-                        db.session.add(character)
-                        count += 1
-                    except Exception as e:
-                        pass  # skip bad lines
-
-        db.session.commit()
-        final_count = Character.query.count()
-        return jsonify({'loaded': count, 'verified_in_db': final_count})
+        applied = migrate()
+        reset_catalog()
+        return jsonify({'migrations_applied': applied, 'verified_in_db': Character.query.count()})
+    except FileNotFoundError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -1673,112 +1607,137 @@ def debug_oauth_uri():
     
     return jsonify(debug_info)
 
-_db_initialized = False
-
-@app.before_request
-def ensure_db_initialized():
-    """Create tables and load characters on the very first request (works reliably under gunicorn)."""
-    global _db_initialized
-    if _db_initialized:
-        return
-    _db_initialized = True
-
-    print("=== DB initialization (first request) ===")
-    from sqlalchemy import text
-
-    # Check if we're in development or production
+def run_migrations():
+    """Apply pending schema migrations (see migrations.py). Call once per deploy, in an app context."""
     is_dev_mode = not is_production and os.environ.get('FLASK_ENV') != 'production'
-
     if is_dev_mode and os.environ.get('RESET_DB') == 'true':
         print("Development mode with RESET_DB=true: Dropping all tables to update schema...")
         db.drop_all()
-        db.create_all()
-    else:
-        print("Creating tables if they don't exist...")
-        db.create_all()
-
-    # Widen columns if they are still VARCHAR(100)/VARCHAR(50) from old schema
-    try:
-        db.session.execute(text('ALTER TABLE character ALTER COLUMN meaning TYPE TEXT'))
-        db.session.execute(text('ALTER TABLE character ALTER COLUMN pinyin TYPE VARCHAR(200)'))
-        db.session.commit()
-        print("Widened meaning/pinyin columns")
-    except Exception:
-        db.session.rollback()
-
-    # Add encrypted_api_key column to user table if missing
-    try:
-        db.session.execute(text("ALTER TABLE \"user\" ADD COLUMN encrypted_api_key TEXT"))
-        db.session.commit()
-        print("Added encrypted_api_key column to user table")
-    except Exception:
-        db.session.rollback()
-
-    # Add translation_popups column to user table if missing
-    try:
-        db.session.execute(text("ALTER TABLE \"user\" ADD COLUMN translation_popups BOOLEAN NOT NULL DEFAULT TRUE"))
-        db.session.commit()
-        print("Added translation_popups column to user table")
-    except Exception:
-        db.session.rollback()
+    start = time.perf_counter()
+    with startup.phase('migrations'):
+        applied = migrate()
+    if applied:
+        reset_catalog()
+    print(f"Applied {len(applied)} migrations in {time.perf_counter() - start:.2f}s")
+    return applied
+
+def preload_caches():
+    """Load the read-only data every request path shares: the character catalog, CC-CEDICT and jieba's dictionary."""
+    start = time.perf_counter()
+    with startup.phase('character catalog'):
+        get_catalog()
+    with startup.phase('CC-CEDICT'):
+        get_dictionary()
+    with startup.phase('jieba'):
+        import jieba
+        jieba.initialize()
+    print(f"Preloaded caches in {time.perf_counter() - start:.2f}s")
+
+def _preload_in_background():
+    with app.app_context():
+        try:
+            preload_caches()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error preloading caches: {e}")
+        if startup.STARTUP_REPORT:
+            startup.report('Worker startup')
+
+def warmup(background=False):
+    """Get a worker process ready to serve: start its background threads and preload caches.
+
+    Run in each worker after it is forked (gunicorn.conf.py), in an app context.
+    With background=True the caches are loaded on a separate thread while the
+    worker already serves; a request that needs one first loads it itself.
+    Servers that skip it (`flask run`) still work: the write-behind queue and
+    the job runner are also started by the first request that uses them.
+    """
+    if review_queue is not None:
+        review_queue.start(app)
+    if job_runner is not None:
+        job_runner.start(app)
+    if background:
+        threading.Thread(target=_preload_in_background, name='warmup', daemon=True).start()
+        return
+    preload_caches()
+    if startup.STARTUP_REPORT:
+        startup.report()
+
+@app.cli.command('migrate')
+@click.option('--check', is_flag=True, help='Only list the migrations this database has not had yet; exit with status 1 if there are any.')
+def migrate_command(check):
+    """Create or upgrade the schema and seed the character table."""
+    if not check:
+        run_migrations()
+        return
+    pending = pending_migrations()
+    for version, name in pending:
+        print(f"Pending migration {version}: {name}")
+    if pending:
+        raise SystemExit(1)
+    print("No pending migrations")
+
+@app.cli.command('warmup')
+def warmup_command():
+    """Preload the caches workers use and print how long each startup phase took."""
+    preload_caches()
+    startup.report()
+
+@app.cli.command('repair-stats')
+def repair_stats_command():
+    """Recompute every user's statistics counters from their progress rows."""
+    count = recompute_user_stats()
+    db.session.commit()
+    print(f"Recomputed statistics for {count} users")
 
-    # Initialize the database with characters from characters.txt
-    try:
-        char_count = Character.query.count()
-        print(f"Characters currently in database: {char_count}")
-        if char_count == 0:
-            print("Initializing database with characters from characters.txt...")
-            characters_file = os.path.join(os.path.dirname(__file__), 'characters.txt')
-            print(f"Looking for characters file at: {characters_file}")
-
-            if os.path.exists(characters_file):
-                print("Characters file found, loading data...")
-                with open(characters_file, 'r', encoding='utf-8') as f:
-                    count = 0
-                    for line in f:
-                        parts = line.strip().split('\t')
-                        if len(parts) >= 5:
-                            try:
-                                rank = int(parts[0])
-                                hanzi = parts[1]
-                                frequency = int(float(parts[2]))
-
-                                pinyin_with_meaning = parts[4:]
-                                pinyin = pinyin_with_meaning[0].split()[0]
-
-                                meaning = ' '.join(pinyin_with_meaning[0].split()[1:])
-                                if len(pinyin_with_meaning) > 1:
-                                    meaning += ' ' + ' '.join(pinyin_with_meaning[1:])
-                                meaning = meaning.strip()
-
-                                if count < 5:
-                                    print(f"Parsed: Rank={rank}, Hanzi='{hanzi}', Pinyin='{pinyin}', Meaning='{meaning}'")
-
-                                character = Character(
-                                    hanzi=hanzi,
-                                    pinyin=pinyin,
-                                    meaning=meaning,
-                                    frequency=frequency,
-                                    rank=rank
-                                )
-                                db.session.add(character)
-                                count += 1
-                            except Exception as e:
-                                print(f"Error parsing line: {line.strip()}, Error: {e}")
-
-                db.session.commit()
-                final_count = Character.query.count()
-                print(f"Committed {count} characters. Verified count in DB: {final_count}")
-            else:
-                print(f"WARNING: characters.txt file not found at {characters_file}")
-        else:
-            print(f"Database already has {char_count} characters, skipping import.")
-    except Exception as e:
-        print(f"ERROR initializing database with characters: {e}")
-        import traceback
-        traceback.print_exc()
-        db.session.rollback()
+@app.cli.command('rollup-reviews')
+@click.option('--full', is_flag=True, help='Rebuild every day instead of only the days since the last rollup.')
+def rollup_reviews_command(full):
+    """Aggregate review events into per-user daily rollups."""
+    count = rollup_reviews(since=date.min if full else None)
+    db.session.commit()
+    print(f"Wrote {count} daily review rollups")
+
+@app.cli.command('build-catalog')
+@click.option('--from-db', is_flag=True, help='Compile the character table instead of characters.txt (for databases seeded by older loaders).')
+@click.option('--output', default=None, help='Where to write the file (default: CATALOG_FILE).')
+def build_catalog_command(from_db, output):
+    """Compile the character catalog file that workers map at startup."""
+    path = output or models.CATALOG_FILE
+    if not path:
+        raise click.UsageError('CATALOG_FILE is empty; pass --output')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if from_db:
+        count = compile_catalog_from_db(path)
+    else:
+        # The seed loaders insert characters.txt in file order, so IDs are 1..n
+        count = compile_catalog(
+            (CatalogEntry(i, c.hanzi, c.rank, c.frequency, c.pinyin, c.meaning)
+             for i, c in enumerate(parse_characters(), start=1)),
+            path
+        )
+    print(f"Compiled {count} characters to {path}")
+
+@app.cli.command('build-dictionary')
+@click.option('--source', default=None, help='CC-CEDICT file, plain or gzipped (default: CEDICT_SOURCE, else the copy shipped with pycccedict). Workers only map files built from CEDICT_SOURCE.')
+@click.option('--output', default=None, help='Where to write the file (default: CEDICT_FILE).')
+def build_dictionary_command(source, output):
+    """Compile the CC-CEDICT file that workers map at startup."""
+    path = output or cedict.CEDICT_FILE
+    if not path:
+        raise click.UsageError('CEDICT_FILE is empty; pass --output')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    count = cedict.compile_dictionary(cedict.load(source), path, cedict.source_fingerprint(source))
+    print(f"Compiled {count} dictionary entries to {path}")
+
+startup.mark('routes and commands')
 
 if __name__ == '__main__':
+    # The reloader runs this file twice; migrate in the watching parent, serve from the child
+    with app.app_context():
+        if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+            run_migrations()
+        else:
+            warmup()
     port = int(os.environ.get('PORT', 8093))
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,130 @@
+"""Benchmark CC-CEDICT lookups for annotation: pycccedict's get_entry path vs cedict.py.
+
+Run `python bench_cedict.py` to time loading the dictionaries (pycccedict,
+cedict.py parsing the source, and the compiled file) and looking up every
+jieba token of a long text (with the fallback for tokens that are not
+headwords), or `python bench_cedict.py file.txt` to annotate that file
+instead of the built-in sample.
+"""
+import os
+import re
+import sys
+import tempfile
+import time
+
+import jieba
+from pycccedict.cccedict import CcCedict
+
+import cedict
+
+SAMPLE = (
+    "我来到北京清华大学，想学习自然语言处理和机器学习。"
+    "今天天气很好，我们一起去公园散步吧。他说这本书非常有意思，值得一读。"
+    "随着经济的快速发展，越来越多的年轻人选择到大城市工作和生活。"
+    "中华人民共和国成立于一九四九年，首都是北京。"
+) * 200
+
+_TONE_MARKS = {
+    'a': 'āáǎà', 'e': 'ēéěè', 'i': 'īíǐì',
+    'o': 'ōóǒò', 'u': 'ūúǔù', 'ü': 'ǖǘǚǜ',
+}
+
+
+def old_tonemarks(s):
+    """The per-lookup conversion annotation used before, without cedict.py's syllable cache."""
+    def convert(m):
+        syllable = m.group(1).lower()
+        tone = int(m.group(2))
+        if tone == 5 or tone == 0:
+            return syllable
+        for v in ('a', 'e'):
+            if v in syllable:
+                return syllable.replace(v, _TONE_MARKS[v][tone - 1])
+        if 'ou' in syllable:
+            return syllable.replace('o', _TONE_MARKS['o'][tone - 1])
+        for idx in range(len(syllable) - 1, -1, -1):
+            ch = syllable[idx]
+            if ch in _TONE_MARKS:
+                return syllable[:idx] + _TONE_MARKS[ch][tone - 1] + syllable[idx + 1:]
+        return syllable
+    return re.sub(r'([a-züA-ZÜ]+)([0-5])', convert, s.replace('v', 'ü'))
+
+
+def is_chinese(s):
+    return any('\u4e00' <= ch <= '\u9fff' for ch in s)
+
+
+def old_lookup(cc, tokens):
+    """What both annotation endpoints did before: get_entry per token, then per character on a miss."""
+    found = 0
+    for tok in tokens:
+        if not is_chinese(tok):
+            continue
+        entry = cc.get_entry(tok)
+        if entry:
+            old_tonemarks(entry.get('pinyin', ''))
+            found += 1
+        elif len(tok) > 1:
+            for ch in tok:
+                ch_entry = cc.get_entry(ch) if is_chinese(ch) else None
+                if ch_entry:
+                    old_tonemarks(ch_entry.get('pinyin', ''))
+                    found += 1
+    return found
+
+
+def new_lookup(dictionary, tokens):
+    found = 0
+    for tok in tokens:
+        if not is_chinese(tok):
+            continue
+        entry = dictionary.get(tok)
+        pieces = [(tok, entry)] if entry is not None or len(tok) == 1 else dictionary.segment(tok)
+        found += sum(1 for _, entry in pieces if entry is not None)
+    return found
+
+
+def best(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def run(text, repeat=5):
+    start = time.perf_counter()
+    cc = CcCedict()
+    print(f"load pycccedict: {time.perf_counter() - start:.3f}s")
+    start = time.perf_counter()
+    dictionary = cedict.load()
+    print(f"load cedict.py: {time.perf_counter() - start:.3f}s ({len(dictionary)} entries)")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'cedict.bin')
+        start = time.perf_counter()
+        cedict.compile_dictionary(dictionary, path)
+        print(f"compile: {time.perf_counter() - start:.3f}s ({os.path.getsize(path) / 1e6:.1f} MB)")
+        start = time.perf_counter()
+        mapped = cedict.MappedCedict(path)
+        print(f"map compiled: {time.perf_counter() - start:.4f}s")
+        _lookups(cc, dictionary, mapped, text, repeat)
+
+
+def _lookups(cc, dictionary, mapped, text, repeat):
+    tokens = list(jieba.cut(text))
+    print(f"{len(text)} characters, {len(tokens)} jieba tokens")
+    for name, lookup in (('get_entry', lambda: old_lookup(cc, tokens)),
+                         ('cedict.py', lambda: new_lookup(dictionary, tokens)),
+                         ('compiled', lambda: new_lookup(mapped, tokens))):
+        elapsed, found = best(lookup, repeat)
+        print(f"{name}: best {elapsed * 1000:.1f}ms of {repeat}, {found} dictionary hits, "
+              f"{elapsed / len(tokens) * 1e6:.2f}us per token")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as f:
+            run(f.read())
+    else:
+        run(SAMPLE)
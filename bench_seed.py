@@ -0,0 +1,59 @@
+"""Benchmark seeding the character table: the old row-by-row ORM path vs character_seed.
+
+Run `python bench_seed.py` to compare both on a temporary SQLite database,
+or `python bench_seed.py postgresql://...` to use a scratch database instead.
+The character table of that database is emptied before every run.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from flask import Flask
+
+from character_seed import parse_characters, load_characters
+from models import db, Character
+
+
+def orm_seed(session, characters):
+    """What the loaders did before: one ORM object per row."""
+    for c in characters:
+        session.add(Character(hanzi=c.hanzi, pinyin=c.pinyin, meaning=c.meaning, frequency=c.frequency, rank=c.rank))
+    return len(characters)
+
+
+def bulk_seed(session, characters):
+    return load_characters(session, characters)
+
+
+def run(url, repeat=3):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        characters = parse_characters()
+        print(f"parse: {len(characters)} characters in {time.perf_counter() - start:.3f}s")
+
+        for name, seed in (('orm', orm_seed), ('bulk', bulk_seed)):
+            timings = []
+            for _ in range(repeat):
+                Character.query.delete()
+                db.session.commit()
+                start = time.perf_counter()
+                seed(db.session, characters)
+                db.session.commit()
+                timings.append(time.perf_counter() - start)
+            print(f"{name}: best {min(timings):.3f}s of {repeat} ({db.engine.dialect.name})")
+
+        Character.query.delete()
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            run('sqlite:///' + os.path.join(directory, 'bench.db'))
@@ -0,0 +1,244 @@
+import functools
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+
+class CatalogEntry:
+    """Read-only copy of one Character row."""
+    __slots__ = ('id', 'hanzi', 'rank', 'frequency', 'pinyin', 'meaning', 'cumulative')
+
+    def __init__(self, id, hanzi, rank, frequency, pinyin, meaning, cumulative=None):
+        self.id = id
+        self.hanzi = hanzi
+        self.rank = rank
+        self.frequency = frequency
+        self.pinyin = pinyin
+        self.meaning = meaning
+        self.cumulative = cumulative  # Percentage of the corpus covered up to this rank (compiled catalogs only)
+
+    def __repr__(self):
+        return f'<CatalogEntry {self.hanzi}>'
+
+
+class Catalog:
+    """Rank-ordered, immutable view of the Character table.
+
+    The character list never changes at runtime, so it is loaded once per
+    process and shared by every request instead of being re-queried.
+    """
+
+    def __init__(self, entries):
+        self.entries = tuple(sorted(entries, key=lambda e: (e.rank, e.id)))
+        self._by_id = {e.id: e for e in self.entries}
+        self._positions = {e.id: i for i, e in enumerate(self.entries)}
+        # Columns in rank order, for scans that only need IDs and ranks
+        self.ids = tuple(e.id for e in self.entries)
+        self.ranks = tuple(e.rank for e in self.entries)
+        self._by_hanzi = {}
+        self._by_rank = {}
+        for e in self.entries:
+            # Keep the most common entry if a hanzi appears more than once
+            self._by_hanzi.setdefault(e.hanzi, e)
+            self._by_rank.setdefault(e.rank, e)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def get(self, character_id):
+        return self._by_id.get(character_id)
+
+    def position(self, character_id):
+        """Index of a character in rank order, or None if unknown."""
+        return self._positions.get(character_id)
+
+    def by_hanzi(self, hanzi):
+        return self._by_hanzi.get(hanzi)
+
+    def by_rank(self, rank):
+        return self._by_rank.get(rank)
+
+    def top(self, n):
+        """Return the n most common entries."""
+        return self.entries[:n]
+
+
+# Compiled catalog file: a header, fixed-width records in rank order, u32
+# columns and indexes, then a UTF-8 heap holding the hanzi/pinyin/meaning
+# strings. All little-endian.
+CATALOG_MAGIC = b'CCAT'
+CATALOG_VERSION = 1
+# magic, version, (reserved), count, fingerprint, then the offsets of the
+# records, the sections in _SECTIONS order and the string heap
+_SECTIONS = ('ids', 'ranks', 'sorted_ids', 'id_positions', 'hanzi_index')
+_HEADER = struct.Struct('<4sHHIQI' + 'I' * len(_SECTIONS) + 'I')
+# id, rank, frequency, cumulative %, then (offset, length) of hanzi, pinyin and meaning in the heap
+_RECORD = struct.Struct('<IIIdIIIIII')
+_HANZI_FIELD = struct.Struct('<20xII')
+
+
+def compile_catalog(entries, path):
+    """Write entries (objects with id, hanzi, rank, frequency, pinyin, meaning) as a compiled catalog file.
+
+    The file is written next to `path` and renamed into place, so processes
+    mapping the old file keep a consistent view.
+    """
+    entries = sorted(entries, key=lambda e: (e.rank, e.id))
+    total = sum(e.frequency or 0 for e in entries)
+    heap = bytearray()
+    records = bytearray()
+    hanzi_bytes = []
+    running = 0
+    for e in entries:
+        running += e.frequency or 0
+        fields = []
+        for text in (e.hanzi, e.pinyin or '', e.meaning or ''):
+            data = text.encode('utf-8')
+            fields += [len(heap), len(data)]
+            heap += data
+        hanzi_bytes.append(e.hanzi.encode('utf-8'))
+        records += _RECORD.pack(e.id, e.rank or 0, e.frequency or 0, running * 100.0 / total if total else 0.0, *fields)
+
+    positions = range(len(entries))
+    by_id = sorted(positions, key=lambda i: entries[i].id)
+    sections = {
+        'ids': array('I', (e.id for e in entries)),
+        'ranks': array('I', (e.rank or 0 for e in entries)),
+        'sorted_ids': array('I', (entries[i].id for i in by_id)),
+        'id_positions': array('I', by_id),
+        # Ties keep rank order, so a lookup finds the most common entry for a hanzi
+        'hanzi_index': array('I', sorted(positions, key=lambda i: (hanzi_bytes[i], i))),
+    }
+    offsets = [_HEADER.size]
+    blocks = [records]
+    for name in _SECTIONS:
+        column = sections[name]
+        if sys.byteorder != 'little':
+            column.byteswap()
+        offsets.append(offsets[-1] + len(blocks[-1]))
+        blocks.append(column.tobytes())
+    offsets.append(offsets[-1] + len(blocks[-1]))
+    blocks.append(heap)
+
+    # Checked against the character table before the file is used (see models.get_catalog)
+    fingerprint = sum(e.id * (e.rank or 0) for e in entries)
+    header = _HEADER.pack(CATALOG_MAGIC, CATALOG_VERSION, 0, len(entries), fingerprint, *offsets)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+class _MappedEntries:
+    """Sequence of the entries of a MappedCatalog, in rank order."""
+    __slots__ = ('_catalog',)
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def __len__(self):
+        return len(self._catalog)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._catalog._entry(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('catalog index out of range')
+        return self._catalog._entry(index)
+
+    def __iter__(self):
+        return map(self._catalog._entry, range(len(self)))
+
+
+class MappedCatalog:
+    """Catalog served from a compiled catalog file mapped read-only into memory.
+
+    Every process maps the same file, so the character data lives once in the
+    page cache instead of once per worker. Lookups binary-search the u32
+    columns in place; entries are decoded on access, with the most used ones
+    cached. Implements the same interface as Catalog.
+    """
+
+    def __init__(self, path, cache_size=4096):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            raise ValueError(f'{path} is not a compiled catalog')
+        magic, version, _, self._count, self.fingerprint, self._records_offset, *offsets = _HEADER.unpack_from(self._map)
+        if magic != CATALOG_MAGIC or version != CATALOG_VERSION:
+            raise ValueError(f'{path} is not a version {CATALOG_VERSION} compiled catalog')
+        if sys.byteorder != 'little':
+            raise ValueError('Compiled catalogs can only be mapped on little-endian machines')
+        view = memoryview(self._map)
+        columns = {name: view[offset:offset + self._count * 4].cast('I') for name, offset in zip(_SECTIONS, offsets)}
+        self.ids = columns['ids']
+        self.ranks = columns['ranks']
+        self._sorted_ids = columns['sorted_ids']
+        self._id_positions = columns['id_positions']
+        self._hanzi_index = columns['hanzi_index']
+        self._heap_offset = offsets[-1]
+        self._entry = functools.lru_cache(maxsize=cache_size)(self._read_entry)
+        self.entries = _MappedEntries(self)
+
+    def _string(self, offset, length):
+        start = self._heap_offset + offset
+        return self._map[start:start + length].decode('utf-8')
+
+    def _read_entry(self, pos):
+        (character_id, rank, frequency, cumulative, hanzi_offset, hanzi_length, pinyin_offset, pinyin_length,
+         meaning_offset, meaning_length) = _RECORD.unpack_from(self._map, self._records_offset + pos * _RECORD.size)
+        return CatalogEntry(character_id, self._string(hanzi_offset, hanzi_length), rank, frequency,
+                            self._string(pinyin_offset, pinyin_length), self._string(meaning_offset, meaning_length),
+                            cumulative)
+
+    def _hanzi_at(self, pos):
+        offset, length = _HANZI_FIELD.unpack_from(self._map, self._records_offset + pos * _RECORD.size)
+        start = self._heap_offset + offset
+        return self._map[start:start + length]
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def position(self, character_id):
+        """Index of a character in rank order, or None if unknown. Ids must be ints."""
+        i = bisect_left(self._sorted_ids, character_id)
+        if i < self._count and self._sorted_ids[i] == character_id:
+            return self._id_positions[i]
+        return None
+
+    def get(self, character_id):
+        pos = self.position(character_id)
+        return None if pos is None else self._entry(pos)
+
+    def by_hanzi(self, hanzi):
+        key = hanzi.encode('utf-8')
+        index = self._hanzi_index
+        i = bisect_left(index, key, key=self._hanzi_at)
+        if i < self._count and self._hanzi_at(index[i]) == key:
+            return self._entry(index[i])
+        return None
+
+    def by_rank(self, rank):
+        pos = bisect_left(self.ranks, rank)
+        if pos < self._count and self.ranks[pos] == rank:
+            return self._entry(pos)
+        return None
+
+    def top(self, n):
+        """Return the n most common entries."""
+        return self.entries[:n]
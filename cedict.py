@@ -0,0 +1,340 @@
+"""CC-CEDICT lookups for text annotation.
+
+Reads the dictionary file shipped with pycccedict, but normalizes every
+entry once at load time (tone-mark pinyin, stripped definitions) instead of
+on every lookup, and adds longest-match segmentation for tokens that are not
+headwords themselves.
+
+Workers normally use a compiled copy (CEDICT_FILE) that they map read-only,
+so the dictionary lives once in the page cache instead of once per process.
+"""
+import functools
+import gzip
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from pathlib import Path
+
+# CC-CEDICT source, by default the copy shipped with pycccedict
+CEDICT_SOURCE = os.environ.get('CEDICT_SOURCE')
+# Compiled dictionary mapped by every worker; set to an empty string to parse the source in each process instead
+CEDICT_FILE = os.environ.get('CEDICT_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'cedict.bin'))
+
+_TONE_MARKS = {
+    'a': 'āáǎà', 'e': 'ēéěè', 'i': 'īíǐì',
+    'o': 'ōóǒò', 'u': 'ūúǔù', 'ü': 'ǖǘǚǜ',
+}
+_SYLLABLE = re.compile(r'([a-züA-ZÜ]+)([0-5])')
+
+
+@functools.lru_cache(maxsize=None)  # There are only a few thousand distinct syllables
+def _mark_syllable(syllable, tone):
+    syllable = syllable.lower()
+    tone = int(tone)
+    if tone == 5 or tone == 0:
+        return syllable
+    for v in ('a', 'e'):
+        if v in syllable:
+            return syllable.replace(v, _TONE_MARKS[v][tone - 1])
+    if 'ou' in syllable:
+        return syllable.replace('o', _TONE_MARKS['o'][tone - 1])
+    for idx in range(len(syllable) - 1, -1, -1):
+        ch = syllable[idx]
+        if ch in _TONE_MARKS:
+            return syllable[:idx] + _TONE_MARKS[ch][tone - 1] + syllable[idx + 1:]
+    return syllable
+
+
+def numbered_to_tonemarks(s: str) -> str:
+    """Convert numbered pinyin like 'bei3 jing1' to tone marks like 'běi jīng'."""
+    s = s.replace('v', 'ü')
+    return _SYLLABLE.sub(lambda m: _mark_syllable(m.group(1), m.group(2)), s)
+
+
+class DictEntry:
+    """One CC-CEDICT entry, normalized for display."""
+    __slots__ = ('traditional', 'simplified', 'pinyin', 'definitions')
+
+    def __init__(self, traditional, simplified, pinyin, definitions):
+        self.traditional = traditional
+        self.simplified = simplified
+        self.pinyin = pinyin  # With tone marks
+        self.definitions = definitions  # Senses split on '/' and ';'
+
+    def __repr__(self):
+        return f'<DictEntry {self.simplified}>'
+
+
+class Cedict:
+    """Headword indexes over CC-CEDICT.
+
+    Like pycccedict, a simplified headword wins over a traditional one, and
+    the last of several entries with the same headword is used. The prefix
+    trie behind longest_match() is kept as the set of its nodes' paths (every
+    proper prefix of a headword), which is much smaller than nested dicts.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        by_traditional = {e.traditional: e for e in self.entries}
+        by_simplified = {e.simplified: e for e in self.entries}
+        self._index = by_traditional
+        self._index.update(by_simplified)
+        self._prefixes = {word[:i] for word in self._index for i in range(1, len(word))}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, word):
+        """The entry for a simplified or traditional headword, or None."""
+        return self._index.get(word)
+
+    def _lookup(self, piece):
+        """(entry or None, whether some longer headword starts with piece)."""
+        return self._index.get(piece), piece in self._prefixes
+
+    def longest_match(self, text, start=0):
+        """(end, entry) of the longest headword at text[start:], or (None, None)."""
+        end = entry = None
+        for stop in range(start + 1, len(text) + 1):
+            found, extends = self._lookup(text[start:stop])
+            if found is not None:
+                end, entry = stop, found
+            if not extends:
+                break
+        return end, entry
+
+    def segment(self, text):
+        """Split text into (piece, entry) by longest match; unmatched characters come out alone with None."""
+        i = 0
+        while i < len(text):
+            end, entry = self.longest_match(text, i)
+            if end is None:
+                end = i + 1
+            yield text[i:end], entry
+            i = end
+
+
+def parse_line(line):
+    """Parse one CC-CEDICT line into a DictEntry, or None for comments and malformed lines."""
+    if line.startswith('#'):
+        return None
+    line = line.strip().rstrip('/')
+    try:
+        chinese, english = line.split('/', maxsplit=1)
+        headwords, pinyin = chinese.strip().split('[')
+        traditional, simplified = headwords.split()
+    except ValueError:
+        return None
+    pinyin = numbered_to_tonemarks(pinyin.strip()[:-1])
+    definitions = [d.strip() for sense in english.split('/') for d in sense.split(';') if d.strip()]
+    return DictEntry(traditional, simplified, pinyin, definitions)
+
+
+def _default_file():
+    if CEDICT_SOURCE:
+        return CEDICT_SOURCE
+    from pycccedict import cccedict
+    return Path(cccedict.__file__).parent / 'data' / 'cedict_1_0_ts_utf-8_mdbg.txt.gz'
+
+
+def load(path=None):
+    """Parse a (gzipped) CC-CEDICT file, by default CEDICT_SOURCE."""
+    path = path or _default_file()
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return Cedict(entry for entry in map(parse_line, f) if entry is not None)
+
+
+def source_fingerprint(path=None):
+    """(size, crc32) of a CC-CEDICT source file, as stored in dictionaries compiled from it."""
+    with open(path or _default_file(), 'rb') as f:
+        data = f.read()
+    return len(data), zlib.crc32(data)
+
+
+# Compiled dictionary file: a header, fixed-width entry and key records, an
+# open-addressing hash table over the keys, then a UTF-8 heap holding the
+# strings. Keys are every headword and every proper prefix of one, so
+# longest-match works on the file too. All little-endian.
+DICTIONARY_MAGIC = b'CCED'
+DICTIONARY_VERSION = 1
+# magic, version, (reserved), entries, keys, slots, source size, source crc32,
+# then the offsets of the entry records, key records, slots and heap
+_HEADER = struct.Struct('<4sHHIIIQIIIII')
+# (offset, length) of traditional, simplified, pinyin and the definitions joined by newlines
+_ENTRY = struct.Struct('<IIIIIIII')
+# key offset, key length, flags, entry index
+_KEY = struct.Struct('<IHHI')
+_WORD = 1
+_PREFIX = 2
+_NO_ENTRY = 0xFFFFFFFF
+
+
+def compile_dictionary(dictionary, path, fingerprint=(0, 0)):
+    """Write a Cedict as a compiled dictionary file, recording the fingerprint of its source.
+
+    The file is written next to `path` and renamed into place, so processes
+    mapping the old file keep a consistent view.
+    """
+    heap = bytearray()
+
+    def put(text):
+        data = text.encode('utf-8')
+        heap.extend(data)
+        return len(heap) - len(data), len(data)
+
+    # Only entries some headword resolves to are stored
+    entries = list({id(e): e for e in dictionary._index.values()}.values())
+    positions = {id(e): i for i, e in enumerate(entries)}
+    records = bytearray()
+    for e in entries:
+        records += _ENTRY.pack(*put(e.traditional), *put(e.simplified), *put(e.pinyin), *put('\n'.join(e.definitions)))
+
+    keys = sorted(set(dictionary._index) | dictionary._prefixes)
+    slot_count = 1 << (len(keys) * 2).bit_length()  # At most half full
+    slots = array('I', bytes(4 * slot_count))
+    key_records = bytearray()
+    for i, key in enumerate(keys):
+        entry = dictionary._index.get(key)
+        flags = (_WORD if entry is not None else 0) | (_PREFIX if key in dictionary._prefixes else 0)
+        offset, length = put(key)
+        key_records += _KEY.pack(offset, length, flags, _NO_ENTRY if entry is None else positions[id(entry)])
+        slot = zlib.crc32(heap[offset:offset + length]) & (slot_count - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = i + 1  # 0 marks an empty slot
+    if sys.byteorder != 'little':
+        slots.byteswap()
+
+    blocks = [records, key_records, slots.tobytes(), heap]
+    offsets = [_HEADER.size]
+    for block in blocks[:-1]:
+        offsets.append(offsets[-1] + len(block))
+    header = _HEADER.pack(DICTIONARY_MAGIC, DICTIONARY_VERSION, 0, len(entries), len(keys), slot_count,
+                          *fingerprint, *offsets)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+class MappedCedict(Cedict):
+    """Cedict served from a compiled dictionary file mapped read-only into memory.
+
+    Lookups hash the UTF-8 key and probe the table in place; entries are
+    decoded on access, with the most used ones cached.
+    """
+
+    def __init__(self, path, cache_size=8192):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            raise ValueError(f'{path} is not a compiled dictionary')
+        (magic, version, _, self._count, self._key_count, slot_count, size, crc,
+         self._entries_offset, self._keys_offset, slots_offset, self._heap_offset) = _HEADER.unpack_from(self._map)
+        if magic != DICTIONARY_MAGIC or version != DICTIONARY_VERSION:
+            raise ValueError(f'{path} is not a version {DICTIONARY_VERSION} compiled dictionary')
+        if sys.byteorder != 'little':
+            raise ValueError('Compiled dictionaries can only be mapped on little-endian machines')
+        self.fingerprint = (size, crc)
+        self._mask = slot_count - 1
+        self._slots = memoryview(self._map)[slots_offset:slots_offset + slot_count * 4].cast('I')
+        self._entry = functools.lru_cache(maxsize=cache_size)(self._read_entry)
+
+    def _string(self, offset, length):
+        start = self._heap_offset + offset
+        return self._map[start:start + length].decode('utf-8')
+
+    def _read_entry(self, pos):
+        (traditional_offset, traditional_length, simplified_offset, simplified_length, pinyin_offset, pinyin_length,
+         definitions_offset, definitions_length) = _ENTRY.unpack_from(self._map, self._entries_offset + pos * _ENTRY.size)
+        definitions = self._string(definitions_offset, definitions_length)
+        return DictEntry(self._string(traditional_offset, traditional_length),
+                         self._string(simplified_offset, simplified_length),
+                         self._string(pinyin_offset, pinyin_length),
+                         definitions.split('\n') if definitions else [])
+
+    @property
+    def entries(self):
+        return [self._entry(i) for i in range(self._count)]
+
+    def __len__(self):
+        return self._count
+
+    def _lookup(self, piece):
+        key = piece.encode('utf-8')
+        slot = zlib.crc32(key) & self._mask
+        while True:
+            index = self._slots[slot]
+            if not index:
+                return None, False
+            offset, length, flags, entry = _KEY.unpack_from(self._map, self._keys_offset + (index - 1) * _KEY.size)
+            start = self._heap_offset + offset
+            if length == len(key) and self._map[start:start + length] == key:
+                return (self._entry(entry) if flags & _WORD else None), bool(flags & _PREFIX)
+            slot = (slot + 1) & self._mask
+
+    def get(self, word):
+        """The entry for a simplified or traditional headword, or None."""
+        return self._lookup(word)[0]
+
+
+def _open_compiled(fingerprint):
+    """The compiled dictionary, or None if it is missing or was built from a different source."""
+    try:
+        dictionary = MappedCedict(CEDICT_FILE)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"WARNING: could not map compiled dictionary {CEDICT_FILE}: {e}")
+        return None
+    if dictionary.fingerprint != fingerprint:
+        print(f"Compiled dictionary {CEDICT_FILE} was built from a different CC-CEDICT, ignoring it")
+        return None
+    return dictionary
+
+
+_dictionary = None
+_dictionary_lock = threading.Lock()
+
+
+def get_dictionary():
+    """Return the process-wide dictionary, loading it on first use.
+
+    With CEDICT_FILE set, the compiled dictionary is mapped if it was built
+    from the current source; otherwise it is (re)compiled first, so the first
+    process to start builds it for the others. Without it, or if the file
+    cannot be written, the source is parsed into memory.
+    """
+    global _dictionary
+    if _dictionary is None:
+        with _dictionary_lock:
+            if _dictionary is None:
+                dictionary = None
+                fingerprint = source_fingerprint() if CEDICT_FILE else None
+                if fingerprint:
+                    dictionary = _open_compiled(fingerprint)
+                if dictionary is None:
+                    dictionary = load()
+                    if fingerprint:
+                        try:
+                            os.makedirs(os.path.dirname(CEDICT_FILE) or '.', exist_ok=True)
+                            compile_dictionary(dictionary, CEDICT_FILE, fingerprint)
+                            print(f"Compiled CC-CEDICT to {CEDICT_FILE}")
+                            dictionary = _open_compiled(fingerprint) or dictionary
+                        except OSError as e:
+                            print(f"WARNING: could not write compiled dictionary {CEDICT_FILE}: {e}")
+                _dictionary = dictionary
+                kind = 'compiled' if isinstance(dictionary, MappedCedict) else 'in-memory'
+                print(f"Loaded {kind} CC-CEDICT with {len(dictionary)} entries")
+    return _dictionary
@@ -0,0 +1,84 @@
+"""Parse characters.txt and bulk-load it into the character table.
+
+characters.txt is tab separated: rank, hanzi, frequency, cumulative
+frequency, pinyin, meaning, followed by two summary lines. The file is parsed
+once into SeedCharacter tuples, which are written with PostgreSQL COPY or a
+single executemany INSERT (one transaction either way) in file order, so
+character IDs come out the same as with the old row-by-row loaders.
+"""
+import io
+import os
+from typing import NamedTuple
+
+from sqlalchemy import insert
+
+CHARACTERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'characters.txt')
+_COLUMNS = ('hanzi', 'pinyin', 'meaning', 'frequency', 'rank')
+
+
+class SeedCharacter(NamedTuple):
+    hanzi: str
+    pinyin: str
+    meaning: str
+    frequency: int
+    rank: int
+
+
+def parse_line(line):
+    """Return the SeedCharacter for one line, or None for summary lines and rows without pinyin."""
+    parts = [part.strip() for part in line.rstrip('\r\n').split('\t')]
+    if len(parts) < 5:
+        return None
+    try:
+        rank = int(parts[0])
+        frequency = int(float(parts[2]))
+    except ValueError:
+        return None
+    # Older copies of the file put the meaning after the pinyin in the same column
+    pinyin, _, rest = parts[4].partition(' ')
+    if not pinyin:
+        return None
+    meaning = ' '.join(part for part in [rest.strip()] + parts[5:] if part)
+    return SeedCharacter(parts[1], pinyin, meaning, frequency, rank)
+
+
+def parse_characters(path=CHARACTERS_FILE):
+    """Parse the whole file into a list of SeedCharacter, in file order."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [character for character in map(parse_line, f) if character is not None]
+
+
+def _copy_field(value):
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_characters(cursor, table, characters):
+    data = io.StringIO(''.join(
+        '\t'.join(_copy_field(value) for value in character) + '\n' for character in characters
+    ))
+    cursor.copy_expert(f'COPY "{table.name}" ({", ".join(_COLUMNS)}) FROM STDIN', data)
+
+
+def load_characters(session, characters):
+    """Insert SeedCharacter rows in one round trip where the driver allows. The caller commits."""
+    from models import Character
+
+    table = Character.__table__
+    connection = session.connection()
+    cursor = connection.connection.cursor()
+    if hasattr(cursor, 'copy_expert'):  # psycopg2
+        try:
+            _copy_characters(cursor, table, characters)
+        finally:
+            cursor.close()
+    else:
+        cursor.close()
+        connection.execute(insert(table), [character._asdict() for character in characters])
+    return len(characters)
+
+
+def seed_characters(session, path=CHARACTERS_FILE):
+    """Load characters.txt into an empty character table and commit. Returns the number of rows added."""
+    count = load_characters(session, parse_characters(path))
+    session.commit()
+    return count
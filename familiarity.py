@@ -0,0 +1,68 @@
+class FamiliarityVector:
+    """A user's familiarity with every catalog character, one byte per character.
+
+    Bytes are laid out in catalog (rank) order: 0 means not reviewed yet,
+    otherwise the byte is familiarity + 1. Counting or listing characters by
+    familiarity is a scan over ~11k bytes instead of a query returning
+    thousands of UserProgress rows.
+
+    Lookups by character ID behave like a dict of reviewed characters, so
+    `vector.get(id)`, `id in vector` and `vector[id] = 2` all work.
+    """
+    __slots__ = ('catalog', 'data')
+
+    def __init__(self, catalog, data=None):
+        self.catalog = catalog
+        if data is not None and len(data) == len(catalog):
+            self.data = bytearray(data)
+        else:
+            self.data = bytearray(len(catalog))
+
+    @classmethod
+    def from_pairs(cls, catalog, pairs):
+        """Build a vector from (character_id, familiarity) pairs."""
+        vector = cls(catalog)
+        for character_id, familiarity in pairs:
+            vector[character_id] = familiarity
+        return vector
+
+    def get(self, character_id, default=None):
+        pos = self.catalog.position(character_id)
+        if pos is None or not self.data[pos]:
+            return default
+        return self.data[pos] - 1
+
+    def __getitem__(self, character_id):
+        familiarity = self.get(character_id)
+        if familiarity is None:
+            raise KeyError(character_id)
+        return familiarity
+
+    def __setitem__(self, character_id, familiarity):
+        pos = self.catalog.position(character_id)
+        if pos is not None:
+            self.data[pos] = familiarity + 1
+
+    def __contains__(self, character_id):
+        return self.get(character_id) is not None
+
+    def __len__(self):
+        """Number of reviewed characters."""
+        return len(self.data) - self.data.count(0)
+
+    def count(self, familiarity):
+        return self.data.count(familiarity + 1)
+
+    def ids_with(self, familiarity):
+        """Character IDs with the given familiarity, most common first."""
+        entries = self.catalog.entries
+        value = bytes([familiarity + 1])
+        ids = []
+        pos = self.data.find(value)
+        while pos != -1:
+            ids.append(entries[pos].id)
+            pos = self.data.find(value, pos + 1)
+        return ids
+
+    def to_bytes(self):
+        return bytes(self.data)
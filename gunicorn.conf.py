@@ -0,0 +1,36 @@
+# gunicorn settings and server hooks; see https://docs.gunicorn.org/en/stable/settings.html
+#
+# Schema setup runs once per deploy in the master before any worker starts;
+# each worker then only starts its background threads and checks its caches
+# (inherited from the master) on a separate thread while it already serves.
+#
+# Because on_starting imports the app in the master, workers forked after a
+# `kill -HUP` run the code the master loaded when it started, as with
+# preload_app. Restart gunicorn (or redeploy) to pick up code changes.
+
+timeout = 180
+
+
+def on_starting(server):
+    import startup
+    from app import app, db, run_migrations, preload_caches
+
+    with app.app_context():
+        run_migrations()
+        # Builds the compiled catalog and dictionary files if they are missing, so workers only map them
+        preload_caches()
+        # Connections must not be shared with forked workers
+        db.engine.dispose()
+    if startup.STARTUP_REPORT:
+        startup.report('Master startup')
+
+
+def post_fork(server, worker):
+    import startup
+    from app import app, db, warmup
+
+    startup.forked()
+    with app.app_context():
+        # Drop pool connections inherited from the master without closing them under it
+        db.engine.dispose(close=False)
+        warmup(background=True)
@@ -0,0 +1,229 @@
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from models import db, Job
+
+
+class JobRunner:
+    """Runs long requests, such as large imports, on a thread pool after the response is sent.
+
+    A job is a function taking the path of its saved upload (or None) and
+    returning an iterator of import events (see progress_import.py):
+    "progress" events update the processed count, "detail" events are
+    collected into the result, and the "result" event becomes the job's
+    result. Job state lives in the Job table, so /api/jobs/<id> can be
+    answered by any worker; status updates are written on their own
+    connection so they are visible while the import's transaction is open.
+    """
+
+    def __init__(self, directory, workers=2, max_pending=8, progress_interval_ms=1000, retention_days=7,
+                 stale_minutes=60):
+        self.directory = directory
+        self.workers = workers
+        self.max_pending = max_pending  # Queued + running jobs per process before new ones are refused
+        self.progress_interval = progress_interval_ms / 1000.0
+        self.retention_days = retention_days
+        self.stale_minutes = stale_minutes  # Unfinished jobs older than this are given up on
+        self.worker_id = None
+        self._app = None
+        self._executor = None
+        self._pending = 0
+        self._live = {}  # job_id -> processed count, for jobs running in this process
+        self._progress_to_db = True
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        """Start the pool and clean up after jobs of processes that are gone. Call in an app context."""
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._app = app
+            self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+            os.makedirs(self.directory, exist_ok=True)
+            # SQLite allows one writer at a time, so progress written from a second
+            # connection would wait on the import's own transaction
+            self._progress_to_db = db.engine.dialect.name != 'sqlite'
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        try:
+            self._fail_interrupted()
+            self._fail_stale()
+            self._purge_finished()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error cleaning up background jobs: {e}")
+        print(f"Background job runner started with {self.workers} workers")
+
+    def _fail_interrupted(self):
+        """Mark jobs owned by dead processes on this host as failed."""
+        host = socket.gethostname()
+        jobs = Job.query.filter(Job.status.in_(('queued', 'running')), Job.worker.like(f'{host}:%')).all()
+        for job in jobs:
+            pid = int(job.worker.rsplit(':', 1)[1])
+            if pid != os.getpid() and _process_alive(pid):
+                continue
+            job.status = 'failed'
+            job.error = 'Interrupted by a server restart, please try again'
+            job.finished_at = datetime.utcnow()
+            self._remove_upload(self._upload_path(job.id))
+            print(f"Marked interrupted job {job.id} as failed")
+        db.session.commit()
+
+    def _stale_cutoff(self):
+        return datetime.utcnow() - timedelta(minutes=self.stale_minutes)
+
+    def _fail_stale(self, *criteria):
+        """Mark queued or running jobs started before the stale cutoff as failed; returns how many.
+
+        This catches jobs whose process went away on another host, which
+        _fail_interrupted cannot check. Jobs running in this process are left alone.
+        """
+        table = Job.__table__
+        started = db.func.coalesce(table.c.started_at, table.c.created_at)
+        query = update(table).where(
+            table.c.status.in_(('queued', 'running')), started < self._stale_cutoff(), *criteria
+        )
+        if self._live:
+            query = query.where(table.c.id.not_in(list(self._live)))
+        result = db.session.execute(query.values(
+            status='failed', error='The job stopped responding, please try again', finished_at=datetime.utcnow()
+        ))
+        db.session.commit()
+        if result.rowcount:
+            print(f"Marked {result.rowcount} stale jobs as failed")
+        return result.rowcount
+
+    def _purge_finished(self):
+        cutoff = datetime.utcnow() - timedelta(days=self.retention_days)
+        Job.query.filter(Job.finished_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _upload_path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.upload')
+
+    @staticmethod
+    def _remove_upload(path):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def submit(self, user_id, kind, task, upload=None):
+        """Save the upload stream (if any), record the job and queue task(upload_path).
+
+        Returns the Job, or None if the runner is not started or this process
+        already has max_pending jobs.
+        """
+        with self._lock:
+            if self._executor is None or self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+
+        job = Job(id=uuid.uuid4().hex, user_id=user_id, kind=kind, status='queued',
+                  worker=self.worker_id, created_at=datetime.utcnow())
+        path = None
+        try:
+            if upload is not None:
+                path = self._upload_path(job.id)
+                with open(path, 'wb') as f:
+                    shutil.copyfileobj(upload, f, 1024 * 1024)
+            db.session.add(job)
+            db.session.commit()
+            self._executor.submit(self._run, job.id, task, path)
+        except Exception:
+            db.session.rollback()
+            self._remove_upload(path)
+            self._release()
+            raise
+        return job
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _update(self, job_id, **values):
+        table = Job.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.id == job_id).values(**values))
+
+    def _run(self, job_id, task, path):
+        with self._app.app_context():
+            processed = 0
+            try:
+                self._update(job_id, status='running', started_at=datetime.utcnow())
+                result = None
+                details = []
+                last_write = time.monotonic()
+                for event in task(path):
+                    if event['type'] == 'progress':
+                        processed = event['processed']
+                        self._live[job_id] = processed
+                        if self._progress_to_db and time.monotonic() - last_write >= self.progress_interval:
+                            self._update(job_id, processed=processed)
+                            last_write = time.monotonic()
+                    elif event['type'] == 'detail':
+                        details.append({k: v for k, v in event.items() if k != 'type'})
+                    elif event['type'] == 'result':
+                        result = {k: v for k, v in event.items() if k != 'type'}
+                        result['results'].setdefault('details', details)
+                self._update(job_id, status='succeeded', processed=processed, result=json.dumps(result),
+                             finished_at=datetime.utcnow())
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error running job {job_id}: {e}")
+                # ValueErrors describe a problem with the uploaded data
+                error = f'Invalid file: {e}' if isinstance(e, ValueError) else 'An error occurred while running the job'
+                try:
+                    self._update(job_id, status='failed', processed=processed, error=error,
+                                 finished_at=datetime.utcnow())
+                except Exception as update_error:
+                    print(f"Error recording failure of job {job_id}: {update_error}")
+            finally:
+                self._remove_upload(path)
+                self._live.pop(job_id, None)
+                self._release()
+
+    def status(self, job_id, user_id):
+        """The job as a dict for its owner, or None."""
+        job = db.session.get(Job, job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        if job.status in ('queued', 'running') and job_id not in self._live \
+                and (job.started_at or job.created_at) < self._stale_cutoff():
+            if self._fail_stale(Job.__table__.c.id == job_id):
+                db.session.refresh(job)
+        data = job.to_dict()
+        if job.status == 'running':
+            data['processed'] = max(data['processed'], self._live.get(job_id, 0))
+        return data
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def from_env():
+    """Build the runner from the JOB_* environment variables; JOB_WORKERS=0 disables background jobs."""
+    workers = int(os.environ.get('JOB_WORKERS', 2))
+    if workers <= 0:
+        return None
+    return JobRunner(
+        directory=os.environ.get('JOB_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'jobs')),
+        workers=workers,
+        max_pending=int(os.environ.get('JOB_MAX_PENDING', 8)),
+        progress_interval_ms=int(os.environ.get('JOB_PROGRESS_INTERVAL_MS', 1000)),
+        retention_days=int(os.environ.get('JOB_RETENTION_DAYS', 7)),
+        stale_minutes=int(os.environ.get('JOB_STALE_MINUTES', 60)),
+    )
@@ -0,0 +1,163 @@
+"""Versioned schema migrations, applied once per deploy.
+
+`flask --app app migrate`, or the gunicorn on_starting hook in
+gunicorn.conf.py, applies every migration not yet recorded in the
+schema_migration table, in order. A database-wide lock (pg_advisory_lock on
+PostgreSQL, an flock'd file next to a SQLite database) keeps concurrent
+deploys from running them twice.
+
+Databases set up before this module existed had the same changes applied
+on every worker's first request without recording them, so each migration
+checks what is already there instead of relying on statements failing.
+"""
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import inspect, text
+
+from character_seed import CHARACTERS_FILE, parse_characters, load_characters
+from models import db, Character, SchemaMigration, merge_duplicate_progress
+
+MIGRATIONS = []  # (version, name, function), in version order
+_LOCK_KEY = 0x43684368  # pg_advisory_lock key shared by every deploy of the app
+
+
+def migration(version, name):
+    def register(function):
+        MIGRATIONS.append((version, name, function))
+        return function
+    return register
+
+
+@migration(1, 'create tables')
+def _create_tables():
+    db.Model.metadata.create_all(bind=db.session.connection())
+
+
+@migration(2, 'widen character text columns')
+def _widen_character_columns():
+    # SQLite does not enforce VARCHAR lengths
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('ALTER TABLE character ALTER COLUMN meaning TYPE TEXT'))
+        db.session.execute(text('ALTER TABLE character ALTER COLUMN pinyin TYPE VARCHAR(200)'))
+
+
+# (table, column, definition) added to tables created by older versions of the app
+_ADDED_COLUMNS = [
+    ('user', 'encrypted_api_key', 'TEXT'),
+    ('user', 'translation_popups', 'BOOLEAN NOT NULL DEFAULT TRUE'),
+    ('user_progress', 'due_at', 'TIMESTAMP'),
+    ('user_progress', 'interval_days', 'FLOAT DEFAULT 0'),
+    ('user_progress', 'ease', 'FLOAT DEFAULT 2.5'),
+    ('user_progress', 'previous_familiarity', 'INTEGER'),
+    ('review_event', 'client_event_id', 'VARCHAR(64)'),
+]
+
+
+@migration(3, 'add columns missing from older schemas')
+def _add_columns():
+    inspector = inspect(db.session.connection())
+    for table, column, definition in _ADDED_COLUMNS:
+        if column not in {c['name'] for c in inspector.get_columns(table)}:
+            db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {definition}'))
+            print(f"Added {column} column to {table} table")
+
+
+@migration(4, 'create indexes missing from older schemas')
+def _create_indexes():
+    # create_all() does not add indexes to tables that already exist
+    connection = db.session.connection()
+    for table in db.Model.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+
+@migration(5, 'unique progress row per user and character')
+def _unique_progress():
+    inspector = inspect(db.session.connection())
+    pair = {'user_id', 'character_id'}
+    if any(set(c['column_names']) == pair for c in inspector.get_unique_constraints('user_progress')) or \
+            any(i.get('unique') and set(i['column_names']) == pair for i in inspector.get_indexes('user_progress')):
+        return
+    # Older databases picked up duplicate rows before the constraint existed
+    removed = merge_duplicate_progress()
+    if removed:
+        print(f"Merged {removed} duplicate user_progress rows")
+    try:
+        db.session.execute(text(
+            'CREATE UNIQUE INDEX uq_user_progress_user_character ON user_progress (user_id, character_id)'
+        ))
+    except Exception as e:
+        # Upserts depend on this index; serving without it would duplicate progress rows again
+        raise RuntimeError(
+            f'Could not create the unique (user_id, character_id) index on user_progress: {e}'
+        ) from e
+
+
+@migration(6, 'spaced-repetition due dates for known characters')
+def _backfill_due_dates():
+    # Characters known before spaced repetition existed are due right away
+    db.session.execute(text('UPDATE user_progress SET due_at = last_reviewed WHERE familiarity = 2 AND due_at IS NULL'))
+
+
+@migration(7, 'seed characters')
+def _seed_characters():
+    if db.session.query(Character.id).first() is not None:
+        return
+    if not os.path.exists(CHARACTERS_FILE):
+        raise FileNotFoundError(f'characters.txt not found at {CHARACTERS_FILE}')
+    count = load_characters(db.session, parse_characters(CHARACTERS_FILE))
+    print(f"Seeded {count} characters from {CHARACTERS_FILE}")
+
+
+@contextmanager
+def _migration_lock():
+    """Hold a lock that only one migrating process at a time can have."""
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as connection:
+            connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': _LOCK_KEY})
+            connection.commit()
+            try:
+                yield
+            finally:
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': _LOCK_KEY})
+                connection.commit()
+        return
+
+    database = db.engine.url.database
+    if not database or database == ':memory:':
+        yield
+        return
+    import fcntl
+    with open(f'{database}.migrate.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def pending_migrations():
+    """(version, name) of the migrations this database has not had yet."""
+    if not inspect(db.engine).has_table(SchemaMigration.__tablename__):
+        return [(version, name) for version, name, _ in MIGRATIONS]
+    applied = {version for (version,) in db.session.query(SchemaMigration.version)}
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in applied]
+
+
+def migrate():
+    """Apply pending migrations, each in its own transaction. Returns the versions applied."""
+    applied = []
+    with _migration_lock():
+        SchemaMigration.__table__.create(bind=db.engine, checkfirst=True)
+        done = {version for (version,) in db.session.query(SchemaMigration.version)}
+        for version, name, function in MIGRATIONS:
+            if version in done:
+                continue
+            print(f"Applying migration {version}: {name}")
+            try:
+                function()
+                db.session.add(SchemaMigration(version=version, name=name))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            applied.append(version)
+    return applied
@@ -1,10 +1,36 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import date, datetime, timedelta
+import base64
+import json
+import os
 import random
+import threading
 from flask_login import UserMixin
+from catalog import Catalog, CatalogEntry, MappedCatalog, compile_catalog
+from familiarity import FamiliarityVector
+from sampling import KnownSampler, RankWindowSampler, effective_weight
+from scheduler import SchedulerState, SchedulerStateCache
+import write_behind
 
 db = SQLAlchemy()
 
+# Where the unknown-character window comes from: 'memory' (cached per-user
+# samplers) or 'sql' (one query per draw, always consistent across workers)
+CANDIDATE_SOURCE = os.environ.get('SCHEDULER_CANDIDATE_SOURCE', 'memory')
+
+# How known characters are re-tested: 'random' (about 1 in 10 draws) or
+# 'srs' (when they come due, using SM-2 style intervals on UserProgress)
+SCHEDULER_MODE = os.environ.get('SCHEDULER_MODE', 'random')
+
+# Per-user scheduler state, shared by all requests handled by this process
+scheduler_states = SchedulerStateCache(
+    max_users=int(os.environ.get('SCHEDULER_CACHE_SIZE', 256)),
+    ttl_seconds=int(os.environ.get('SCHEDULER_CACHE_TTL', 600))
+)
+
+# Opt-in write-behind buffer for /api/progress (WRITE_BEHIND=true, see write_behind.py)
+review_queue = write_behind.from_env(lambda user_id, reviews: _apply_buffered_reviews(user_id, reviews))
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(100), unique=True, nullable=False)
@@ -20,11 +46,11 @@ class User(UserMixin, db.Model):
 
 class Character(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    hanzi = db.Column(db.String(10), nullable=False)
+    hanzi = db.Column(db.String(10), nullable=False, index=True)
     pinyin = db.Column(db.String(200), nullable=False)
     meaning = db.Column(db.Text, nullable=False)
     frequency = db.Column(db.Integer, default=0)  # Store frequency from characters.txt
-    rank = db.Column(db.Integer, default=0)  # Store rank based on frequency
+    rank = db.Column(db.Integer, default=0, index=True)  # Store rank based on frequency
     
     def __repr__(self):
         return f'<Character {self.hanzi}>'
@@ -39,7 +65,18 @@ class UserProgress(db.Model):
     know_count = db.Column(db.Integer, default=0)  # Number of times marked as "Know"
     unsure_count = db.Column(db.Integer, default=0)  # Number of times marked as "Unsure"
     dont_know_count = db.Column(db.Integer, default=0)  # Number of times marked as "Don't Know"
+    due_at = db.Column(db.DateTime, nullable=True)  # Next spaced-repetition review, only set while known
+    interval_days = db.Column(db.Float, default=0)  # Current spaced-repetition interval
+    ease = db.Column(db.Float, default=2.5)  # SM-2 ease factor
+    previous_familiarity = db.Column(db.Integer, nullable=True)  # Familiarity before the latest review
     
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'character_id', name='uq_user_progress_user_character'),
+        db.Index('ix_user_progress_user_familiarity', 'user_id', 'familiarity'),
+        db.Index('ix_user_progress_user_last_reviewed', 'user_id', 'last_reviewed'),
+        db.Index('ix_user_progress_user_due', 'user_id', 'due_at'),
+    )
+
     character = db.relationship('Character', backref=db.backref('progress', lazy=True))
     user = db.relationship('User', backref=db.backref('progress', lazy=True))
     
@@ -62,6 +99,99 @@ class UserCharacterTuning(db.Model):
     def __repr__(self):
         return f'<UserCharacterTuning user_id={self.user_id} character_id={self.character_id} rank_penalty={self.rank_penalty}>'
 
+class UserFamiliarityVector(db.Model):
+    """Packed copy of a user's UserProgress familiarity values (see familiarity.py)."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    catalog_size = db.Column(db.Integer, nullable=False)  # Vector is rebuilt if the catalog size changes
+    data = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<UserFamiliarityVector user_id={self.user_id} catalog_size={self.catalog_size}>'
+
+class UserStats(db.Model):
+    """Per-user review counters, kept up to date by every progress write."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    reviewed_count = db.Column(db.Integer, nullable=False, default=0)
+    know_count = db.Column(db.Integer, nullable=False, default=0)
+    unsure_count = db.Column(db.Integer, nullable=False, default=0)
+    dont_know_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<UserStats user_id={self.user_id} reviewed={self.reviewed_count}>'
+
+class ReviewEvent(db.Model):
+    """One flashcard answer. Rows are only ever appended, never updated."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False)
+    familiarity = db.Column(db.SmallInteger, nullable=False)
+    previous_familiarity = db.Column(db.SmallInteger, nullable=True)  # None for the first review
+    reviewed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    latency_ms = db.Column(db.Integer, nullable=True)  # Time from showing the card to the answer
+    client_event_id = db.Column(db.String(64), nullable=True)  # Set by offline clients (/api/sync) to make retries safe
+
+    __table_args__ = (
+        db.Index('ix_review_event_user_reviewed_at', 'user_id', 'reviewed_at'),
+        db.Index('ix_review_event_reviewed_at', 'reviewed_at'),
+        db.Index('uq_review_event_user_client_event', 'user_id', 'client_event_id', unique=True),
+    )
+
+    def __repr__(self):
+        return f'<ReviewEvent user_id={self.user_id} character_id={self.character_id} familiarity={self.familiarity}>'
+
+class ReviewDailyRollup(db.Model):
+    """Per-user, per-day aggregate of ReviewEvent rows, built by rollup_reviews."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    reviews = db.Column(db.Integer, nullable=False, default=0)
+    new_known = db.Column(db.Integer, nullable=False, default=0)  # Answers that moved a character to "Know"
+    lapses = db.Column(db.Integer, nullable=False, default=0)  # Known characters answered "Unsure"/"Don't know"
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ReviewDailyRollup user_id={self.user_id} day={self.day} reviews={self.reviews}>'
+
+class Job(db.Model):
+    """A long-running request (e.g. a large import) handed to the background job runner (see jobs.py)."""
+    id = db.Column(db.String(32), primary_key=True)  # Random hex, so ids cannot be guessed
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    kind = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, succeeded, failed
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    result = db.Column(db.Text, nullable=True)  # JSON of the final response
+    error = db.Column(db.Text, nullable=True)
+    worker = db.Column(db.String(100), nullable=True)  # host:pid of the process that owns the job
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'processed': self.processed,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<Job id={self.id} kind={self.kind} status={self.status}>'
+
+class SchemaMigration(db.Model):
+    """A migration from migrations.py that has been applied to this database."""
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SchemaMigration version={self.version} name={self.name}>'
+
 class CharacterAIDescription(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False, unique=True)
@@ -74,6 +204,263 @@ class CharacterAIDescription(db.Model):
     def __repr__(self):
         return f'<CharacterAIDescription character_id={self.character_id} model={self.model}>'
 
+_catalog = None
+_catalog_lock = threading.Lock()
+
+# Compiled catalog file mapped by every worker (see catalog.MappedCatalog);
+# set CATALOG_FILE to an empty string to keep a private copy per process instead
+CATALOG_FILE = os.environ.get('CATALOG_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'catalog.bin'))
+
+def _character_table_fingerprint():
+    """(count, sum of id * rank) of the character table, as stored in compiled catalogs."""
+    count, id_rank_sum = db.session.query(
+        db.func.count(Character.id), db.func.coalesce(db.func.sum(Character.id * Character.rank), 0)
+    ).one()
+    return count, int(id_rank_sum)
+
+def _open_compiled_catalog(fingerprint):
+    """The compiled catalog, or None if it is missing or was built from a different character table."""
+    try:
+        catalog = MappedCatalog(CATALOG_FILE)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"WARNING: could not map compiled catalog {CATALOG_FILE}: {e}")
+        return None
+    if (len(catalog), catalog.fingerprint) != fingerprint:
+        print(f"Compiled catalog {CATALOG_FILE} does not match the character table, ignoring it")
+        return None
+    return catalog
+
+def _catalog_rows():
+    return db.session.query(
+        Character.id, Character.hanzi, Character.rank,
+        Character.frequency, Character.pinyin, Character.meaning
+    ).all()
+
+def compile_catalog_from_db(path=None):
+    """Compile the character table into a catalog file. Returns the number of characters."""
+    return compile_catalog((CatalogEntry(*row) for row in _catalog_rows()), path or CATALOG_FILE)
+
+def get_catalog():
+    """Return the process-wide character catalog, loading it on first use.
+
+    With CATALOG_FILE set, the compiled catalog is mapped if it matches the
+    character table; otherwise it is (re)compiled from the table first, so
+    the first process to start builds it for the others. Without it, or if
+    the file cannot be written, the catalog is loaded into memory.
+
+    An empty catalog (database not seeded yet) is returned but not cached.
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                catalog = None
+                fingerprint = _character_table_fingerprint() if CATALOG_FILE else None
+                if fingerprint:
+                    catalog = _open_compiled_catalog(fingerprint)
+                if catalog is None:
+                    rows = _catalog_rows()
+                    if rows and fingerprint:
+                        try:
+                            os.makedirs(os.path.dirname(CATALOG_FILE) or '.', exist_ok=True)
+                            compile_catalog((CatalogEntry(*row) for row in rows), CATALOG_FILE)
+                            print(f"Compiled character catalog to {CATALOG_FILE}")
+                            catalog = _open_compiled_catalog(fingerprint)
+                        except OSError as e:
+                            print(f"WARNING: could not write compiled catalog {CATALOG_FILE}: {e}")
+                    if catalog is None:
+                        catalog = Catalog(CatalogEntry(*row) for row in rows)
+                if len(catalog) == 0:
+                    return catalog
+                _catalog = catalog
+                kind = 'compiled' if isinstance(catalog, MappedCatalog) else 'in-memory'
+                print(f"Loaded {kind} character catalog with {len(catalog)} characters")
+    return _catalog
+
+def reset_catalog():
+    """Drop the cached catalog so the next access reloads it from the database."""
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
+    scheduler_states.clear()
+
+# SM-2 response quality for each familiarity level
+_SRS_QUALITY = {0: 1, 1: 3, 2: 5}
+
+def next_schedule(ease, interval, familiarity, now):
+    """Return the SM-2 (ease, interval_days, due_at) after a review.
+
+    Only known characters get a due date; the others are picked up by the
+    regular unknown-character window.
+    """
+    quality = _SRS_QUALITY[familiarity]
+    ease = ease or 2.5
+    interval = interval or 0
+
+    ease = max(1.3, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    if quality < 3:
+        interval = 0
+    elif interval < 1:
+        interval = 1
+    elif interval < 6:
+        interval = 6
+    else:
+        interval = interval * ease
+
+    due_at = now + timedelta(days=interval) if familiarity == 2 else None
+    return ease, interval, due_at
+
+def _sql_schedule(table, familiarity, now):
+    """SQL expressions computing next_schedule from a row's current ease and interval.
+
+    Used in the ON CONFLICT branch of update_progress so the new schedule is
+    written by the same statement that records the review.
+    """
+    quality = _SRS_QUALITY[familiarity]
+    sqlite = db.engine.dialect.name == 'sqlite'
+    greatest = db.func.max if sqlite else db.func.greatest
+
+    old_interval = db.func.coalesce(table.c.interval_days, 0)
+    ease = greatest(1.3, db.func.coalesce(table.c.ease, 2.5) + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)))
+    if quality < 3:
+        interval = db.literal(0.0)
+    else:
+        interval = db.case((old_interval < 1, 1.0), (old_interval < 6, 6.0), else_=old_interval * ease)
+
+    if familiarity != 2:
+        due_at = None
+    elif sqlite:
+        due_at = db.func.strftime('%Y-%m-%d %H:%M:%f', db.literal(now, db.DateTime),
+                                  db.func.printf('%+f seconds', interval * 86400))
+    else:
+        due_at = db.literal(now, db.DateTime) + db.func.make_interval(0, 0, 0, 0, 0, 0, interval * 86400)
+    return {'ease': ease, 'interval_days': interval, 'due_at': due_at}
+
+def schedule_review(progress, familiarity, now):
+    """Update a progress record's SM-2 interval, ease and due date after a review."""
+    progress.ease, progress.interval_days, progress.due_at = next_schedule(
+        progress.ease, progress.interval_days, familiarity, now
+    )
+
+def get_due_character_ids(user_id, limit, now=None):
+    """Return IDs of known characters whose review is due, most overdue first.
+
+    Served by a range scan on the (user_id, due_at) index.
+    """
+    rows = db.session.query(UserProgress.character_id).filter(
+        UserProgress.user_id == user_id,
+        UserProgress.due_at <= (now or datetime.utcnow())
+    ).order_by(UserProgress.due_at.asc()).limit(limit).all()
+    return [row[0] for row in rows]
+
+# UserStats counter for each familiarity level
+_STATS_COUNTERS = {0: 'dont_know_count', 1: 'unsure_count', 2: 'know_count'}
+
+def _increment_stats(user_id, deltas):
+    """Add counter deltas ({'know_count': 3, ...}) to the user's UserStats row in SQL."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    columns = UserStats.__table__.c
+    values = {name: columns[name] + delta for name, delta in deltas.items()}
+    values['updated_at'] = datetime.utcnow()
+
+    result = db.session.execute(db.update(UserStats).where(UserStats.user_id == user_id).values(**values))
+    if result.rowcount == 0:
+        recompute_user_stats(user_id)
+
+def _stats_deltas(changes):
+    """Counter deltas for (old_familiarity, new_familiarity) pairs; old is None for new rows."""
+    deltas = {'reviewed_count': 0, 'know_count': 0, 'unsure_count': 0, 'dont_know_count': 0}
+    for old_familiarity, new_familiarity in changes:
+        if old_familiarity == new_familiarity:
+            continue
+        if old_familiarity is None:
+            deltas['reviewed_count'] += 1
+        else:
+            deltas[_STATS_COUNTERS[old_familiarity]] -= 1
+        deltas[_STATS_COUNTERS[new_familiarity]] += 1
+    return deltas
+
+def apply_stats_delta(user_id, old_familiarity, new_familiarity):
+    """Adjust the user's UserStats row for one progress row changing familiarity.
+
+    old_familiarity is None for a newly reviewed character. The counters are
+    incremented in SQL inside the current transaction; the caller commits.
+    """
+    _increment_stats(user_id, _stats_deltas([(old_familiarity, new_familiarity)]))
+
+def recompute_user_stats(user_id=None):
+    """Rebuild UserStats from UserProgress with a single GROUP BY.
+
+    Recomputes one user, or every user when user_id is None. Returns the
+    number of rows written; the caller commits.
+    """
+    query = db.session.query(
+        UserProgress.user_id, UserProgress.familiarity, db.func.count(UserProgress.id)
+    ).group_by(UserProgress.user_id, UserProgress.familiarity)
+    if user_id is not None:
+        query = query.filter(UserProgress.user_id == user_id)
+
+    totals = {}
+    for uid, familiarity, count in query:
+        totals.setdefault(uid, {0: 0, 1: 0, 2: 0})[familiarity] = count
+
+    # Users whose progress disappeared must be reset as well
+    stale = UserStats.query if user_id is None else UserStats.query.filter_by(user_id=user_id)
+    for stats in stale:
+        totals.setdefault(stats.user_id, {0: 0, 1: 0, 2: 0})
+    if user_id is not None:
+        totals.setdefault(user_id, {0: 0, 1: 0, 2: 0})
+
+    now = datetime.utcnow()
+    for uid, counts in totals.items():
+        stats = db.session.get(UserStats, uid)
+        if stats is None:
+            stats = UserStats(user_id=uid)
+            db.session.add(stats)
+        stats.reviewed_count = sum(counts.values())
+        stats.know_count = counts.get(2, 0)
+        stats.unsure_count = counts.get(1, 0)
+        stats.dont_know_count = counts.get(0, 0)
+        stats.updated_at = now
+    return len(totals)
+
+def _pending_familiarity(user_id):
+    """{character_id: familiarity} of a user's reviews still buffered by the write-behind queue."""
+    if review_queue is None:
+        return {}
+    pending = {}
+    # Applied in time order, so the newest buffered answer wins
+    for character_id, familiarity, *_ in sorted(review_queue.pending_for(user_id), key=lambda review: review[2]):
+        pending[character_id] = familiarity
+    return pending
+
+def get_user_stats(user_id):
+    """Return the user's UserStats (one primary-key lookup), creating the row if missing.
+
+    Reviews still buffered by the write-behind queue are counted as well; the
+    result is then a detached copy of the row, never written back.
+    """
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        recompute_user_stats(user_id)
+        db.session.commit()
+        stats = db.session.get(UserStats, user_id)
+
+    pending = _pending_familiarity(user_id)
+    if not pending:
+        return stats
+    stored = dict(db.session.query(UserProgress.character_id, UserProgress.familiarity).filter(
+        UserProgress.user_id == user_id, UserProgress.character_id.in_(list(pending))
+    ))
+    deltas = _stats_deltas((stored.get(character_id), familiarity) for character_id, familiarity in pending.items())
+    return UserStats(user_id=user_id, updated_at=stats.updated_at, **{
+        name: getattr(stats, name) + delta for name, delta in deltas.items()
+    })
+
 def get_rank_penalties(user_id):
     records = UserCharacterTuning.query.filter_by(user_id=user_id).all()
     return {r.character_id: r.rank_penalty for r in records}
@@ -91,159 +478,827 @@ def _weighted_pick(characters, rank_penalties):
         weights.append(1.0 / max(effective_rank, 1))
     return random.choices(characters, weights=weights, k=1)[0]
 
-def get_next_character(user_id):
+def get_candidates_by_effective_rank(user_id, limit):
+    """Return (character_id, effective_rank) for the `limit` unknown characters
+    with the lowest rank + rank_penalty, computed in a single statement.
+
+    Unlike re-sorting a fixed rank window in Python, this always returns the
+    true top-K after demotes, without over-fetching.
     """
-    Get the next character to review based on frequency and familiarity.
-    Uses a sliding window of the 100 most common characters that aren't yet known.
-    Occasionally re-tests known characters (about 1 in 20 times).
+    penalty = db.func.coalesce(UserCharacterTuning.rank_penalty, 0)
+    effective_rank = (Character.rank + penalty).label('effective_rank')
+    known = db.session.query(UserProgress.id).filter(
+        UserProgress.user_id == user_id,
+        UserProgress.character_id == Character.id,
+        UserProgress.familiarity == 2
+    ).exists()
+    return db.session.query(Character.id, effective_rank).outerjoin(
+        UserCharacterTuning,
+        db.and_(UserCharacterTuning.character_id == Character.id, UserCharacterTuning.user_id == user_id)
+    ).filter(~known).order_by(effective_rank.asc(), Character.rank.asc()).limit(limit).all()
+
+def _build_familiarity_vector(user_id, catalog):
+    rows = db.session.query(UserProgress.character_id, UserProgress.familiarity).filter_by(user_id=user_id)
+    return FamiliarityVector.from_pairs(catalog, rows)
+
+# Reviews touching at most this many characters overlay just the changed bytes
+# of the stored vector on PostgreSQL instead of rewriting all of it
+VECTOR_OVERLAY_LIMIT = 64
+
+def _overlay_familiarity_vector(user_id, catalog, changes):
+    """Set the changed bytes of the stored vector in SQL with set_byte() (PostgreSQL only).
+
+    Returns False when there is no stored vector for the current catalog, in
+    which case the caller rebuilds it.
     """
+    table = UserFamiliarityVector.__table__
+    data = table.c.data
+    for character_id, familiarity in changes.items():
+        position = catalog.position(character_id)
+        if position is not None:
+            data = db.func.set_byte(data, position, familiarity + 1, type_=db.LargeBinary)
+    result = db.session.execute(db.update(table).where(
+        table.c.user_id == user_id, table.c.catalog_size == len(catalog)
+    ).values(data=data, updated_at=datetime.utcnow()))
+    return result.rowcount > 0
+
+def sync_familiarity_vector(user_id, changes=None):
+    """Write the user's persisted familiarity vector inside the current transaction.
+
+    `changes` maps character_id -> familiarity for the rows just written.
+    On PostgreSQL a few changes only overwrite their own bytes of the stored
+    vector; otherwise (SQLite cannot splice blobs in SQL) the row is locked
+    and rewritten. With changes=None (bulk writes) the vector is rebuilt from
+    UserProgress. Returns the vector written, or None when only bytes were
+    overlaid. The caller commits.
+    """
+    catalog = get_catalog()
+    if (changes is not None and len(changes) <= VECTOR_OVERLAY_LIMIT
+            and db.engine.dialect.name == 'postgresql'
+            and _overlay_familiarity_vector(user_id, catalog, changes)):
+        return None
+
+    record = db.session.get(UserFamiliarityVector, user_id, with_for_update=True)
+    if changes is None or record is None or record.catalog_size != len(catalog):
+        db.session.flush()
+        vector = _build_familiarity_vector(user_id, catalog)
+    else:
+        vector = FamiliarityVector(catalog, record.data)
+        for character_id, familiarity in changes.items():
+            vector[character_id] = familiarity
+
+    if record is None:
+        record = UserFamiliarityVector(user_id=user_id)
+        db.session.add(record)
+    record.catalog_size = len(catalog)
+    record.data = vector.to_bytes()
+    record.updated_at = datetime.utcnow()
+    return vector
+
+def _load_familiarity_vector(user_id, catalog):
+    """Read the persisted vector with one primary-key lookup, rebuilding it if missing or outdated."""
+    record = db.session.get(UserFamiliarityVector, user_id)
+    if record is not None and record.catalog_size == len(catalog):
+        return FamiliarityVector(catalog, record.data)
     try:
-        # First, check if we have any characters in the database
-        total_characters = Character.query.count()
-        if total_characters == 0:
-            print("No characters in database")
-            return None
-            
-        # Get all characters that have been reviewed by this user and their familiarity
-        progress_records = UserProgress.query.filter_by(user_id=user_id).all()
+        vector = sync_familiarity_vector(user_id)
+        db.session.commit()
+        return vector
+    except Exception as e:
+        print(f"Error saving familiarity vector: {e}")
+        db.session.rollback()
+        return _build_familiarity_vector(user_id, catalog)
+
+def _load_scheduler_state(user_id):
+    """Build a SchedulerState for a user from the database."""
+    catalog = get_catalog()
 
-        # Create a dictionary of character_id -> familiarity for quick lookup
-        familiarity_dict = {p.character_id: p.familiarity for p in progress_records}
+    last_progress = db.session.query(UserProgress.character_id).filter_by(user_id=user_id).order_by(
+        UserProgress.last_reviewed.desc()
+    ).first()
 
-        rank_penalties = get_rank_penalties(user_id)
+    state = SchedulerState(
+        user_id=user_id,
+        familiarity=_load_familiarity_vector(user_id, catalog),
+        rank_penalties=get_rank_penalties(user_id),
+        last_shown_id=last_progress[0] if last_progress else None,
+        catalog_size=len(catalog)
+    )
+    # Reviews still buffered by the write-behind queue are not in the database yet
+    if review_queue is not None:
+        for character_id, familiarity, *_ in review_queue.pending_for(user_id):
+            state.record_review(character_id, familiarity)
+    return state
+
+def get_scheduler_state(user_id):
+    return scheduler_states.get(user_id, _load_scheduler_state)
+
+def get_familiarity_vector(user_id):
+    """Return the user's familiarity vector as stored in the database.
+
+    Unlike the scheduler state cached per process (for up to
+    SCHEDULER_CACHE_TTL seconds), this sees reviews written by other workers.
+    """
+    vector = _load_familiarity_vector(user_id, get_catalog())
+    if review_queue is not None:
+        for character_id, familiarity, *_ in review_queue.pending_for(user_id):
+            vector[character_id] = familiarity
+    return vector
+
+def _pick_character(catalog, state, avoid_ids):
+    """Run one round of the selection algorithm for a user. The caller holds state.lock.
+
+    Characters in avoid_ids are skipped where possible; if nothing else is
+    available the algorithm may still fall back to one of them.
+    """
+    familiarity = state.familiarity
+    rank_penalties = state.rank_penalties
+    reviewed_count = len(familiarity)
+
+    # For beginners (fewer than 20 characters reviewed), focus on the absolute most common characters
+    if reviewed_count < 20:
+        base_candidates = list(catalog.top(200))
+        base_candidates.sort(key=lambda c: (c.rank + rank_penalties.get(c.id, 0), c.rank))
+        top_characters = base_candidates[:20]
         
-        # Get all character IDs that have been marked as known (familiarity = 2)
-        known_ids = [char_id for char_id, familiarity in familiarity_dict.items() if familiarity == 2]
+        # First priority: Show unreviewed characters from the top 20
+        unreviewed_top = [char for char in top_characters if char.id not in familiarity and char.id not in avoid_ids]
+        if unreviewed_top:
+            return _weighted_pick(unreviewed_top, rank_penalties)
         
-        # Count how many characters the user has reviewed
-        reviewed_count = len(familiarity_dict)
-        print(f"User has reviewed {reviewed_count} characters")
-        print(f"User knows {len(known_ids)} characters")
+        # Second priority: Show characters from top 20 that aren't well known
+        not_well_known = [char for char in top_characters if char.id in familiarity and familiarity[char.id] < 2 and char.id not in avoid_ids]
+        if not_well_known:
+            return _weighted_pick(not_well_known, rank_penalties)
         
+        # If all top 20 are known, fall through to the main algorithm
+    
+    # Decide whether to show a known character (1 in 10 chance, or about 10%).
+    # In SRS mode known characters are only shown when due (see get_next_characters).
+    show_known = SCHEDULER_MODE != 'srs' and random.random() < 0.1
+    
+    if show_known and state.known_ids:
+        # Select a known character, avoiding recently shown ones if possible
+        if state.known_sampler is None:
+            state.known_sampler = KnownSampler(catalog, rank_penalties, state.known_ids)
+        character = state.known_sampler.draw(avoid_ids)
+        if character:
+            return character
+    
+    # Main algorithm: draw from the 100 unknown characters with the lowest effective rank
+    if CANDIDATE_SOURCE == 'sql':
+        rows = [(catalog.get(char_id), rank) for char_id, rank in get_candidates_by_effective_rank(state.user_id, 100)]
+        rows = [row for row in rows if row[0]]
+        available = [row for row in rows if row[0].id not in avoid_ids] or rows
+        if available:
+            return random.choices(
+                [entry for entry, _ in available],
+                weights=[effective_weight(rank) for _, rank in available],
+                k=1
+            )[0]
+        return catalog.entries[0]
+
+    if state.window_sampler is None or state.window_sampler.is_stale():
+        state.window_sampler = RankWindowSampler(catalog, rank_penalties, state.known_ids, window_size=100)
+    character = state.window_sampler.draw(avoid_ids)
+    if character:
+        return character
+    
+    # If somehow all characters are known (extremely rare), show the most common one
+    return catalog.entries[0]
+
+def get_next_characters(user_id, count, exclude_ids=()):
+    """
+    Get up to `count` distinct characters to review, in the order they should be shown.
+    The user's state and the catalog are loaded once for the whole batch.
+    Characters in exclude_ids (e.g. cards the client already has queued) are never returned.
+    """
+    catalog = get_catalog()
+    try:
+        state = get_scheduler_state(user_id)
+
+        # First, check if we have any characters in the database
+        if state.catalog_size == 0:
+            print("No characters in database")
+            scheduler_states.invalidate(user_id)
+            return []
+
+        print(f"User has reviewed {len(state.familiarity)} characters")
+        print(f"User knows {len(state.known_ids)} characters")
+
         # Keep track of the last shown character to avoid repetition
-        last_shown_id = None
-        last_progress = UserProgress.query.filter_by(user_id=user_id).order_by(UserProgress.last_reviewed.desc()).first()
-        if last_progress:
-            last_shown_id = last_progress.character_id
+        last_shown_id = state.last_shown_id
+        if last_shown_id:
             print(f"Last shown character ID: {last_shown_id}")
-        
-        # For beginners (fewer than 20 characters reviewed), focus on the absolute most common characters
-        if reviewed_count < 20:
-            base_candidates = Character.query.order_by(Character.rank.asc()).limit(200).all()
-            base_candidates.sort(key=lambda c: (c.rank + rank_penalties.get(c.id, 0), c.rank))
-            top_characters = base_candidates[:20]
-            top_ids = [char.id for char in top_characters]
-            
-            # First priority: Show unreviewed characters from the top 20
-            unreviewed_top = [char for char in top_characters if char.id not in familiarity_dict and char.id != last_shown_id]
-            if unreviewed_top:
-                return _weighted_pick(unreviewed_top, rank_penalties)
-            
-            # Second priority: Show characters from top 20 that aren't well known
-            not_well_known = [char for char in top_characters if char.id in familiarity_dict and familiarity_dict[char.id] < 2 and char.id != last_shown_id]
-            if not_well_known:
-                return _weighted_pick(not_well_known, rank_penalties)
-            
-            # If all top 20 are known, fall through to the main algorithm
-        
-        # Decide whether to show a known character (1 in 10 chance, or about 10%)
-        show_known = random.random() < 0.1
-        
-        if show_known and known_ids:
-            # Select a random known character, avoiding the last shown one if possible
-            available_known = [char_id for char_id in known_ids if char_id != last_shown_id]
-            if not available_known and known_ids:  # If only the last shown is known
-                available_known = known_ids
-                
-            if available_known:
-                characters = Character.query.filter(Character.id.in_(available_known)).all()
-                if characters:
-                    return _weighted_pick(characters, rank_penalties)
-        
-        # Main algorithm: Get the 100 most common characters that aren't yet known
-        
-        # First, get all characters that are marked as known
-        known_characters_subquery = db.session.query(UserProgress.character_id).filter(
-            UserProgress.user_id == user_id,
-            UserProgress.familiarity == 2
-        ).subquery()
-        
-        base_candidates = Character.query.filter(
-            ~Character.id.in_(known_characters_subquery)
-        ).order_by(Character.rank.asc()).limit(300).all()
 
-        base_candidates.sort(key=lambda c: (c.rank + rank_penalties.get(c.id, 0), c.rank))
-        next_characters = base_candidates[:100]
-        
-        if next_characters:
-            # Filter out the last shown character if possible
-            available_next = [char for char in next_characters if char.id != last_shown_id]
-            if not available_next:
-                available_next = next_characters
-                
-            if available_next:
-                return _weighted_pick(available_next, rank_penalties)
-        
-        # If somehow all characters are known (extremely rare), show a random one from the top 100
-        return Character.query.order_by(Character.rank.asc()).limit(100).first()
+        picked = []
+        skip_ids = set(exclude_ids)
+        avoid_ids = set(skip_ids)
+        if last_shown_id:
+            avoid_ids.add(last_shown_id)
+
+        # In SRS mode, due reviews are shown before anything else
+        due_ids = []
+        if SCHEDULER_MODE == 'srs':
+            due_ids = get_due_character_ids(user_id, count + len(avoid_ids))
+            if review_queue is not None:
+                pending_ids = {review[0] for review in review_queue.pending_for(user_id)}
+                due_ids = [due_id for due_id in due_ids if due_id not in pending_ids]
+
+        # Reviews answered on other threads update the samplers under the same lock
+        with state.lock:
+            for _ in range(count):
+                character = None
+                while due_ids and character is None:
+                    due_id = due_ids.pop(0)
+                    if due_id not in avoid_ids:
+                        character = catalog.get(due_id)
+                if character is None:
+                    character = _pick_character(catalog, state, avoid_ids)
+                if character is None or character.id in skip_ids:
+                    break
+                picked.append(character)
+                skip_ids.add(character.id)
+                avoid_ids.add(character.id)
+        return picked
     
     except Exception as e:
-        print(f"Error in get_next_character: {e}")
+        print(f"Error in get_next_characters: {e}")
         # Fallback to a random character
-        return Character.query.order_by(db.func.random()).first()
+        return [random.choice(catalog.entries)] if len(catalog) else []
 
-def update_progress(user_id, character_id, familiarity):
+def get_next_character(user_id):
     """
-    Update the user's progress for a character.
+    Get the next character to review based on frequency and familiarity.
+    Uses a sliding window of the 100 most common characters that aren't yet known.
+    Occasionally re-tests known characters (about 1 in 20 times).
+    """
+    characters = get_next_characters(user_id, 1)
+    return characters[0] if characters else None
+
+def update_progress(user_id, character_id, familiarity, latency_ms=None):
+    """
+    Update the user's progress for a character and log the review.
     
     Args:
         user_id: The ID of the user
         character_id: The ID of the character
         familiarity: 0 (Don't know), 1 (Unsure), or 2 (Know)
+        latency_ms: How long the user took to answer, if known
     
     Returns:
         True if successful, False otherwise
     """
     try:
-        # Find existing progress record
-        progress = UserProgress.query.filter_by(user_id=user_id, character_id=character_id).first()
-        
-        if not progress:
-            # Create a new progress record
-            progress = UserProgress(
-                user_id=user_id,
-                character_id=character_id, 
-                familiarity=familiarity, 
-                last_reviewed=datetime.utcnow(),
-                review_count=1
-            )
-            
-            # Set the appropriate count based on familiarity
-            if familiarity == 0:
-                progress.dont_know_count = 1
-            elif familiarity == 1:
-                progress.unsure_count = 1
-            elif familiarity == 2:
-                progress.know_count = 1
-                
-            db.session.add(progress)
+        now = datetime.utcnow()
+        table = UserProgress.__table__
+        counter = _STATS_COUNTERS[familiarity]
+        ease, interval, due_at = next_schedule(None, None, familiarity, now)
+
+        # Insert the row or bump its counters in one statement. The unique
+        # (user_id, character_id) constraint makes concurrent reviews of the
+        # same character serialize on the row instead of duplicating it, and
+        # RETURNING hands back the familiarity it had before this review.
+        stmt = upsert_insert(table).values(
+            user_id=user_id,
+            character_id=character_id,
+            familiarity=familiarity,
+            previous_familiarity=None,
+            last_reviewed=now,
+            review_count=1,
+            know_count=int(familiarity == 2),
+            unsure_count=int(familiarity == 1),
+            dont_know_count=int(familiarity == 0),
+            due_at=due_at,
+            interval_days=interval,
+            ease=ease,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'character_id'],
+            set_={
+                'previous_familiarity': table.c.familiarity,
+                'familiarity': familiarity,
+                'last_reviewed': now,
+                'review_count': table.c.review_count + 1,
+                counter: table.c[counter] + 1,
+                **_sql_schedule(table, familiarity, now),
+            }
+        ).returning(table.c.previous_familiarity)
+
+        if db.engine.dialect.name == 'postgresql':
+            _write_review(stmt, user_id, character_id, familiarity, latency_ms, now)
         else:
-            # Update existing record
-            progress.familiarity = familiarity
-            progress.last_reviewed = datetime.utcnow()
-            progress.review_count += 1
-            
-            # Increment the appropriate count based on familiarity
-            if familiarity == 0:
-                progress.dont_know_count += 1
-            elif familiarity == 1:
-                progress.unsure_count += 1
-            elif familiarity == 2:
-                progress.know_count += 1
+            old_familiarity = db.session.execute(stmt).scalar()
+            db.session.execute(db.insert(ReviewEvent).values(
+                user_id=user_id,
+                character_id=character_id,
+                familiarity=familiarity,
+                previous_familiarity=old_familiarity,
+                reviewed_at=now,
+                latency_ms=latency_ms,
+            ))
+            sync_familiarity_vector(user_id, {character_id: familiarity})
+            apply_stats_delta(user_id, old_familiarity, familiarity)
         
         db.session.commit()
+        scheduler_states.record_review(user_id, character_id, familiarity)
         return True
     except Exception as e:
         print(f"Error updating progress: {e}")
         db.session.rollback()
         return False
+
+def _write_review(upsert, user_id, character_id, familiarity, latency_ms, now):
+    """Apply one review on PostgreSQL with a single statement.
+
+    The progress upsert runs as a data-modifying CTE whose RETURNING feeds the
+    ReviewEvent insert, the UserStats counters and the familiarity vector byte,
+    so a review is one round trip. A missing stats or vector row (new user,
+    changed catalog) is rebuilt afterwards, in the same transaction.
+    """
+    up = upsert.cte('up')
+    previous = up.c.previous_familiarity
+
+    event = db.insert(ReviewEvent).from_select(
+        ['user_id', 'character_id', 'familiarity', 'previous_familiarity', 'reviewed_at', 'latency_ms'],
+        db.select(
+            db.literal(user_id), db.literal(character_id), db.literal(familiarity), previous,
+            db.literal(now), db.literal(latency_ms, db.Integer)
+        ).select_from(up)
+    ).cte('event')
+
+    # Same arithmetic as _stats_deltas, with the previous familiarity taken from the upsert
+    stats_table = UserStats.__table__
+    changed = db.case((previous.is_distinct_from(familiarity), 1), else_=0)
+    counters = {'reviewed_count': stats_table.c.reviewed_count + db.case((previous.is_(None), 1), else_=0)}
+    for level, name in _STATS_COUNTERS.items():
+        if level == familiarity:
+            counters[name] = stats_table.c[name] + changed
+        else:
+            counters[name] = stats_table.c[name] - db.case((previous == level, 1), else_=0)
+    stats = db.update(stats_table).where(stats_table.c.user_id == user_id).values(
+        updated_at=now, **counters
+    ).returning(stats_table.c.user_id).cte('stats')
+    updated = [db.select(db.func.count()).select_from(stats).scalar_subquery()]
+
+    catalog = get_catalog()
+    position = catalog.position(character_id)
+    if position is not None:
+        vector_table = UserFamiliarityVector.__table__
+        vector = db.update(vector_table).where(
+            vector_table.c.user_id == user_id, vector_table.c.catalog_size == len(catalog)
+        ).values(
+            data=db.func.set_byte(vector_table.c.data, position, familiarity + 1, type_=db.LargeBinary),
+            updated_at=now,
+        ).returning(vector_table.c.user_id).cte('vector')
+        updated.append(db.select(db.func.count()).select_from(vector).scalar_subquery())
+
+    row = db.session.execute(db.select(previous, *updated).select_from(up).add_cte(event)).one()
+    if not row[1]:
+        recompute_user_stats(user_id)
+    if position is not None and not row[2]:
+        sync_familiarity_vector(user_id)
+    return row[0]
+
+def upsert_insert(model):
+    """Return an INSERT for the active database that supports ON CONFLICT."""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# IDs per IN (...) lookup; keeps SQLite under its bound-parameter limit
+BULK_CHUNK_SIZE = 500
+
+def bulk_update_progress(user_id, reviews, log_events=True):
+    """
+    Apply many reviews for one user in a single transaction.
+
+    Has the same effect as calling update_progress once per review, in order
+    (see write_reviews), and commits.
+
+    Args:
+        user_id: The ID of the user
+        reviews: (character_id, familiarity[, reviewed_at[, latency_ms[, client_event_id]]])
+            tuples in the order they happened; character IDs must exist
+        log_events: Whether to append ReviewEvent rows (imports are not reviews)
+
+    Returns:
+        True if successful, False otherwise
+    """
+    try:
+        final_familiarity = write_reviews(user_id, reviews, log_events)
+        db.session.commit()
+        for character_id, familiarity in final_familiarity.items():
+            scheduler_states.record_review(user_id, character_id, familiarity)
+        return True
+    except Exception as e:
+        print(f"Error bulk updating progress: {e}")
+        db.session.rollback()
+        return False
+
+def write_reviews(user_id, reviews, log_events=True):
+    """
+    Write many reviews for one user inside the current transaction.
+
+    Resolves existing rows with one IN query per chunk and writes them with
+    a single executemany INSERT ... ON CONFLICT DO UPDATE (batched into
+    multi-VALUES statements by SQLAlchemy's insertmanyvalues), then updates
+    the familiarity vector and stats. Takes the same arguments as
+    bulk_update_progress; errors are raised and the caller commits.
+
+    Returns:
+        {character_id: familiarity} after the reviews
+    """
+    now = datetime.utcnow()
+
+    # Coalesce repeated reviews of the same character
+    merged = {}
+    for review in reviews:
+        character_id, familiarity = review[0], review[1]
+        reviewed_at = review[2] if len(review) > 2 and review[2] else now
+        latency_ms = review[3] if len(review) > 3 else None
+        client_event_id = review[4] if len(review) > 4 else None
+        merged.setdefault(character_id, []).append((familiarity, reviewed_at, latency_ms, client_event_id))
+    if not merged:
+        return {}
+
+    character_ids = list(merged)
+    existing = {}
+    for chunk in _chunks(character_ids, BULK_CHUNK_SIZE):
+        rows = db.session.query(
+            UserProgress.character_id, UserProgress.familiarity, UserProgress.ease,
+            UserProgress.interval_days, UserProgress.due_at, UserProgress.last_reviewed
+        ).filter(UserProgress.user_id == user_id, UserProgress.character_id.in_(chunk))
+        for row in rows:
+            existing[row[0]] = tuple(row[1:])
+
+    values = []
+    events = []
+    stats_changes = []
+    final_familiarity = {}
+    for character_id, history in merged.items():
+        old_familiarity, old_ease, old_interval, old_due_at, old_reviewed = existing.get(character_id, (None,) * 5)
+        ease, interval = old_ease, old_interval
+        counts = {0: 0, 1: 0, 2: 0}
+        due_at = None
+        previous = old_familiarity
+        for familiarity, reviewed_at, latency_ms, client_event_id in history:
+            counts[familiarity] += 1
+            ease, interval, due_at = next_schedule(ease, interval, familiarity, reviewed_at)
+            events.append({
+                'user_id': user_id,
+                'character_id': character_id,
+                'familiarity': familiarity,
+                'previous_familiarity': previous,
+                'reviewed_at': reviewed_at,
+                'latency_ms': latency_ms,
+                'client_event_id': client_event_id,
+            })
+            previous = familiarity
+        familiarity = history[-1][0]
+        last_reviewed = max(reviewed_at for _, reviewed_at, _, _ in history)
+        if old_reviewed is not None and last_reviewed < old_reviewed:
+            # Every review here predates the stored one (e.g. synced late
+            # from an offline device): count them, but keep the newer state
+            familiarity, ease, interval, due_at, last_reviewed = (
+                old_familiarity, old_ease, old_interval, old_due_at, old_reviewed
+            )
+        final_familiarity[character_id] = familiarity
+        stats_changes.append((old_familiarity, familiarity))
+        values.append({
+            'user_id': user_id,
+            'character_id': character_id,
+            'familiarity': familiarity,
+            'previous_familiarity': old_familiarity,
+            'last_reviewed': last_reviewed,
+            'review_count': len(history),
+            'know_count': counts[2],
+            'unsure_count': counts[1],
+            'dont_know_count': counts[0],
+            'due_at': due_at,
+            'interval_days': interval,
+            'ease': ease,
+        })
+
+    table = UserProgress.__table__
+    stmt = upsert_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'character_id'],
+        set_={
+            'previous_familiarity': table.c.familiarity,
+            'familiarity': stmt.excluded.familiarity,
+            'last_reviewed': stmt.excluded.last_reviewed,
+            'review_count': table.c.review_count + stmt.excluded.review_count,
+            'know_count': table.c.know_count + stmt.excluded.know_count,
+            'unsure_count': table.c.unsure_count + stmt.excluded.unsure_count,
+            'dont_know_count': table.c.dont_know_count + stmt.excluded.dont_know_count,
+            'due_at': stmt.excluded.due_at,
+            'interval_days': stmt.excluded.interval_days,
+            'ease': stmt.excluded.ease,
+        }
+    )
+    db.session.execute(stmt, values)
+    if log_events:
+        db.session.execute(db.insert(ReviewEvent), events)
+
+    sync_familiarity_vector(user_id, final_familiarity)
+    _increment_stats(user_id, _stats_deltas(stats_changes))
+
+    return final_familiarity
+
+def merge_duplicate_progress():
+    """
+    Merge duplicate UserProgress rows for the same user and character.
+
+    Databases created before the unique (user_id, character_id) constraint can
+    hold several rows per pair. The most recently reviewed row is kept with the
+    review counters of all rows added up; the others are deleted. The caller
+    commits.
+
+    Returns:
+        The number of rows deleted
+    """
+    pairs = db.session.query(UserProgress.user_id, UserProgress.character_id).group_by(
+        UserProgress.user_id, UserProgress.character_id
+    ).having(db.func.count(UserProgress.id) > 1).all()
+
+    removed = 0
+    for user_id, character_id in pairs:
+        rows = UserProgress.query.filter_by(user_id=user_id, character_id=character_id).all()
+        rows.sort(key=lambda row: (row.last_reviewed or datetime.min, row.id), reverse=True)
+        keep = rows[0]
+        for column in ('review_count', 'know_count', 'unsure_count', 'dont_know_count'):
+            setattr(keep, column, sum(getattr(row, column) or 0 for row in rows))
+        for row in rows[1:]:
+            db.session.delete(row)
+        removed += len(rows) - 1
+    db.session.flush()
+
+    # Derived per-user data was built from the duplicated rows
+    for user_id in {user_id for user_id, _ in pairs}:
+        sync_familiarity_vector(user_id)
+        recompute_user_stats(user_id)
+        scheduler_states.invalidate(user_id)
+    return removed
+
+def _aggregate_review_days(*criteria):
+    """Yield (user_id, day, reviews, new_known, lapses) for ReviewEvent rows matching criteria."""
+    day = db.func.date(ReviewEvent.reviewed_at)
+    new_known = db.case(
+        ((ReviewEvent.familiarity == 2) &
+         (ReviewEvent.previous_familiarity.is_(None) | (ReviewEvent.previous_familiarity != 2)), 1),
+        else_=0
+    )
+    lapse = db.case(((ReviewEvent.previous_familiarity == 2) & (ReviewEvent.familiarity != 2), 1), else_=0)
+
+    rows = db.session.query(
+        ReviewEvent.user_id, day, db.func.count(ReviewEvent.id), db.func.sum(new_known), db.func.sum(lapse)
+    ).filter(*criteria).group_by(ReviewEvent.user_id, day)
+    for user_id, review_day, reviews, new, lapses in rows:
+        # SQLite returns date() as text
+        if isinstance(review_day, str):
+            review_day = date.fromisoformat(review_day)
+        yield user_id, review_day, reviews, new or 0, lapses or 0
+
+def rollup_reviews(since=None):
+    """
+    Materialize ReviewDailyRollup rows from ReviewEvent with one GROUP BY.
+
+    Every day from `since` onwards is recomputed. By default that is the most
+    recent day already rolled up (it may have been partial when it was built),
+    so running this regularly only ever scans new events. The caller commits.
+
+    Returns:
+        The number of rollup rows written
+    """
+    if since is None:
+        since = db.session.query(db.func.max(ReviewDailyRollup.day)).scalar()
+    criteria = []
+    if since is not None:
+        criteria.append(ReviewEvent.reviewed_at >= datetime.combine(since, datetime.min.time()))
+
+    now = datetime.utcnow()
+    values = [
+        {'user_id': user_id, 'day': review_day, 'reviews': reviews,
+         'new_known': new_known, 'lapses': lapses, 'updated_at': now}
+        for user_id, review_day, reviews, new_known, lapses in _aggregate_review_days(*criteria)
+    ]
+    if values:
+        stmt = upsert_insert(ReviewDailyRollup.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'day'],
+            set_={
+                'reviews': stmt.excluded.reviews,
+                'new_known': stmt.excluded.new_known,
+                'lapses': stmt.excluded.lapses,
+                'updated_at': stmt.excluded.updated_at,
+            }
+        )
+        db.session.execute(stmt, values)
+    return len(values)
+
+def get_review_history(user_id, days=90):
+    """
+    Return the user's daily review counts for the last `days` days, oldest first.
+
+    Days already rolled up are read from ReviewDailyRollup; days after the
+    last rollup (normally just today) are aggregated from ReviewEvent.
+    """
+    today = datetime.utcnow().date()
+    start = today - timedelta(days=days - 1)
+
+    history = {
+        row.day: (row.reviews, row.new_known, row.lapses)
+        for row in ReviewDailyRollup.query.filter(ReviewDailyRollup.user_id == user_id, ReviewDailyRollup.day >= start)
+    }
+    live_from = max([start] + list(history))
+    for _, review_day, reviews, new_known, lapses in _aggregate_review_days(
+        ReviewEvent.user_id == user_id,
+        ReviewEvent.reviewed_at >= datetime.combine(live_from, datetime.min.time())
+    ):
+        history[review_day] = (reviews, new_known, lapses)
+
+    return [
+        {'day': review_day.isoformat(), 'reviews': reviews, 'new_known': new_known, 'lapses': lapses}
+        for review_day, (reviews, new_known, lapses) in sorted(history.items())
+    ]
+
+# List pages: familiarity shown, and how many "not known" answers sort a character to the top
+CHARACTER_LIST_CATEGORIES = {
+    'known': (2, lambda: UserProgress.dont_know_count + UserProgress.unsure_count),
+    'unsure': (1, lambda: UserProgress.unsure_count),
+    'unknown': (0, lambda: UserProgress.dont_know_count),
+}
+_NEVER = datetime(1970, 1, 1)
+
+def _encode_cursor(user_id, category, misses, last_reviewed, progress_id):
+    raw = json.dumps([user_id, category, misses, last_reviewed.isoformat(), progress_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _decode_cursor(cursor, user_id, category):
+    """Inverse of _encode_cursor; raises ValueError for anything it did not produce for this user and list."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_user_id, cursor_category, misses, last_reviewed, progress_id = json.loads(raw)
+        if (cursor_user_id, cursor_category) != (user_id, category):
+            raise ValueError('Cursor belongs to another list')
+        return int(misses), datetime.fromisoformat(last_reviewed), int(progress_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def get_character_page(user_id, category, cursor=None, limit=60):
+    """
+    One page of a character list (/known, /unsure, /unknown).
+
+    Characters are ordered by how often they were not known, then by most
+    recent review (ties in the order the rows were created), in SQL, and
+    paged by keyset: the cursor holds the sort key of the last row shown, so
+    later pages cost the same as the first.
+
+    With the write-behind queue, a character whose buffered review moves it
+    to another list is left out at once, but it only shows up in its new
+    list (with updated counts) once the review is flushed, within
+    WRITE_BEHIND_FLUSH_MS.
+
+    Returns:
+        (characters, next_cursor), where next_cursor is None on the last page.
+        Raises ValueError for an unknown category or invalid cursor.
+    """
+    if category not in CHARACTER_LIST_CATEGORIES:
+        raise ValueError(f'Unknown category {category!r}')
+    familiarity, misses_expr = CHARACTER_LIST_CATEGORIES[category]
+    misses = db.func.coalesce(misses_expr(), 0)
+    last_reviewed = db.func.coalesce(UserProgress.last_reviewed, db.literal(_NEVER, db.DateTime))
+
+    query = db.session.query(
+        UserProgress.id, misses, last_reviewed, Character.id, Character.hanzi, Character.pinyin, Character.meaning,
+        UserProgress.review_count, UserProgress.know_count, UserProgress.unsure_count, UserProgress.dont_know_count
+    ).join(
+        Character, Character.id == UserProgress.character_id
+    ).filter(
+        UserProgress.user_id == user_id, UserProgress.familiarity == familiarity
+    )
+    if cursor:
+        after_misses, after_reviewed, after_id = _decode_cursor(cursor, user_id, category)
+        # Negating the id turns the mixed sort directions into one tuple comparison
+        query = query.filter(db.tuple_(misses, last_reviewed, -UserProgress.id) < db.tuple_(
+            db.literal(after_misses), db.literal(after_reviewed, db.DateTime), db.literal(-after_id)
+        ))
+    rows = query.order_by(misses.desc(), last_reviewed.desc(), UserProgress.id.asc()).limit(limit + 1).all()
+
+    pending = _pending_familiarity(user_id)
+    characters = [{
+        'id': character_id,
+        'hanzi': hanzi,
+        'pinyin': pinyin,
+        'meaning': meaning,
+        'last_reviewed': reviewed,
+        'review_count': review_count or 0,
+        'know_count': know_count or 0,
+        'unsure_count': unsure_count or 0,
+        'dont_know_count': dont_know_count or 0
+    } for _, _, reviewed, character_id, hanzi, pinyin, meaning, review_count, know_count, unsure_count, dont_know_count
+        in rows[:limit] if pending.get(character_id, familiarity) == familiarity]
+    next_cursor = None
+    if len(rows) > limit:
+        progress_id, row_misses, reviewed = rows[limit - 1][:3]
+        next_cursor = _encode_cursor(user_id, category, row_misses, reviewed, progress_id)
+    return characters, next_cursor
+
+def sync_reviews(user_id, events):
+    """
+    Apply a batch of reviews recorded offline, ignoring ones already applied.
+
+    Args:
+        user_id: The ID of the user
+        events: (client_event_id, character_id, familiarity, reviewed_at, latency_ms)
+            tuples; character IDs must exist
+
+    Returns:
+        (applied, duplicates) counts, or None if the batch could not be written
+    """
+    # Apply in the order the reviews happened; a retried event id counts once
+    unique = {}
+    for event in sorted(events, key=lambda event: event[3]):
+        unique.setdefault(event[0], event)
+    duplicates = len(events) - len(unique)
+
+    # A concurrent retry of the same batch can insert the same event ids between
+    # the check and the write; the unique index then fails the whole
+    # transaction and the second attempt filters them out.
+    for _ in range(2):
+        seen = set()
+        for chunk in _chunks(list(unique), BULK_CHUNK_SIZE):
+            seen.update(row[0] for row in db.session.query(ReviewEvent.client_event_id).filter(
+                ReviewEvent.user_id == user_id, ReviewEvent.client_event_id.in_(chunk)
+            ))
+        reviews = [
+            (character_id, familiarity, reviewed_at, latency_ms, client_event_id)
+            for client_event_id, character_id, familiarity, reviewed_at, latency_ms in unique.values()
+            if client_event_id not in seen
+        ]
+        if bulk_update_progress(user_id, reviews):
+            return len(reviews), duplicates + len(seen)
+    return None
+
+def _apply_buffered_reviews(user_id, reviews):
+    """Write a write-behind batch; reviews already applied before a crash are skipped by their queue id."""
+    events = [
+        (review_id, character_id, familiarity, reviewed_at, latency_ms)
+        for character_id, familiarity, reviewed_at, latency_ms, review_id in reviews
+    ]
+    return sync_reviews(user_id, events) is not None
+
+def import_progress_rows(user_id, rows):
+    """
+    Overwrite progress rows with imported values in bulk.
+
+    Unlike bulk_update_progress, counters are replaced rather than added to,
+    and no review events or stats updates are written: the caller rebuilds
+    the familiarity vector and stats once the whole import is done, and
+    commits.
+
+    Args:
+        user_id: The ID of the user
+        rows: dicts with character_id, familiarity, review_count, know_count,
+            unsure_count, dont_know_count and last_reviewed
+    """
+    if not rows:
+        return
+    values = [dict(
+        row,
+        user_id=user_id,
+        # Imported known characters come due from their last review
+        due_at=row['last_reviewed'] if row['familiarity'] == 2 else None,
+        interval_days=0,
+        ease=2.5,
+    ) for row in rows]
+    stmt = upsert_insert(UserProgress.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'character_id'],
+        set_={name: stmt.excluded[name] for name in (
+            'familiarity', 'review_count', 'know_count', 'unsure_count',
+            'dont_know_count', 'last_reviewed', 'due_at'
+        )}
+    )
+    db.session.execute(stmt, values)
+
+def import_rank_penalties(user_id, penalties):
+    """Set many rank penalties ({character_id: penalty}) in bulk. The caller commits."""
+    if not penalties:
+        return
+    stmt = upsert_insert(UserCharacterTuning.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'character_id'],
+        set_={'rank_penalty': stmt.excluded.rank_penalty}
+    )
+    db.session.execute(stmt, [
+        {'user_id': user_id, 'character_id': character_id, 'rank_penalty': penalty}
+        for character_id, penalty in penalties.items()
+    ])
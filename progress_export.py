@@ -0,0 +1,180 @@
+"""Streaming export of a user's progress in the /api/export-progress format.
+
+The document is produced section by section from a few queries read with
+yield_per, so memory use stays flat however many characters a user has
+reviewed. The output is the same as json.dumps(..., ensure_ascii=False,
+indent=2) of the whole document would produce.
+
+The encoded document is spooled to a temporary file (see spool_chunks) and
+only sent once it is complete, so a failed export is an error response
+rather than a truncated download.
+"""
+import json
+import tempfile
+import zlib
+
+import snapshot
+from models import db, Character, UserProgress, UserCharacterTuning
+
+EXPORT_FETCH_SIZE = 1000
+EXPORT_SPOOL_BYTES = 4 * 1024 * 1024  # Exports larger than this are spooled on disk instead of in memory
+_FAMILIARITY_LISTS = (('know', 2), ('unsure', 1), ('dont_know', 0))
+
+
+def _dumps(value, depth):
+    """Serialize value as json.dumps(indent=2) would when nested `depth` levels deep."""
+    text = json.dumps(value, ensure_ascii=False, indent=2)
+    # json.dumps escapes newlines inside strings, so every '\n' is layout
+    return text.replace('\n', '\n' + '  ' * depth)
+
+
+def _section(name, items, is_object, last=False):
+    """Yield one top-level member: `"name": [...]` or `"name": {...}` from (key, value) or value items."""
+    open_char, close_char = ('{', '}') if is_object else ('[', ']')
+    yield f'  {_dumps(name, 1)}: {open_char}'
+    empty = True
+    for item in items:
+        prefix = '\n    ' if empty else ',\n    '
+        empty = False
+        if is_object:
+            key, value = item
+            yield f'{prefix}{_dumps(key, 2)}: {_dumps(value, 2)}'
+        else:
+            yield f'{prefix}{_dumps(item, 2)}'
+    closing = close_char if empty else f'\n  {close_char}'
+    yield closing + ('\n' if last else ',\n')
+
+
+def _hanzi_with_familiarity(user_id, familiarity):
+    query = db.session.query(Character.hanzi).join(
+        UserProgress, UserProgress.character_id == Character.id
+    ).filter(
+        UserProgress.user_id == user_id, UserProgress.familiarity == familiarity
+    ).order_by(UserProgress.id).execution_options(yield_per=EXPORT_FETCH_SIZE)
+    for (hanzi,) in query:
+        yield hanzi
+
+
+def _detailed(user_id):
+    """(hanzi, details) for every progress row: progress ⟕ character ⟕ tuning in one query."""
+    query = db.session.query(
+        Character.hanzi, UserProgress.familiarity, UserProgress.review_count, UserProgress.know_count,
+        UserProgress.unsure_count, UserProgress.dont_know_count, UserProgress.last_reviewed,
+        UserCharacterTuning.rank_penalty
+    ).join(
+        Character, Character.id == UserProgress.character_id
+    ).outerjoin(
+        UserCharacterTuning,
+        (UserCharacterTuning.user_id == UserProgress.user_id) &
+        (UserCharacterTuning.character_id == UserProgress.character_id)
+    ).filter(UserProgress.user_id == user_id).order_by(UserProgress.id).execution_options(
+        yield_per=EXPORT_FETCH_SIZE
+    )
+    for hanzi, familiarity, review_count, know_count, unsure_count, dont_know_count, last_reviewed, rank_penalty in query:
+        yield hanzi, {
+            "familiarity": familiarity,
+            "review_count": review_count,
+            "know_count": know_count,
+            "unsure_count": unsure_count,
+            "dont_know_count": dont_know_count,
+            "last_reviewed": last_reviewed.isoformat() if last_reviewed else None,
+            "rank_penalty": rank_penalty or 0
+        }
+
+
+def _tuning(user_id):
+    query = db.session.query(Character.hanzi, UserCharacterTuning.rank_penalty).join(
+        Character, Character.id == UserCharacterTuning.character_id
+    ).filter(UserCharacterTuning.user_id == user_id).order_by(UserCharacterTuning.id).execution_options(
+        yield_per=EXPORT_FETCH_SIZE
+    )
+    for hanzi, rank_penalty in query:
+        yield hanzi, {"rank_penalty": rank_penalty}
+
+
+def export_progress(user_id):
+    """Yield the user's progress export as text chunks."""
+    yield '{\n'
+    for name, familiarity in _FAMILIARITY_LISTS:
+        yield from _section(name, _hanzi_with_familiarity(user_id, familiarity), is_object=False)
+    yield from _section('detailed', _detailed(user_id), is_object=True)
+    yield from _section('tuning', _tuning(user_id), is_object=True, last=True)
+    yield '}'
+
+
+def _snapshot_records(user_id):
+    """RECORD tuples for every progress row, then for tuning rows without progress."""
+    progress = db.session.query(
+        Character.rank, UserProgress.familiarity, UserProgress.review_count, UserProgress.know_count,
+        UserProgress.unsure_count, UserProgress.dont_know_count, UserProgress.last_reviewed,
+        UserCharacterTuning.rank_penalty
+    ).join(
+        Character, Character.id == UserProgress.character_id
+    ).outerjoin(
+        UserCharacterTuning,
+        (UserCharacterTuning.user_id == UserProgress.user_id) &
+        (UserCharacterTuning.character_id == UserProgress.character_id)
+    ).filter(UserProgress.user_id == user_id).order_by(UserProgress.id).execution_options(
+        yield_per=EXPORT_FETCH_SIZE
+    )
+    for rank, familiarity, review_count, know_count, unsure_count, dont_know_count, last_reviewed, rank_penalty in progress:
+        flags = snapshot.HAS_PROGRESS | (snapshot.HAS_TUNING if rank_penalty is not None else 0)
+        yield (rank, familiarity or 0, flags, 0, review_count or 0, know_count or 0, unsure_count or 0,
+               dont_know_count or 0, snapshot.to_micros(last_reviewed), rank_penalty or 0)
+
+    has_progress = db.session.query(UserProgress.id).filter(
+        UserProgress.user_id == UserCharacterTuning.user_id,
+        UserProgress.character_id == UserCharacterTuning.character_id
+    ).exists()
+    tuning = db.session.query(Character.rank, UserCharacterTuning.rank_penalty).join(
+        Character, Character.id == UserCharacterTuning.character_id
+    ).filter(UserCharacterTuning.user_id == user_id, ~has_progress).order_by(UserCharacterTuning.id).execution_options(
+        yield_per=EXPORT_FETCH_SIZE
+    )
+    for rank, rank_penalty in tuning:
+        yield (rank, 0, snapshot.HAS_TUNING, 0, 0, 0, 0, 0, 0, rank_penalty or 0)
+
+
+def export_snapshot(user_id):
+    """Return the user's progress as a binary snapshot (see snapshot.py)."""
+    return snapshot.pack(_snapshot_records(user_id))
+
+
+def encode_chunks(chunks, gzip=False, buffer_size=64 * 1024):
+    """Encode text chunks as UTF-8 (optionally gzip-compressed) blocks of about buffer_size bytes."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    pending = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            block = b''.join(pending)
+            pending, size = [], 0
+            block = compressor.compress(block) if compressor else block
+            if block:
+                yield block
+    block = b''.join(pending)
+    if compressor:
+        block = compressor.compress(block) + compressor.flush()
+    if block:
+        yield block
+
+
+def spool_chunks(blocks, max_size=EXPORT_SPOOL_BYTES):
+    """Write every block to a temporary file and return (file rewound to the start, size in bytes).
+
+    Errors while the blocks are generated are raised here, before a response
+    has been started. The caller closes the file.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+    try:
+        for block in blocks:
+            spool.write(block)
+        size = spool.tell()
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool, size
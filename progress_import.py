@@ -0,0 +1,366 @@
+"""Streaming import of progress files written by /api/export-progress.
+
+The upload is decoded and parsed incrementally, one member of the
+"detailed"/"tuning" objects or one element of the "know"/"unsure"/"dont_know"
+lists at a time, so memory use does not grow with the file size. Parsed
+entries are resolved against the in-memory catalog and written with bulk
+upserts in batches of IMPORT_BATCH_SIZE.
+"""
+import codecs
+import json
+import zlib
+from datetime import datetime
+
+import snapshot
+from models import (db, get_catalog, import_progress_rows, import_rank_penalties, write_reviews,
+                    sync_familiarity_vector, recompute_user_stats, scheduler_states)
+
+IMPORT_BATCH_SIZE = 500
+_FAMILIARITY_LISTS = {'know': 2, 'unsure': 1, 'dont_know': 0}
+
+
+class ProgressFormatError(ValueError):
+    """The file is JSON, but not a progress object."""
+
+
+class JSONStreamReader:
+    """Incremental reader for one JSON document from a binary stream.
+
+    Containers are walked token by token; only the values handed out by
+    value() are fully decoded, so a large object can be consumed member by
+    member. Gzip-compressed input is detected and decompressed on the fly.
+    """
+
+    def __init__(self, stream, chunk_size=64 * 1024, max_value_size=1024 * 1024):
+        self._stream = stream
+        self._decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._json = json.JSONDecoder()
+        self._chunk_size = chunk_size
+        self._max_value_size = max_value_size
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._started = False
+        self._inflate = None
+
+    def _read(self):
+        """Return the next block of (decompressed) input, b'' at the end."""
+        inflate = self._inflate
+        while True:
+            if inflate is not None and inflate.unconsumed_tail:
+                return inflate.decompress(inflate.unconsumed_tail, self._chunk_size)
+            data = self._stream.read(max(self._chunk_size, 2))
+            if not self._started:
+                self._started = True
+                if data[:2] == b'\x1f\x8b':
+                    inflate = self._inflate = zlib.decompressobj(wbits=31)
+            if inflate is None:
+                return data
+            if not data:
+                return inflate.flush()
+            # Bounded output keeps a small, highly compressed upload from expanding all at once
+            data = inflate.decompress(data, self._chunk_size)
+            if data:
+                return data
+
+    def _fill(self):
+        """Read another chunk into the buffer. Returns False at end of input."""
+        if self._eof:
+            return False
+        data = self._read()
+        self._eof = not data
+        text = self._decoder.decode(data or b'', final=self._eof)
+        # Drop what has been consumed so the buffer stays around one chunk
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+        return bool(text) or not self._eof
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at end of input)."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self._pos}")
+        self._pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+                # A number cut off by the end of the buffer (e.g. "12" of "12.5e3")
+                # may continue in the next chunk
+                if self._eof or (end < len(self._buf) and self._buf[end] not in '.eE+-'):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof or len(self._buf) - self._pos > self._max_value_size:
+                    raise
+            self._fill()
+
+    def members(self):
+        """Iterate over the (key, ...) members of an object; the caller consumes each value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError('Object keys must be strings')
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self._pos += 1
+                continue
+            self.expect('}')
+            return
+
+    def items(self):
+        """Iterate over the elements of an array; the caller consumes each one."""
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ',':
+                self._pos += 1
+                continue
+            self.expect(']')
+            return
+
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _progress_row(character_id, details, now):
+    familiarity = details.get('familiarity', 0)
+    if familiarity not in (0, 1, 2):
+        raise ValueError(f'Invalid familiarity {familiarity!r}')
+    try:
+        last_reviewed = datetime.fromisoformat(details['last_reviewed'])
+    except (KeyError, TypeError, ValueError):
+        last_reviewed = now
+    return {
+        'character_id': character_id,
+        'familiarity': familiarity,
+        'review_count': _int(details.get('review_count')),
+        'know_count': _int(details.get('know_count')),
+        'unsure_count': _int(details.get('unsure_count')),
+        'dont_know_count': _int(details.get('dont_know_count')),
+        'last_reviewed': last_reviewed,
+    }
+
+
+def import_progress(user_id, stream, details=True):
+    """
+    Import a progress file for a user, yielding progress as it goes.
+
+    Yields dicts with a "type" of:
+      - "detail": one per character (only when details is True)
+      - "progress": after every batch written, with the number of entries processed
+      - "result": once at the end, with the summary counts
+
+    The "know"/"unsure"/"dont_know" lists are only applied when the file has
+    no "detailed" section. Nothing is committed until the whole file has been
+    parsed; a ValueError is raised (after rolling back) if it is not valid
+    JSON.
+    """
+    catalog = get_catalog()
+    now = datetime.utcnow()
+    reader = JSONStreamReader(stream)
+    results = {'success': 0, 'failed': 0, 'not_found': 0, 'know': 0, 'unsure': 0, 'dont_know': 0}
+    processed = 0
+
+    saw_detailed = False
+    progress_batch = {}  # character_id -> row; one upsert cannot touch a row twice
+    # Tuning and list entries are small and bounded by the catalog size. List
+    # entries are only needed if no "detailed" section turns up.
+    penalties = {}
+    list_reviews = []
+    list_not_found = []
+
+    def flush_progress():
+        import_progress_rows(user_id, list(progress_batch.values()))
+        progress_batch.clear()
+
+    try:
+        if reader.peek() != '{':
+            raise ProgressFormatError('Invalid progress data format')
+
+        for key in reader.members():
+            if key == 'detailed' and reader.peek() == '{':
+                saw_detailed = True
+                for hanzi in reader.members():
+                    entry = reader.value()
+                    processed += 1
+                    character = catalog.by_hanzi(hanzi)
+                    if not character:
+                        results['not_found'] += 1
+                        if details:
+                            yield {'type': 'detail', 'character': hanzi, 'status': 'not_found'}
+                        continue
+                    try:
+                        row = _progress_row(character.id, entry if isinstance(entry, dict) else {}, now)
+                    except ValueError:
+                        results['failed'] += 1
+                        if details:
+                            yield {'type': 'detail', 'character': hanzi, 'status': 'failed'}
+                        continue
+                    progress_batch[character.id] = row
+                    results['success'] += 1
+                    results[('dont_know', 'unsure', 'know')[row['familiarity']]] += 1
+                    if details:
+                        yield {'type': 'detail', 'character': hanzi, 'status': 'success',
+                               'familiarity': row['familiarity']}
+                    if len(progress_batch) >= IMPORT_BATCH_SIZE:
+                        flush_progress()
+                        yield {'type': 'progress', 'processed': processed}
+
+            elif key == 'tuning' and reader.peek() == '{':
+                for hanzi in reader.members():
+                    tuning = reader.value()
+                    character = catalog.by_hanzi(hanzi)
+                    if not character:
+                        continue
+                    rank_penalty = tuning.get('rank_penalty', 0) if isinstance(tuning, dict) else tuning
+                    penalties[character.id] = _int(rank_penalty)
+
+            elif key in _FAMILIARITY_LISTS and reader.peek() == '[':
+                familiarity = _FAMILIARITY_LISTS[key]
+                for _ in reader.items():
+                    hanzi = reader.value()
+                    character = catalog.by_hanzi(hanzi) if isinstance(hanzi, str) else None
+                    if not character:
+                        list_not_found.append(hanzi)
+                        continue
+                    list_reviews.append((character.id, familiarity, hanzi, key))
+
+            else:
+                reader.value()  # Skip sections this importer does not know
+
+        if reader.peek() != '':
+            raise ValueError('Unexpected data after the progress object')
+
+        if saw_detailed:
+            flush_progress()
+        elif list_reviews or list_not_found:
+            # Lists are applied in order (know, unsure, dont_know), so a
+            # character listed twice ends up with the later level
+            list_reviews.sort(key=lambda review: -review[1])
+            for hanzi in list_not_found:
+                results['not_found'] += 1
+                if details:
+                    yield {'type': 'detail', 'character': hanzi, 'status': 'not_found'}
+            # Written in this transaction; a failure rolls back the whole import
+            write_reviews(
+                user_id, [(character_id, familiarity) for character_id, familiarity, _, _ in list_reviews],
+                log_events=False
+            )
+            for _, _, hanzi, key in list_reviews:
+                processed += 1
+                results['success'] += 1
+                results[key] += 1
+                if details:
+                    yield {'type': 'detail', 'character': hanzi, 'status': 'success', 'familiarity': key}
+
+        import_rank_penalties(user_id, penalties)
+        sync_familiarity_vector(user_id)
+        recompute_user_stats(user_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        scheduler_states.invalidate(user_id)
+
+    yield {'type': 'progress', 'processed': processed}
+    yield {
+        'type': 'result',
+        'success': True,
+        'message': f"Successfully imported {results['success']} characters ({results['know']} known, {results['unsure']} unsure, {results['dont_know']} don't know). {results['not_found']} not found, {results['failed']} failed.",
+        'results': results,
+    }
+
+
+def import_snapshot(user_id, data, details=True):
+    """
+    Import a binary snapshot (see snapshot.py) for a user.
+
+    Yields the same events as import_progress. Records are matched to
+    characters by rank; a snapshot.SnapshotError is raised before anything is
+    written if the data is not a readable snapshot.
+    """
+    records = snapshot.unpack(data)
+    catalog = get_catalog()
+    now = datetime.utcnow()
+    results = {'success': 0, 'failed': 0, 'not_found': 0, 'know': 0, 'unsure': 0, 'dont_know': 0}
+    processed = 0
+    progress_rows = {}
+    penalties = {}
+
+    for (rank, familiarity, flags, _, review_count, know_count, unsure_count, dont_know_count,
+         last_reviewed, rank_penalty) in records:
+        character = catalog.by_rank(rank)
+        if flags & snapshot.HAS_TUNING and character:
+            penalties[character.id] = rank_penalty
+        if not flags & snapshot.HAS_PROGRESS:
+            continue
+        processed += 1
+        if not character:
+            results['not_found'] += 1
+            if details:
+                yield {'type': 'detail', 'character': f'#{rank}', 'status': 'not_found'}
+            continue
+        if familiarity not in (0, 1, 2):
+            results['failed'] += 1
+            if details:
+                yield {'type': 'detail', 'character': character.hanzi, 'status': 'failed'}
+            continue
+        progress_rows[character.id] = {
+            'character_id': character.id,
+            'familiarity': familiarity,
+            'review_count': review_count,
+            'know_count': know_count,
+            'unsure_count': unsure_count,
+            'dont_know_count': dont_know_count,
+            'last_reviewed': snapshot.from_micros(last_reviewed) or now,
+        }
+        results['success'] += 1
+        results[('dont_know', 'unsure', 'know')[familiarity]] += 1
+        if details:
+            yield {'type': 'detail', 'character': character.hanzi, 'status': 'success', 'familiarity': familiarity}
+
+    try:
+        # The rows are already in memory, so write them in one bulk upsert
+        import_progress_rows(user_id, list(progress_rows.values()))
+        import_rank_penalties(user_id, penalties)
+        sync_familiarity_vector(user_id)
+        recompute_user_stats(user_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        scheduler_states.invalidate(user_id)
+
+    yield {'type': 'progress', 'processed': processed}
+    yield {
+        'type': 'result',
+        'success': True,
+        'message': f"Successfully imported {results['success']} characters ({results['know']} known, {results['unsure']} unsure, {results['dont_know']} don't know). {results['not_found']} not found, {results['failed']} failed.",
+        'results': results,
+    }
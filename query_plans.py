@@ -0,0 +1,91 @@
+"""EXPLAIN checks for the hot queries against user_progress and character.
+
+Run `python query_plans.py` against the configured DATABASE_URL (SQLite or
+PostgreSQL). It prints each plan and exits non-zero if any hot query has
+stopped using an index, so it can be used as a regression check after
+schema changes.
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import text
+
+# (name, table, SQL) for the queries issued on every flashcard/list/stats request
+HOT_QUERIES = [
+    ('progress by user and character', 'user_progress',
+     'SELECT * FROM user_progress WHERE user_id = :user_id AND character_id = :character_id'),
+    ('progress by familiarity', 'user_progress',
+     'SELECT * FROM user_progress WHERE user_id = :user_id AND familiarity = :familiarity'),
+    ('last reviewed', 'user_progress',
+     'SELECT character_id FROM user_progress WHERE user_id = :user_id ORDER BY last_reviewed DESC LIMIT 1'),
+    ('due reviews', 'user_progress',
+     'SELECT character_id FROM user_progress WHERE user_id = :user_id AND due_at <= :now ORDER BY due_at LIMIT 10'),
+    ('familiarity counts', 'user_progress',
+     'SELECT familiarity, COUNT(*) FROM user_progress WHERE user_id = :user_id GROUP BY familiarity'),
+    ('character list page', 'user_progress',
+     'SELECT character_id FROM user_progress WHERE user_id = :user_id AND familiarity = :familiarity '
+     'ORDER BY unsure_count DESC, last_reviewed DESC, id DESC LIMIT 60'),
+    ('character by hanzi', 'character',
+     'SELECT id FROM "character" WHERE hanzi = :hanzi'),
+    ('characters by rank', 'character',
+     'SELECT id FROM "character" ORDER BY rank LIMIT 100'),
+    ('recent review events', 'review_event',
+     'SELECT familiarity FROM review_event WHERE user_id = :user_id AND reviewed_at >= :now'),
+    ('review events to roll up', 'review_event',
+     'SELECT user_id FROM review_event WHERE reviewed_at >= :now'),
+]
+
+PARAMS = {'user_id': 1, 'character_id': 1, 'familiarity': 2, 'hanzi': '的', 'now': datetime(2000, 1, 1)}
+
+
+def explain(session, sql):
+    """Return the plan of a query as a list of text lines."""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        rows = session.execute(text(f'EXPLAIN QUERY PLAN {sql}'), PARAMS).fetchall()
+        return [row[-1] for row in rows]
+    # Small tables are cheaper to scan, so make the planner show whether an
+    # index *can* be used rather than whether it is worth it right now.
+    session.execute(text('SET LOCAL enable_seqscan = off'))
+    rows = session.execute(text(f'EXPLAIN {sql}'), PARAMS).fetchall()
+    return [row[0] for row in rows]
+
+
+def uses_index(dialect, table, plan):
+    if dialect == 'sqlite':
+        for line in plan:
+            if line.startswith(f'SCAN {table}') and 'INDEX' not in line:
+                return False
+        return any('INDEX' in line for line in plan)
+    return not any('Seq Scan' in line for line in plan) and any('Index' in line for line in plan)
+
+
+def check_query_plans(session):
+    """EXPLAIN every hot query; returns a list of {name, uses_index, plan} dicts."""
+    dialect = session.get_bind().dialect.name
+    results = []
+    try:
+        for name, table, sql in HOT_QUERIES:
+            plan = explain(session, sql)
+            results.append({'name': name, 'uses_index': uses_index(dialect, table, plan), 'plan': plan})
+    finally:
+        session.rollback()
+    return results
+
+
+if __name__ == '__main__':
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.create_all()
+        results = check_query_plans(db.session)
+
+    failed = [r for r in results if not r['uses_index']]
+    for r in results:
+        print(f"{'OK  ' if r['uses_index'] else 'FAIL'} {r['name']}")
+        for line in r['plan']:
+            print(f"       {line}")
+    if failed:
+        print(f"{len(failed)} hot queries are not using an index")
+        sys.exit(1)
@@ -0,0 +1,232 @@
+import heapq
+import random
+from array import array
+
+
+def effective_weight(effective_rank):
+    """Selection weight for a character: lower effective rank = more likely."""
+    return 1.0 / max(effective_rank, 1)
+
+
+class FenwickTree:
+    """Binary indexed tree over non-negative floats.
+
+    Supports point updates, prefix sums and "find the item a prefix sum lands
+    on" in O(log n), which is what weighted sampling over a large, slowly
+    changing candidate list needs.
+    """
+    __slots__ = ('_values', '_tree', '_top_bit')
+
+    def __init__(self, values):
+        n = len(values)
+        self._values = array('d', values)
+        tree = array('d', bytes(8 * (n + 1)))
+        for i in range(1, n + 1):
+            tree[i] += self._values[i - 1]
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._top_bit = 1 << (n.bit_length() - 1) if n else 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def value(self, index):
+        return self._values[index]
+
+    def set(self, index, value):
+        delta = value - self._values[index]
+        if not delta:
+            return
+        self._values[index] = value
+        tree = self._tree
+        n = len(self._values)
+        i = index + 1
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, count):
+        """Sum of the first `count` values."""
+        total = 0.0
+        tree = self._tree
+        i = count
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def total(self):
+        return self.prefix(len(self._values))
+
+    def search(self, target):
+        """Return the index i with prefix(i) <= target < prefix(i + 1)."""
+        tree = self._tree
+        n = len(self._values)
+        pos = 0
+        step = self._top_bit
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= target:
+                pos = nxt
+                target -= tree[nxt]
+            step >>= 1
+        return min(pos, n - 1)
+
+
+def _effective_order(catalog, rank_penalties):
+    """Yield (effective_rank, rank, entry) for the whole catalog in effective-rank order.
+
+    Unpenalized entries are already in order in the catalog, so only the
+    (few) penalized ones need sorting before the two streams are merged.
+    """
+    penalized = sorted(
+        (e.rank + rank_penalties[e.id], e.rank, e.id) for e in
+        (catalog.get(char_id) for char_id in rank_penalties) if e is not None
+    )
+    plain = ((rank, rank, char_id) for rank, char_id in zip(catalog.ranks, catalog.ids)
+             if char_id not in rank_penalties)
+    for effective_rank, rank, char_id in heapq.merge(plain, penalized):
+        yield effective_rank, rank, catalog.get(char_id)
+
+
+class RankWindowSampler:
+    """Weighted draws from the `window_size` unknown characters with the lowest effective rank.
+
+    The sampler keeps a pool of characters in effective-rank order (known ones
+    included, with zero weight) in two Fenwick trees: one of weights and one
+    of "is unknown" counts. Marking a character known/unknown or demoting it
+    out of the pool only touches that character's entries; the pool is only
+    rebuilt when it runs out of unknown characters or a demote reorders it.
+    """
+
+    def __init__(self, catalog, rank_penalties, known_ids, window_size=100, slack=None):
+        self.window_size = window_size
+        self._catalog = catalog
+        target_unknown = window_size + (window_size if slack is None else slack)
+
+        entries = []
+        keys = []
+        weights = []
+        counts = []
+        unknown = 0
+        for effective_rank, rank, entry in _effective_order(catalog, rank_penalties):
+            if unknown >= target_unknown:
+                break
+            is_unknown = entry.id not in known_ids
+            entries.append(entry)
+            keys.append((effective_rank, rank))
+            weights.append(effective_weight(effective_rank) if is_unknown else 0.0)
+            counts.append(1.0 if is_unknown else 0.0)
+            unknown += is_unknown
+
+        self.entries = entries
+        self._keys = keys
+        self._positions = {e.id: i for i, e in enumerate(entries)}
+        self._weights = FenwickTree(weights)
+        self._counts = FenwickTree(counts)
+        # True when the pool holds the whole catalog, so it can never run dry
+        self.complete = len(entries) == len(catalog)
+
+    def is_stale(self):
+        """True when the pool can no longer fill the window and must be rebuilt."""
+        return not self.complete and self._counts.total() < self.window_size
+
+    def set_known(self, character_id, known):
+        pos = self._positions.get(character_id)
+        if pos is None:
+            return
+        self._counts.set(pos, 0.0 if known else 1.0)
+        self._weights.set(pos, 0.0 if known else effective_weight(self._keys[pos][0]))
+
+    def set_rank_penalty(self, character_id, rank_penalty):
+        """Apply a changed penalty. Returns False if the pool must be rebuilt."""
+        entry = self._catalog.get(character_id)
+        if entry is None:
+            return True
+        new_key = (entry.rank + rank_penalty, entry.rank)
+        last_key = self._keys[-1] if self._keys else None
+        beyond_pool = not self.complete and last_key is not None and new_key > last_key
+        pos = self._positions.get(character_id)
+        if pos is None:
+            # Moving into the pool would change its order
+            return beyond_pool
+        if not beyond_pool:
+            return False
+        # Demoted past the end of the pool: just drop it
+        del self._positions[character_id]
+        self._counts.set(pos, 0.0)
+        self._weights.set(pos, 0.0)
+        return True
+
+    def _window_end(self):
+        """Number of pool entries covering the first window_size unknown characters."""
+        active = int(round(self._counts.total()))
+        if active == 0:
+            return 0
+        return self._counts.search(min(self.window_size, active) - 0.5) + 1
+
+    def draw(self, avoid_ids=(), attempts=32):
+        """Draw one entry from the window, skipping avoid_ids unless nothing else is left."""
+        end = self._window_end()
+        if end == 0:
+            return None
+        total = self._weights.prefix(end)
+
+        # Rejection sampling keeps draws O(log n) and leaves the trees untouched
+        for _ in range(attempts):
+            i = self._weights.search(random.random() * total)
+            if self._weights.value(i) > 0 and self.entries[i].id not in avoid_ids:
+                return self.entries[i]
+
+        # Most of the window is avoided: pick exactly among what is left
+        candidates = [i for i in range(end) if self._weights.value(i) > 0]
+        allowed = [i for i in candidates if self.entries[i].id not in avoid_ids] or candidates
+        if not allowed:
+            return None
+        i = random.choices(allowed, weights=[self._weights.value(i) for i in allowed], k=1)[0]
+        return self.entries[i]
+
+
+class KnownSampler:
+    """Weighted draws over a user's known characters, indexed by catalog position."""
+
+    def __init__(self, catalog, rank_penalties, known_ids):
+        self.entries = catalog.entries
+        self._catalog = catalog
+        self._rank_penalties = rank_penalties
+        self._weights = FenwickTree([
+            effective_weight(rank + rank_penalties.get(char_id, 0)) if char_id in known_ids else 0.0
+            for rank, char_id in zip(catalog.ranks, catalog.ids)
+        ])
+
+    def _weight(self, entry):
+        return effective_weight(entry.rank + self._rank_penalties.get(entry.id, 0))
+
+    def set_known(self, character_id, known):
+        pos = self._catalog.position(character_id)
+        if pos is not None:
+            self._weights.set(pos, self._weight(self.entries[pos]) if known else 0.0)
+
+    def refresh_weight(self, character_id):
+        """Re-read the rank penalty of a character after it changed."""
+        pos = self._catalog.position(character_id)
+        if pos is not None and self._weights.value(pos) > 0:
+            self._weights.set(pos, self._weight(self.entries[pos]))
+
+    def draw(self, avoid_ids=(), attempts=32):
+        total = self._weights.total()
+        if total <= 0:
+            return None
+        for _ in range(attempts):
+            i = self._weights.search(random.random() * total)
+            if self._weights.value(i) > 0 and self.entries[i].id not in avoid_ids:
+                return self.entries[i]
+        # Rounding can leave a tiny total behind once every weight is back to zero
+        candidates = [i for i in range(len(self.entries)) if self._weights.value(i) > 0]
+        allowed = [i for i in candidates if self.entries[i].id not in avoid_ids] or candidates
+        if not allowed:
+            return None
+        i = random.choices(allowed, weights=[self._weights.value(i) for i in allowed], k=1)[0]
+        return self.entries[i]
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class SchedulerState:
+    """In-memory snapshot of everything get_next_character needs for one user.
+
+    The state is built once from the database and then kept up to date by the
+    code paths that change it (reviews, demotes, imports), so picking the next
+    card does not have to reload the user's whole progress every time.
+
+    Requests of the same user can run on different threads: draws from the
+    samplers (see models._pick_character) and the updates below all hold
+    `lock`, so a draw never walks a Fenwick tree that is half updated.
+    """
+    __slots__ = ('user_id', 'familiarity', 'known_ids', 'rank_penalties',
+                 'last_shown_id', 'catalog_size', 'loaded_at',
+                 'window_sampler', 'known_sampler', 'lock')
+
+    def __init__(self, user_id, familiarity, rank_penalties, last_shown_id, catalog_size):
+        self.user_id = user_id
+        self.familiarity = familiarity  # FamiliarityVector: character_id -> 0/1/2
+        self.known_ids = set(familiarity.ids_with(2))
+        self.rank_penalties = rank_penalties  # character_id -> rank penalty
+        self.last_shown_id = last_shown_id
+        self.catalog_size = catalog_size
+        self.loaded_at = time.monotonic()
+        # Built lazily by get_next_character (see sampling.py)
+        self.window_sampler = None
+        self.known_sampler = None
+        self.lock = threading.Lock()
+
+    def record_review(self, character_id, familiarity):
+        with self.lock:
+            self.familiarity[character_id] = familiarity
+            if familiarity == 2:
+                self.known_ids.add(character_id)
+            else:
+                self.known_ids.discard(character_id)
+            self.last_shown_id = character_id
+            known = familiarity == 2
+            if self.window_sampler is not None:
+                self.window_sampler.set_known(character_id, known)
+            if self.known_sampler is not None:
+                self.known_sampler.set_known(character_id, known)
+
+    def set_rank_penalty(self, character_id, rank_penalty):
+        with self.lock:
+            if rank_penalty:
+                self.rank_penalties[character_id] = rank_penalty
+            else:
+                self.rank_penalties.pop(character_id, None)
+            if self.window_sampler is not None and not self.window_sampler.set_rank_penalty(character_id, rank_penalty):
+                self.window_sampler = None
+            if self.known_sampler is not None:
+                self.known_sampler.refresh_weight(character_id)
+
+    def __repr__(self):
+        return f'<SchedulerState user_id={self.user_id} reviewed={len(self.familiarity)} known={len(self.known_ids)}>'
+
+
+class SchedulerStateCache:
+    """Process-wide LRU cache of SchedulerState objects with a TTL.
+
+    The TTL bounds how stale a state can get when another worker process
+    writes progress for the same user.
+    """
+
+    def __init__(self, max_users=256, ttl_seconds=600):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fresh(self, state):
+        return time.monotonic() - state.loaded_at < self.ttl_seconds
+
+    def peek(self, user_id):
+        """Return the cached state for a user, or None if missing or expired."""
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                return None
+            if not self._fresh(state):
+                del self._states[user_id]
+                return None
+            self._states.move_to_end(user_id)
+            return state
+
+    def get(self, user_id, loader):
+        """Return the state for a user, building it with loader(user_id) on a miss."""
+        state = self.peek(user_id)
+        if state is not None:
+            return state
+
+        state = loader(user_id)
+        with self._lock:
+            self._states[user_id] = state
+            self._states.move_to_end(user_id)
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+        return state
+
+    def record_review(self, user_id, character_id, familiarity):
+        state = self.peek(user_id)
+        if state is not None:
+            state.record_review(character_id, familiarity)
+
+    def set_rank_penalty(self, user_id, character_id, rank_penalty):
+        state = self.peek(user_id)
+        if state is not None:
+            state.set_rank_penalty(character_id, rank_penalty)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
@@ -0,0 +1,82 @@
+"""Binary account snapshot format.
+
+A snapshot is a fixed header followed by one fixed-width little-endian
+record per character, keyed by frequency rank (stable across databases,
+unlike character IDs):
+
+    header  magic "CCSN", version, record size, record count, created_at
+    record  rank, familiarity, flags, review/know/unsure/dont_know counts,
+            last_reviewed, rank_penalty
+
+Timestamps are microseconds since the Unix epoch (UTC). Records are parsed
+straight out of the uploaded buffer with struct.iter_unpack over a
+memoryview, so nothing is copied or decoded per field name.
+"""
+import struct
+from datetime import datetime, timedelta
+
+MAGIC = b'CCSN'
+VERSION = 1
+MIMETYPE = 'application/x-chinchar-snapshot'
+
+HEADER = struct.Struct('<4sHHIq')
+# rank, familiarity, flags, (reserved), review_count, know_count, unsure_count,
+# dont_know_count, last_reviewed, rank_penalty
+RECORD = struct.Struct('<IBBHIIIIqi')
+
+# Far more than the catalog holds; bounds how much of an upload is read
+MAX_RECORDS = 1 << 16
+MAX_BYTES = HEADER.size + RECORD.size * MAX_RECORDS
+
+HAS_PROGRESS = 0x01
+HAS_TUNING = 0x02
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class SnapshotError(ValueError):
+    """The data is not a snapshot this version can read."""
+
+
+def to_micros(value):
+    return (value - _EPOCH) // timedelta(microseconds=1) if value else 0
+
+
+def from_micros(value):
+    return _EPOCH + timedelta(microseconds=value) if value else None
+
+
+def is_snapshot(prefix):
+    return bytes(prefix[:len(MAGIC)]) == MAGIC
+
+
+def pack(records, created_at=None):
+    """Build a snapshot from RECORD field tuples."""
+    records = list(records)
+    buf = bytearray(HEADER.size + RECORD.size * len(records))
+    HEADER.pack_into(buf, 0, MAGIC, VERSION, RECORD.size, len(records), to_micros(created_at or datetime.utcnow()))
+    offset = HEADER.size
+    for record in records:
+        RECORD.pack_into(buf, offset, *record)
+        offset += RECORD.size
+    return bytes(buf)
+
+
+def unpack(data):
+    """Validate a snapshot and return an iterator of RECORD field tuples."""
+    view = memoryview(data)
+    if len(view) < HEADER.size:
+        raise SnapshotError('Snapshot is truncated')
+    magic, version, record_size, count, _ = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise SnapshotError('Not a snapshot file')
+    if version != VERSION:
+        raise SnapshotError(f'Unsupported snapshot version {version}')
+    if record_size != RECORD.size:
+        raise SnapshotError(f'Unsupported snapshot record size {record_size}')
+    if count > MAX_RECORDS:
+        raise SnapshotError('Snapshot has too many records')
+    end = HEADER.size + record_size * count
+    if len(view) != end:
+        raise SnapshotError('Snapshot length does not match its record count')
+    return RECORD.iter_unpack(view[HEADER.size:end])
@@ -0,0 +1,48 @@
+"""Startup timing: how long each phase of importing and warming up the app takes.
+
+Set STARTUP_REPORT=true to print the report (and the configuration the app
+was started with) when a process has warmed up, or run
+`flask --app app warmup` to measure a cold start on demand.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+STARTUP_REPORT = os.environ.get('STARTUP_REPORT') == 'true'
+
+_phases = []  # (name, seconds), in the order they finished
+_last_mark = time.perf_counter()
+
+
+def mark(name):
+    """Record the time since the previous mark (or since this module was imported) as a phase."""
+    global _last_mark
+    now = time.perf_counter()
+    _phases.append((name, now - _last_mark))
+    _last_mark = now
+
+
+@contextmanager
+def phase(name):
+    """Time the body of a with block as a phase."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - start))
+
+
+def forked():
+    """Start over in a forked worker; the master reports the phases before the fork itself."""
+    global _last_mark
+    _phases.clear()
+    _last_mark = time.perf_counter()
+
+
+def report(title='Startup'):
+    """Print every phase recorded so far in this process."""
+    lines = [f"{title} timing (pid {os.getpid()}):"]
+    for name, seconds in _phases:
+        lines.append(f"  {name:<28} {seconds * 1000:8.1f} ms")
+    lines.append(f"  {'total':<28} {sum(seconds for _, seconds in _phases) * 1000:8.1f} ms")
+    print('\n'.join(lines))
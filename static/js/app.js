@@ -24,6 +24,14 @@ document.addEventListener('DOMContentLoaded', () => {
     
     // Current character data
     let currentCharacter = null;
+    // When the current card was shown, to report how long the answer took
+    let cardShownAt = null;
+
+    // Prefetched cards (with details) waiting to be shown
+    const QUEUE_SIZE = 10;
+    const QUEUE_LOW_WATER = 3;
+    let cardQueue = [];
+    let queueRefill = null;
     
     // Initialize the app
     init();
@@ -87,6 +95,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 return;
             }
             currentCharacter = data;
+            cardShownAt = performance.now();
             characterHanzi.textContent = data.hanzi;
             flashcard.classList.remove('flipped');
             await loadCharacterDetails(data.id);
@@ -96,47 +105,85 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
     
+    function refillQueue() {
+        // Only one refill request in flight at a time
+        if (queueRefill) return queueRefill;
+
+        const exclude = cardQueue.map(card => card.id);
+        if (currentCharacter) exclude.push(currentCharacter.id);
+
+        const params = new URLSearchParams({ n: Math.max(QUEUE_SIZE - cardQueue.length, 1) });
+        if (exclude.length) params.set('exclude', exclude.join(','));
+
+        queueRefill = fetch(`/api/character/queue?${params}`)
+            .then(async (response) => {
+                const data = await response.json();
+                if (!response.ok || (data && data.error)) {
+                    const error = new Error((data && data.error) || 'Failed to load card queue');
+                    error.status = response.status;
+                    throw error;
+                }
+
+                const queuedIds = new Set(cardQueue.map(card => card.id));
+                for (const card of data.cards) {
+                    if (!queuedIds.has(card.id)) {
+                        cardQueue.push(card);
+                    }
+                }
+            })
+            .finally(() => {
+                queueRefill = null;
+            });
+
+        return queueRefill;
+    }
+
+    function showCard(card) {
+        currentCharacter = card;
+        cardShownAt = performance.now();
+
+        // Update the front of the card
+        characterHanzi.textContent = card.hanzi;
+
+        // Reset the card to front side
+        flashcard.classList.remove('flipped');
+
+        // Details come with the card, so the back can be filled in right away
+        characterHanziBack.textContent = card.hanzi;
+        characterPinyin.textContent = convertPinyinToToneMarks(card.pinyin);
+        characterMeaning.textContent = card.meaning;
+
+        if (btnAiDescription) {
+            btnAiDescription.title = card.has_ai_description ? 'AI description (cached)' : '';
+        }
+    }
+    
     async function loadNextCharacter() {
         try {
-            const response = await fetch('/api/character/next');
-            console.log(`Next character response status: ${response.status}`);
-            
-            // Get the response text for debugging
-            const responseText = await response.text();
-            console.log('Next character response text:', responseText);
-            
-            // Parse the JSON (if possible)
-            let data;
-            try {
-                data = JSON.parse(responseText);
-                console.log('Parsed next character data:', data);
-            } catch (jsonError) {
-                console.error('Error parsing next character JSON response:', jsonError);
-                throw new Error('Failed to parse server response');
+            if (cardQueue.length === 0) {
+                await refillQueue();
             }
-            
-            if (!response.ok || (data && data.error)) {
-                if (response.status === 404 || (data && data.error === 'No characters available')) {
-                    // No characters available - show a friendly message
-                    characterHanzi.textContent = '?';
-                    alert('No characters available. Please make sure characters.txt is properly loaded.');
-                    return;
-                }
-                throw new Error((data && data.error) || 'Failed to load next character');
+
+            const card = cardQueue.shift();
+            if (!card) {
+                characterHanzi.textContent = '?';
+                alert('No characters available. Please make sure characters.txt is properly loaded.');
+                return;
+            }
+
+            showCard(card);
+
+            // Top the queue up in the background so the next card is instant
+            if (cardQueue.length < QUEUE_LOW_WATER) {
+                refillQueue().catch(error => console.error('Error refilling card queue:', error));
             }
-            
-            currentCharacter = data;
-            
-            // Update the front of the card
-            characterHanzi.textContent = data.hanzi;
-            
-            // Reset the card to front side
-            flashcard.classList.remove('flipped');
-            
-            // Load character details for the back of the card
-            await loadCharacterDetails(data.id);
-            
         } catch (error) {
+            if (error.status === 404) {
+                // No characters available - show a friendly message
+                characterHanzi.textContent = '?';
+                alert('No characters available. Please make sure characters.txt is properly loaded.');
+                return;
+            }
             console.error('Error loading next character:', error);
             characterHanzi.textContent = '?';
             alert('Error loading character. Please try again.');
@@ -291,7 +338,8 @@ document.addEventListener('DOMContentLoaded', () => {
         // Create the request data
         const requestData = {
             character_id: currentCharacter.id,
-            familiarity: familiarity
+            familiarity: familiarity,
+            latency_ms: cardShownAt === null ? null : Math.round(performance.now() - cardShownAt)
         };
         
         console.log('Request data:', requestData);
@@ -0,0 +1,60 @@
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# The app is a set of top-level modules, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py and models.py read their configuration when they are imported, so
+# point everything at a scratch directory before any test imports them
+_DIR = tempfile.mkdtemp(prefix='chinchar-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_DIR, 'test.db')}"
+os.environ['CATALOG_FILE'] = os.path.join(_DIR, 'catalog.bin')
+os.environ['CEDICT_FILE'] = ''
+os.environ['JOB_DIR'] = os.path.join(_DIR, 'jobs')
+os.environ['WRITE_BEHIND_DIR'] = os.path.join(_DIR, 'write_behind')
+os.environ.pop('WRITE_BEHIND', None)
+
+_emails = itertools.count()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def app():
+    """The Flask app on a migrated (and seeded) SQLite database shared by the whole run."""
+    from app import app as flask_app, run_migrations
+
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        run_migrations()
+    return flask_app
+
+
+def _login(app):
+    from models import User
+
+    client = app.test_client()
+    email = f'user{next(_emails)}@example.com'
+    client.post('/login', data={'email': email})
+    with app.app_context():
+        client.user_id = User.query.filter_by(email=email).one().id
+    return client
+
+
+@pytest.fixture
+def client(app):
+    """A test client logged in as a new user, whose id is client.user_id."""
+    return _login(app)
+
+
+@pytest.fixture
+def other_client(app):
+    """A second logged-in client, for a different new user."""
+    return _login(app)
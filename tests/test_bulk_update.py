@@ -0,0 +1,101 @@
+"""bulk_update_progress must match one update_progress call per review, in order."""
+from datetime import datetime, timedelta
+
+import models
+from models import (ReviewEvent, UserProgress, bulk_update_progress, get_catalog, get_familiarity_vector,
+                    get_user_stats, recompute_user_stats)
+
+T0 = datetime(2024, 5, 1, 8, 0)
+
+
+def _rows(user_id):
+    return {row.character_id: row for row in UserProgress.query.filter_by(user_id=user_id)}
+
+
+def _stats(user_id):
+    stats = get_user_stats(user_id)
+    return stats.reviewed_count, stats.know_count, stats.unsure_count, stats.dont_know_count
+
+
+def _assert_derived_state(user_id):
+    """The stats counters and the familiarity vector agree with the progress rows."""
+    rows = _rows(user_id)
+    counters = _stats(user_id)
+    recompute_user_stats(user_id)
+    assert _stats(user_id) == counters
+    vector = get_familiarity_vector(user_id)
+    assert len(vector) == len(rows)
+    assert {character_id: vector.get(character_id) for character_id in rows} == \
+        {character_id: row.familiarity for character_id, row in rows.items()}
+
+
+def test_repeated_character_is_merged(app, client):
+    user_id = client.user_id
+    with app.app_context():
+        assert bulk_update_progress(user_id, [
+            (10, 0, T0), (11, 2, T0), (10, 1, T0 + timedelta(minutes=1)), (10, 2, T0 + timedelta(minutes=2)),
+        ])
+        row = _rows(user_id)[10]
+        assert (row.familiarity, row.review_count) == (2, 3)
+        assert (row.know_count, row.unsure_count, row.dont_know_count) == (1, 1, 1)
+        assert row.last_reviewed == T0 + timedelta(minutes=2)
+
+        events = ReviewEvent.query.filter_by(user_id=user_id, character_id=10).order_by(ReviewEvent.id).all()
+        assert [(e.previous_familiarity, e.familiarity) for e in events] == [(None, 0), (0, 1), (1, 2)]
+        assert _stats(user_id) == (2, 2, 0, 0)
+        _assert_derived_state(user_id)
+
+
+def test_existing_rows_are_updated(app, client):
+    user_id = client.user_id
+    with app.app_context():
+        assert bulk_update_progress(user_id, [(20, 2, T0), (21, 1, T0), (22, 0, T0)])
+        assert _stats(user_id) == (3, 1, 1, 1)
+
+        assert bulk_update_progress(user_id, [(20, 0, T0 + timedelta(days=1)), (21, 1, T0 + timedelta(days=1)),
+                                              (23, 2, T0 + timedelta(days=1))])
+        rows = _rows(user_id)
+        assert (rows[20].familiarity, rows[20].previous_familiarity, rows[20].review_count) == (0, 2, 2)
+        assert (rows[20].know_count, rows[20].dont_know_count) == (1, 1)
+        assert (rows[21].familiarity, rows[21].unsure_count, rows[21].review_count) == (1, 2, 2)
+        assert rows[22].review_count == 1
+        assert _stats(user_id) == (4, 1, 1, 2)
+        _assert_derived_state(user_id)
+
+
+def test_older_reviews_keep_the_newer_state(app, client):
+    user_id = client.user_id
+    with app.app_context():
+        assert bulk_update_progress(user_id, [(30, 2, T0)])
+        due_at = _rows(user_id)[30].due_at
+
+        # Synced late from an offline device: counted, but the stored answer is newer
+        assert bulk_update_progress(user_id, [(30, 0, T0 - timedelta(hours=2)), (30, 1, T0 - timedelta(hours=1))])
+        row = _rows(user_id)[30]
+        assert (row.familiarity, row.last_reviewed, row.due_at) == (2, T0, due_at)
+        assert (row.review_count, row.know_count, row.unsure_count, row.dont_know_count) == (3, 1, 1, 1)
+        assert _stats(user_id) == (1, 1, 0, 0)
+        _assert_derived_state(user_id)
+
+
+def test_chunked_batches(app, client, monkeypatch):
+    monkeypatch.setattr(models, 'BULK_CHUNK_SIZE', 7)
+    user_id = client.user_id
+    with app.app_context():
+        ids = [entry.id for entry in get_catalog().top(50)]
+        assert bulk_update_progress(user_id, [(character_id, i % 3, T0) for i, character_id in enumerate(ids)])
+        assert bulk_update_progress(user_id, [(character_id, 2, T0 + timedelta(hours=1)) for character_id in ids[:20]])
+        rows = _rows(user_id)
+        assert len(rows) == 50
+        assert all(rows[character_id].familiarity == 2 and rows[character_id].review_count == 2
+                   for character_id in ids[:20])
+        assert _stats(user_id)[0] == 50
+        _assert_derived_state(user_id)
+
+
+def test_imports_do_not_log_events(app, client):
+    user_id = client.user_id
+    with app.app_context():
+        assert bulk_update_progress(user_id, [(40, 2, T0)], log_events=False)
+        assert ReviewEvent.query.filter_by(user_id=user_id).count() == 0
+        assert _rows(user_id)[40].familiarity == 2
@@ -0,0 +1,46 @@
+"""Character ids arrive from JSON as ints or numeric strings; both must mean the same character."""
+from models import UserProgress, get_familiarity_vector, get_scheduler_state
+
+
+def test_progress_with_string_id_updates_table_and_vector(app, client):
+    response = client.post('/api/progress', json={'character_id': '101', 'familiarity': 2})
+    assert response.status_code == 200
+    assert response.get_json()['character_id'] == 101
+
+    with app.app_context():
+        row = UserProgress.query.filter_by(user_id=client.user_id, character_id=101).one()
+        assert row.familiarity == 2
+        assert get_familiarity_vector(client.user_id).get(101) == 2
+        assert get_scheduler_state(client.user_id).familiarity.get(101) == 2
+
+
+def test_invalid_id_is_a_bad_request(client):
+    for character_id in ('abc', '1.5', [101], True):
+        response = client.post('/api/progress', json={'character_id': character_id, 'familiarity': 2})
+        assert response.status_code == 400, character_id
+    assert client.post('/api/character/demote', json={'character_id': 'abc'}).status_code == 400
+    assert client.post('/api/character-familiarity', json={'ids': ['abc']}).status_code == 400
+
+
+def test_demote_with_string_id(client):
+    response = client.post('/api/character/demote', json={'character_id': '102'})
+    assert response.status_code == 200
+    assert response.get_json()['rank_penalty'] == 50
+
+
+def test_batch_and_sync_accept_string_ids(client):
+    response = client.post('/api/batch-progress', json={'updates': [
+        {'character_id': '103', 'familiarity': 1},
+        {'character_id': 'abc', 'familiarity': 1},
+    ]})
+    assert response.get_json()['results'] == {'success': 1, 'failed': 1, 'total': 2}
+
+    response = client.post('/api/sync', json={'events': [
+        {'id': 'e1', 'character_id': '104', 'familiarity': 0, 'reviewed_at': '2024-05-01T08:30:00Z'},
+    ]})
+    data = response.get_json()
+    assert (data['applied'], data['rejected']) == (1, [])
+    assert data['familiarity'] == {'104': 0}
+
+    response = client.post('/api/character-familiarity', json={'ids': ['103', 104, '105']})
+    assert response.get_json()['familiarity'] == {'103': 1, '104': 0}
@@ -0,0 +1,78 @@
+"""Keyset pagination of the /known, /unsure and /unknown lists."""
+import random
+from datetime import datetime
+
+import pytest
+
+from models import UserProgress, db, get_catalog
+
+
+@pytest.fixture
+def progress(app, client):
+    """Known, unsure and unknown rows for client's user, with many ties in the sort key."""
+    rng = random.Random(5)
+    with app.app_context():
+        ids = [entry.id for entry in get_catalog().top(90)]
+        rng.shuffle(ids)  # Row ids then follow no other order
+        for i, character_id in enumerate(ids):
+            db.session.add(UserProgress(
+                user_id=client.user_id, character_id=character_id, familiarity=i % 3,
+                review_count=5, know_count=1, unsure_count=rng.randrange(3), dont_know_count=rng.randrange(3),
+                last_reviewed=datetime(2024, 5, 1 + rng.randrange(2))
+            ))
+        db.session.commit()
+    return client
+
+
+def _old_order(app, user_id, familiarity, misses):
+    """Order of the lists before they were paged: a stable Python sort of the rows."""
+    with app.app_context():
+        rows = UserProgress.query.filter_by(user_id=user_id, familiarity=familiarity).all()
+    rows.sort(key=lambda p: (-misses(p), -p.last_reviewed.timestamp()))
+    return [p.character_id for p in rows]
+
+
+def _all_pages(client, category, limit):
+    ids, cursor, pages = [], None, 0
+    while True:
+        params = {'limit': limit} if cursor is None else {'limit': limit, 'cursor': cursor}
+        page = client.get(f'/api/characters/{category}', query_string=params).get_json()
+        ids += [character['id'] for character in page['characters']]
+        pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            return ids, pages
+
+
+@pytest.mark.parametrize('category, familiarity, misses', [
+    ('known', 2, lambda p: p.dont_know_count + p.unsure_count),
+    ('unsure', 1, lambda p: p.unsure_count),
+    ('unknown', 0, lambda p: p.dont_know_count),
+])
+@pytest.mark.parametrize('limit', [1, 4, 30, 200])
+def test_pages_match_old_order(app, progress, category, familiarity, misses, limit):
+    expected = _old_order(app, progress.user_id, familiarity, misses)
+    ids, pages = _all_pages(progress, category, limit)
+    assert ids == expected  # Nothing duplicated, skipped or reordered
+    assert pages == max(1, -(-len(expected) // limit))
+
+
+def test_first_page_is_rendered(app, progress):
+    expected = _old_order(app, progress.user_id, 2, lambda p: p.dont_know_count + p.unsure_count)
+    html = progress.get('/known').get_data(as_text=True)
+    with app.app_context():
+        hanzi = [get_catalog().get(character_id).hanzi for character_id in expected]
+    positions = [html.index(h) for h in hanzi]
+    assert positions == sorted(positions)
+
+
+def test_bad_cursors_are_rejected(progress, other_client):
+    cursor = progress.get('/api/characters/known', query_string={'limit': 2}).get_json()['next_cursor']
+    assert progress.get('/api/characters/known', query_string={'cursor': cursor}).status_code == 200
+
+    for bad in ('nonsense', cursor[:-3], '全', 'W10', 'WzEsMiwzXQ'):
+        assert progress.get('/api/characters/known', query_string={'cursor': bad}).status_code == 400
+    # A cursor from another list or another user's list
+    assert progress.get('/api/characters/unsure', query_string={'cursor': cursor}).status_code == 400
+    assert other_client.get('/api/characters/known', query_string={'cursor': cursor}).status_code == 400
+    assert progress.get('/api/characters/everything').status_code == 400
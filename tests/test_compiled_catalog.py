@@ -0,0 +1,94 @@
+"""The compiled, memory-mapped catalog answers like the in-memory one."""
+import pytest
+
+import models
+from catalog import Catalog, CatalogEntry, MappedCatalog, compile_catalog
+
+
+def _fields(entry):
+    return None if entry is None else (entry.id, entry.hanzi, entry.rank, entry.frequency, entry.pinyin, entry.meaning)
+
+
+@pytest.fixture
+def entries():
+    return [
+        CatalogEntry(7, '的', 1, 900, 'de', 'possessive particle'),
+        CatalogEntry(3, '一', 2, 800, 'yī', 'one'),
+        CatalogEntry(12, '是', 3, 700, 'shì', 'is; are'),
+        CatalogEntry(2, '了', 4, 600, 'le', 'completed action'),
+        CatalogEntry(40, '一', 9, 10, 'yāo', 'one (on the phone)'),  # Same hanzi, less common
+        CatalogEntry(5, '𠀀', 5, 50, '', ''),  # Outside the BMP: four UTF-8 bytes
+        CatalogEntry(9, 'ā', 6, 40, 'ā', 'é' * 300),
+        CatalogEntry(8, '中', 6, 40, 'zhōng', 'middle'),  # Tied rank: id decides
+    ]
+
+
+@pytest.fixture
+def catalogs(entries, tmp_path):
+    path = tmp_path / 'catalog.bin'
+    assert compile_catalog(entries, str(path)) == len(entries)
+    return Catalog(entries), MappedCatalog(str(path))
+
+
+def test_same_entries_in_rank_order(catalogs):
+    memory, mapped = catalogs
+    assert len(mapped) == len(memory)
+    assert [_fields(e) for e in mapped] == [_fields(e) for e in memory]
+    assert list(mapped.ids) == list(memory.ids) == [7, 3, 12, 2, 5, 8, 9, 40]
+    assert list(mapped.ranks) == list(memory.ranks)
+    assert [_fields(e) for e in mapped.top(3)] == [_fields(e) for e in memory.top(3)]
+    assert _fields(mapped.entries[-1]) == _fields(memory.entries[-1])
+    with pytest.raises(IndexError):
+        mapped.entries[len(memory)]
+    # Cumulative coverage, only stored in compiled catalogs, ends at the whole corpus
+    assert mapped.entries[-1].cumulative == pytest.approx(100.0)
+
+
+def test_same_lookups(catalogs, entries):
+    memory, mapped = catalogs
+    for character_id in [e.id for e in entries] + [0, 1, 6, 41, 10 ** 6]:
+        assert mapped.position(character_id) == memory.position(character_id)
+        assert _fields(mapped.get(character_id)) == _fields(memory.get(character_id))
+    for hanzi in [e.hanzi for e in entries] + ['二', '', '一一', '\U00020001']:
+        assert _fields(mapped.by_hanzi(hanzi)) == _fields(memory.by_hanzi(hanzi))
+    assert mapped.by_hanzi('一').id == 3  # The most common of the two
+    for rank in range(0, 11):
+        assert _fields(mapped.by_rank(rank)) == _fields(memory.by_rank(rank))
+
+
+def test_empty_catalog(tmp_path):
+    path = str(tmp_path / 'empty.bin')
+    compile_catalog([], path)
+    mapped = MappedCatalog(path)
+    assert (len(mapped), list(mapped), mapped.get(1), mapped.by_hanzi('一'), mapped.top(5)) == (0, [], None, None, [])
+
+
+def test_not_a_catalog(tmp_path):
+    path = tmp_path / 'catalog.bin'
+    for data in (b'', b'CCAT', b'XXXX' + bytes(100)):
+        path.write_bytes(data)
+        with pytest.raises(ValueError):
+            MappedCatalog(str(path))
+
+
+def test_stale_catalog_is_recompiled(app, entries, tmp_path, monkeypatch):
+    path = tmp_path / 'catalog.bin'
+    compile_catalog(entries, str(path))  # Built from some other character table
+    monkeypatch.setattr(models, 'CATALOG_FILE', str(path))
+    monkeypatch.setattr(models, '_catalog', None)
+
+    with app.app_context():
+        fingerprint = models._character_table_fingerprint()
+        assert models._open_compiled_catalog(fingerprint) is None
+        catalog = models.get_catalog()
+        assert isinstance(catalog, MappedCatalog)
+        assert (len(catalog), catalog.fingerprint) == fingerprint
+        assert models._open_compiled_catalog(fingerprint) is not None
+        assert [_fields(e) for e in catalog.top(50)] == \
+            [_fields(e) for e in Catalog(CatalogEntry(*row) for row in models._catalog_rows()).top(50)]
+
+    # A damaged file is replaced as well
+    path.write_bytes(b'not a catalog')
+    monkeypatch.setattr(models, '_catalog', None)
+    with app.app_context():
+        assert isinstance(models.get_catalog(), MappedCatalog)
@@ -0,0 +1,104 @@
+"""The compiled, memory-mapped CC-CEDICT answers like the in-memory one."""
+import pytest
+
+import cedict
+from cedict import Cedict, MappedCedict, compile_dictionary, parse_line
+
+SOURCE = """\
+# CC-CEDICT test excerpt
+中 中 [zhong1] /China/Chinese/surname Zhong/
+中國 中国 [Zhong1 guo2] /China/
+中國人 中国人 [Zhong1 guo2 ren2] /Chinese person/
+中文 中文 [Zhong1 wen2] /Chinese language/
+人 人 [ren2] /person; people/
+一絲不苟 一丝不苟 [yi1 si1 bu4 gou3] /not one thread loose; strictly according to the rules/
+一 一 [yi1] /one/
+了 了 [le5] /(completed action marker)/
+了 了 [liao3] /to finish; to understand/
+乾 干 [gan1] /dry/
+幹 干 [gan4] /to do/
+後 后 [hou4] /back; behind/
+后 后 [hou4] /empress/
+𠀀 𠀀 [he1] /variant of 呵/
+not a valid line
+"""
+
+
+def _fields(entry):
+    return None if entry is None else (entry.traditional, entry.simplified, entry.pinyin, tuple(entry.definitions))
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'cedict.txt'
+    path.write_text(SOURCE, encoding='utf-8')
+    return path
+
+
+@pytest.fixture
+def dictionaries(source, tmp_path):
+    memory = cedict.load(str(source))
+    path = str(tmp_path / 'cedict.bin')
+    compile_dictionary(memory, path, (123, 456))
+    return memory, MappedCedict(path)
+
+
+def test_same_entries(dictionaries):
+    memory, mapped = dictionaries
+    assert mapped.fingerprint == (123, 456)
+    # Entries no headword resolves to any more (the first of the two 了) are not stored
+    resolved = {_fields(e) for e in memory._index.values()}
+    assert len(mapped) == len(resolved) < len(memory)
+    assert {_fields(e) for e in mapped.entries} == resolved
+
+
+def test_same_lookups(dictionaries):
+    memory, mapped = dictionaries
+    words = {word for line in SOURCE.splitlines() if (e := parse_line(line)) for word in (e.traditional, e.simplified)}
+    for word in words | {'中国人民', '一丝', '一丝不', '国', '', 'x'}:
+        assert _fields(mapped.get(word)) == _fields(memory.get(word)), word
+    assert mapped.get('干').pinyin == 'gàn'  # The last entry for a headword wins
+    assert mapped.get('后').definitions == ['empress']  # A simplified headword wins over a traditional one
+    assert mapped.get('後').definitions == ['back', 'behind']
+
+
+@pytest.mark.parametrize('text', [
+    '中国人说中文', '一丝不苟的人', '一丝', '中国人民', '我了解𠀀干后', 'abc', '',
+])
+def test_same_segmentation(dictionaries, text):
+    memory, mapped = dictionaries
+    for start in range(len(text)):
+        end, entry = mapped.longest_match(text, start)
+        expected_end, expected_entry = memory.longest_match(text, start)
+        assert (end, _fields(entry)) == (expected_end, _fields(expected_entry))
+    assert [(piece, _fields(entry)) for piece, entry in mapped.segment(text)] == \
+        [(piece, _fields(entry)) for piece, entry in memory.segment(text)]
+
+
+def test_not_a_dictionary(tmp_path):
+    path = tmp_path / 'cedict.bin'
+    for data in (b'', b'CCED', b'XXXX' + bytes(100)):
+        path.write_bytes(data)
+        with pytest.raises(ValueError):
+            MappedCedict(str(path))
+
+
+def test_stale_dictionary_is_recompiled(source, tmp_path, monkeypatch):
+    path = tmp_path / 'cedict.bin'
+    compile_dictionary(Cedict([parse_line('人 人 [ren2] /person/')]), str(path), (1, 2))
+    monkeypatch.setattr(cedict, 'CEDICT_SOURCE', str(source))
+    monkeypatch.setattr(cedict, 'CEDICT_FILE', str(path))
+    monkeypatch.setattr(cedict, '_dictionary', None)
+
+    fingerprint = cedict.source_fingerprint()
+    assert cedict._open_compiled(fingerprint) is None
+    dictionary = cedict.get_dictionary()
+    assert isinstance(dictionary, MappedCedict)
+    assert dictionary.fingerprint == fingerprint
+    assert dictionary.get('中国人').definitions == ['Chinese person']
+    assert cedict._open_compiled(fingerprint) is not None
+
+    # Editing the source invalidates the compiled copy
+    source.write_text(SOURCE + '好 好 [hao3] /good/\n', encoding='utf-8')
+    monkeypatch.setattr(cedict, '_dictionary', None)
+    assert cedict.get_dictionary().get('好').definitions == ['good']
@@ -0,0 +1,152 @@
+"""Background jobs, run on the request thread (or held back) instead of a thread pool."""
+import io
+import json
+import socket
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+import jobs
+from models import Job, db, get_catalog
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+class HeldExecutor:
+    """Queues tasks until run() is called, like a pool whose workers are all busy."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args):
+        self.tasks.append((fn, args))
+
+    def run(self):
+        tasks, self.tasks = self.tasks, []
+        for fn, args in tasks:
+            fn(*args)
+
+
+def _runner(app, tmp_path, executor, **kwargs):
+    runner = jobs.JobRunner(str(tmp_path), **kwargs)
+    with app.app_context():
+        runner.start(app)
+    runner._executor.shutdown()
+    runner._executor = executor
+    return runner
+
+
+@pytest.fixture
+def runner(app, tmp_path, monkeypatch):
+    runner = _runner(app, tmp_path, InlineExecutor())
+    monkeypatch.setattr(app_module, 'job_runner', runner)
+    return runner
+
+
+def _import(client, document):
+    data = document if isinstance(document, bytes) else json.dumps(document, ensure_ascii=False).encode('utf-8')
+    return client.post('/api/import-progress?async=1', data={'file': (io.BytesIO(data), 'progress.json')})
+
+
+def test_async_import_flow(app, client, runner, tmp_path):
+    with app.app_context():
+        hanzi = [entry.hanzi for entry in get_catalog().top(3)]
+    response = _import(client, {'know': hanzi})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['status_url'] == f"/api/jobs/{body['job_id']}"
+
+    job = client.get(body['status_url']).get_json()
+    assert (job['kind'], job['status'], job['error']) == ('import-progress', 'succeeded', None)
+    assert job['result']['results']['know'] == 3
+    assert [detail['character'] for detail in job['result']['results']['details']] == hanzi
+    assert client.get('/api/stats').get_json()['know_count'] == 3
+    assert list(tmp_path.iterdir()) == []  # The saved upload is removed
+
+    # Jobs are only visible to their owner
+    assert client.application.test_client().get(body['status_url']).status_code in (302, 401)
+    assert client.get('/api/jobs/unknown').status_code == 404
+
+
+def test_failed_job(client, runner):
+    response = _import(client, b'{"detailed": {"\xe4\xb8\x80": ')
+    assert response.status_code == 202
+    job = client.get(response.get_json()['status_url']).get_json()
+    assert job['status'] == 'failed'
+    assert job['error'].startswith('Invalid file')
+    assert job['finished_at'] is not None
+    assert runner._pending == 0
+
+
+def test_full_runner_refuses_jobs(app, client, tmp_path, monkeypatch):
+    held = HeldExecutor()
+    monkeypatch.setattr(app_module, 'job_runner', _runner(app, tmp_path, held, max_pending=2))
+
+    accepted = [_import(client, {'know': []}) for _ in range(2)]
+    assert [response.status_code for response in accepted] == [202, 202]
+    assert client.get(accepted[0].get_json()['status_url']).get_json()['status'] == 'queued'
+    assert _import(client, {'know': []}).status_code == 503
+
+    held.run()
+    assert [client.get(r.get_json()['status_url']).get_json()['status'] for r in accepted] == ['succeeded'] * 2
+    assert _import(client, {'know': []}).status_code == 202
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+def test_orphaned_jobs_are_failed(app, client, tmp_path):
+    host = socket.gethostname()
+    now = datetime.utcnow()
+    old = now - timedelta(hours=2)
+    jobs_by_name = {
+        'dead_worker': (f'{host}:{_dead_pid()}', 'running', now),
+        'other_host_stale': ('elsewhere:1', 'running', old),
+        'other_host_queued_stale': ('elsewhere:1', 'queued', old),
+        'other_host_recent': ('elsewhere:1', 'running', now),
+        'finished': ('elsewhere:1', 'succeeded', old),
+    }
+    with app.app_context():
+        for name, (worker, status, started_at) in jobs_by_name.items():
+            db.session.add(Job(id=f'{name}-{client.user_id}', user_id=client.user_id, kind='import-progress',
+                               status=status, worker=worker, created_at=started_at, started_at=started_at))
+        db.session.commit()
+    # The dead worker's upload is removed with it
+    upload = tmp_path / f'dead_worker-{client.user_id}.upload'
+    upload.write_bytes(b'{}')
+
+    _runner(app, tmp_path, InlineExecutor(), stale_minutes=60)
+
+    with app.app_context():
+        statuses = {name: db.session.get(Job, f'{name}-{client.user_id}').status for name in jobs_by_name}
+    assert statuses == {
+        'dead_worker': 'failed',
+        'other_host_stale': 'failed',
+        'other_host_queued_stale': 'failed',
+        'other_host_recent': 'running',
+        'finished': 'succeeded',
+    }
+    assert not upload.exists()
+
+
+def test_status_fails_stale_job(app, client, runner):
+    with app.app_context():
+        db.session.add(Job(id=f'stale-{client.user_id}', user_id=client.user_id, kind='import-progress',
+                           status='running', worker='elsewhere:1', created_at=datetime.utcnow(),
+                           started_at=datetime.utcnow()))
+        db.session.commit()
+    assert client.get(f'/api/jobs/stale-{client.user_id}').get_json()['status'] == 'running'
+
+    runner.stale_minutes = -1
+    job = client.get(f'/api/jobs/stale-{client.user_id}').get_json()
+    assert job['status'] == 'failed'
+    assert job['error'] == 'The job stopped responding, please try again'
@@ -0,0 +1,110 @@
+"""Upgrading a database created by the first version of the app."""
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+from flask import Flask
+from sqlalchemy import inspect, text
+
+from migrations import MIGRATIONS, migrate, pending_migrations
+from models import UserProgress, UserStats, db, get_catalog
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The schema as the app created it before migrations existed: no columns added
+# since, no unique (user_id, character_id) index on user_progress
+_BASELINE_SCHEMA = [
+    '''CREATE TABLE user (
+        id INTEGER PRIMARY KEY, email VARCHAR(100) NOT NULL UNIQUE, name VARCHAR(100), profile_pic VARCHAR(200),
+        created_at DATETIME, last_login DATETIME, google_id VARCHAR(100) UNIQUE)''',
+    '''CREATE TABLE character (
+        id INTEGER PRIMARY KEY, hanzi VARCHAR(10) NOT NULL, pinyin VARCHAR(50) NOT NULL, meaning VARCHAR(200) NOT NULL,
+        frequency INTEGER, rank INTEGER)''',
+    '''CREATE TABLE user_progress (
+        id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES user (id),
+        character_id INTEGER NOT NULL REFERENCES character (id), familiarity INTEGER, last_reviewed DATETIME,
+        review_count INTEGER, know_count INTEGER, unsure_count INTEGER, dont_know_count INTEGER)''',
+    '''CREATE TABLE user_character_tuning (
+        id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES user (id),
+        character_id INTEGER NOT NULL REFERENCES character (id), rank_penalty INTEGER)''',
+]
+
+
+@pytest.fixture
+def baseline(app, tmp_path):
+    """A Flask app on a SQLite database with the baseline schema and duplicate progress rows."""
+    with app.app_context():
+        characters = [(e.id, e.hanzi, e.pinyin, e.meaning, e.frequency, e.rank) for e in get_catalog().top(3)]
+
+    old_app = Flask('baseline')
+    old_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'baseline.db'}"
+    db.init_app(old_app)
+    with old_app.app_context():
+        for statement in _BASELINE_SCHEMA:
+            db.session.execute(text(statement))
+        db.session.execute(text("INSERT INTO user (id, email) VALUES (1, 'old@example.com')"))
+        db.session.execute(text('INSERT INTO character VALUES (:0, :1, :2, :3, :4, :5)'),
+                           [dict(zip('012345', c)) for c in characters])
+        first, second = characters[0][0], characters[1][0]
+        db.session.execute(text(
+            'INSERT INTO user_progress (user_id, character_id, familiarity, last_reviewed, review_count, know_count,'
+            ' unsure_count, dont_know_count) VALUES (1, :character_id, :familiarity, :last_reviewed, :reviews, :know,'
+            ' 0, :dont_know)'
+        ), [
+            {'character_id': first, 'familiarity': 0, 'last_reviewed': datetime(2024, 1, 1), 'reviews': 2, 'know': 0, 'dont_know': 2},
+            {'character_id': first, 'familiarity': 2, 'last_reviewed': datetime(2024, 2, 1), 'reviews': 1, 'know': 1, 'dont_know': 0},
+            {'character_id': second, 'familiarity': 2, 'last_reviewed': datetime(2024, 1, 5), 'reviews': 1, 'know': 1, 'dont_know': 0},
+        ])
+        db.session.commit()
+    old_app.characters = characters
+    return old_app
+
+
+def test_migrate_baseline_twice(baseline):
+    with baseline.app_context():
+        assert pending_migrations() == [(version, name) for version, name, _ in MIGRATIONS]
+        assert migrate() == [version for version, _, _ in MIGRATIONS]
+        assert pending_migrations() == []
+        assert migrate() == []
+
+        inspector = inspect(db.engine)
+        columns = {table: {c['name'] for c in inspector.get_columns(table)} for table in ('user', 'user_progress')}
+        assert {'encrypted_api_key', 'translation_popups'} <= columns['user']
+        assert {'due_at', 'interval_days', 'ease', 'previous_familiarity'} <= columns['user_progress']
+        assert any(index['unique'] and set(index['column_names']) == {'user_id', 'character_id'}
+                   for index in inspector.get_indexes('user_progress'))
+        assert inspector.has_table('review_event') and inspector.has_table('user_stats')
+
+        # Duplicates merged into the most recent row, with their counters added up
+        first, second = baseline.characters[0][0], baseline.characters[1][0]
+        rows = {row.character_id: row for row in UserProgress.query.filter_by(user_id=1)}
+        assert set(rows) == {first, second}
+        assert (rows[first].familiarity, rows[first].review_count, rows[first].know_count,
+                rows[first].dont_know_count) == (2, 3, 1, 2)
+        # Known characters come due from their last review
+        assert rows[second].due_at == datetime(2024, 1, 5)
+        stats = db.session.get(UserStats, 1)
+        assert (stats.reviewed_count, stats.know_count) == (2, 2)
+        # Characters already there are not seeded again
+        assert db.session.execute(text('SELECT COUNT(*) FROM character')).scalar() == 3
+
+
+def _check(database_url):
+    env = dict(os.environ, DATABASE_URL=database_url, JOB_WORKERS='0')
+    return subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate', '--check'],
+                          cwd=_ROOT, env=env, capture_output=True, text=True)
+
+
+def test_migrate_check(baseline):
+    url = baseline.config['SQLALCHEMY_DATABASE_URI']
+    pending = _check(url)
+    assert pending.returncode == 1, pending.stderr
+    assert f'Pending migration 1: {MIGRATIONS[0][1]}' in pending.stdout
+
+    with baseline.app_context():
+        migrate()
+    done = _check(url)
+    assert done.returncode == 0, done.stderr
+    assert 'No pending migrations' in done.stdout
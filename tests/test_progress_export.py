@@ -0,0 +1,68 @@
+"""The streamed JSON export must be the document the old in-memory export built."""
+import gzip
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+from models import Character, UserCharacterTuning, UserProgress, bulk_update_progress, db, get_catalog
+
+
+def _old_document(user_id):
+    """What /api/export-progress returned before it was streamed."""
+    progress = UserProgress.query.filter_by(user_id=user_id).order_by(UserProgress.id).all()
+    tuning_records = UserCharacterTuning.query.filter_by(user_id=user_id).order_by(UserCharacterTuning.id).all()
+    tuning_by_character_id = {t.character_id: t.rank_penalty for t in tuning_records}
+    document = {"know": [], "unsure": [], "dont_know": [], "detailed": {}, "tuning": {}}
+    for p in progress:
+        character = db.session.get(Character, p.character_id)
+        document[("dont_know", "unsure", "know")[p.familiarity]].append(character.hanzi)
+        document["detailed"][character.hanzi] = {
+            "familiarity": p.familiarity,
+            "review_count": p.review_count,
+            "know_count": p.know_count,
+            "unsure_count": p.unsure_count,
+            "dont_know_count": p.dont_know_count,
+            "last_reviewed": p.last_reviewed.isoformat(),
+            "rank_penalty": tuning_by_character_id.get(character.id, 0)
+        }
+    for t in tuning_records:
+        document["tuning"][db.session.get(Character, t.character_id).hanzi] = {"rank_penalty": t.rank_penalty}
+    return document
+
+
+@pytest.fixture
+def reviewed(app, client):
+    with app.app_context():
+        ids = [entry.id for entry in get_catalog().top(40)]
+        reviews = [(character_id, i % 3, datetime(2024, 5, 1, 8, i)) for i, character_id in enumerate(ids[:30])]
+        assert bulk_update_progress(client.user_id, reviews)
+        for character_id, penalty in ((ids[3], 50), (ids[35], 150)):
+            db.session.add(UserCharacterTuning(user_id=client.user_id, character_id=character_id, rank_penalty=penalty))
+        db.session.commit()
+    return client
+
+
+@pytest.mark.parametrize('populated', [False, True])
+def test_export_matches_old_document(app, reviewed, other_client, populated):
+    exporter = reviewed if populated else other_client
+    response = exporter.get('/api/export-progress')
+    assert response.status_code == 200
+    assert int(response.headers['Content-Length']) == len(response.data)
+    with app.app_context():
+        expected = _old_document(exporter.user_id)
+    assert json.loads(response.data) == expected
+    assert response.get_data(as_text=True) == json.dumps(expected, ensure_ascii=False, indent=2)
+
+    compressed = exporter.get('/api/export-progress?gzip=1')
+    assert compressed.headers['Content-Type'] == 'application/gzip'
+    assert json.loads(gzip.decompress(compressed.data)) == expected
+
+
+def test_gzip_export_imports(app, reviewed, other_client):
+    data = reviewed.get('/api/export-progress?gzip=1').data
+    response = other_client.post('/api/import-progress', data={'file': (io.BytesIO(data), 'character_progress.json.gz')})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.get_json()['results']['success'] == 30
+    assert json.loads(other_client.get('/api/export-progress').data) == json.loads(reviewed.get('/api/export-progress').data)
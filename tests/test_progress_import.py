@@ -0,0 +1,61 @@
+"""Progress files in the list-only format ("know"/"unsure"/"dont_know", no "detailed" section)."""
+import io
+import json
+
+import pytest
+
+import progress_import
+from models import UserCharacterTuning, UserProgress, get_catalog, get_user_stats
+
+
+@pytest.fixture
+def hanzi(app):
+    with app.app_context():
+        return [entry.hanzi for entry in get_catalog().top(6)]
+
+
+def _upload(client, document):
+    data = {'file': (io.BytesIO(json.dumps(document, ensure_ascii=False).encode('utf-8')), 'progress.json')}
+    return client.post('/api/import-progress', data=data)
+
+
+def test_list_format_round_trip(app, client, other_client, hanzi):
+    document = {
+        'know': hanzi[:3],
+        'unsure': [hanzi[3], hanzi[0]],  # Listed twice: the later list wins
+        'dont_know': [hanzi[4], '𠀀'],
+        'tuning': {hanzi[5]: {'rank_penalty': 50}},
+    }
+    response = _upload(client, document)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    results = response.get_json()['results']
+    assert (results['success'], results['know'], results['unsure'], results['dont_know'], results['not_found']) == \
+        (6, 3, 2, 1, 1)
+
+    exported = json.loads(client.get('/api/export-progress').data)
+    assert exported['know'] == hanzi[1:3]
+    assert sorted(exported['unsure']) == sorted([hanzi[0], hanzi[3]])
+    assert exported['dont_know'] == [hanzi[4]]
+    assert exported['tuning'] == {hanzi[5]: {'rank_penalty': 50}}
+
+    with app.app_context():
+        stats = get_user_stats(client.user_id)
+        assert (stats.reviewed_count, stats.know_count, stats.unsure_count, stats.dont_know_count) == (5, 2, 2, 1)
+
+    # Importing the export gives the same document back
+    assert _upload(other_client, exported).status_code == 200
+    reexported = json.loads(other_client.get('/api/export-progress').data)
+    assert {key: reexported[key] for key in ('know', 'unsure', 'dont_know', 'tuning')} == \
+        {key: exported[key] for key in ('know', 'unsure', 'dont_know', 'tuning')}
+
+
+def test_failed_list_write_commits_nothing(app, client, hanzi, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError('database went away')
+    monkeypatch.setattr(progress_import, 'write_reviews', fail)
+
+    response = _upload(client, {'know': hanzi[:2], 'tuning': {hanzi[5]: {'rank_penalty': 50}}})
+    assert response.status_code == 500
+    with app.app_context():
+        assert UserProgress.query.filter_by(user_id=client.user_id).count() == 0
+        assert UserCharacterTuning.query.filter_by(user_id=client.user_id).count() == 0
@@ -0,0 +1,16 @@
+"""The hot queries in query_plans.py must keep using an index on a migrated SQLite schema."""
+import pytest
+
+from models import db
+from query_plans import HOT_QUERIES, check_query_plans
+
+
+@pytest.fixture(scope='module')
+def plans(app):
+    with app.app_context():
+        return {result['name']: result for result in check_query_plans(db.session)}
+
+
+@pytest.mark.parametrize('name', [name for name, _, _ in HOT_QUERIES])
+def test_hot_query_uses_index(plans, name):
+    assert plans[name]['uses_index'], '\n'.join(plans[name]['plan'])
@@ -0,0 +1,140 @@
+"""Fenwick trees and the weighted samplers built on them, with a seeded random source."""
+import random
+from collections import Counter
+
+import pytest
+
+import sampling
+from catalog import Catalog, CatalogEntry
+from sampling import FenwickTree, KnownSampler, RankWindowSampler, effective_weight
+
+
+@pytest.fixture
+def catalog():
+    # Ids deliberately differ from ranks
+    return Catalog([CatalogEntry(1000 + rank, chr(0x4e00 + rank), rank, 0, '', '') for rank in range(1, 301)])
+
+
+@pytest.fixture(autouse=True)
+def seeded(monkeypatch):
+    monkeypatch.setattr(sampling, 'random', random.Random(20240501))
+
+
+def _ids(catalog, ranks):
+    return {1000 + rank for rank in ranks}
+
+
+def _frequencies(sampler, draws=20000, avoid_ids=()):
+    counts = Counter(sampler.draw(avoid_ids).id for _ in range(draws))
+    return {character_id: count / draws for character_id, count in counts.items()}
+
+
+def _expected(weights):
+    total = sum(weights.values())
+    return {character_id: weight / total for character_id, weight in weights.items()}
+
+
+def _assert_close(observed, expected):
+    assert set(observed) == set(expected)
+    for character_id, share in expected.items():
+        assert observed[character_id] == pytest.approx(share, abs=0.015)
+
+
+def test_fenwick_prefix_sums_and_search():
+    rng = random.Random(7)
+    values = [rng.choice([0.0, 0.5, 1.0, 3.25]) for _ in range(37)]
+    tree = FenwickTree(values)
+    for _ in range(50):
+        i = rng.randrange(len(values))
+        values[i] = rng.choice([0.0, 2.0, 0.125])
+        tree.set(i, values[i])
+
+    for count in range(len(values) + 1):
+        assert tree.prefix(count) == pytest.approx(sum(values[:count]))
+    assert tree.total() == pytest.approx(sum(values))
+    for i, value in enumerate(values):
+        if value > 0:
+            # The first and the last point of an item's share both land on it
+            assert tree.search(sum(values[:i])) == i
+            assert tree.search(sum(values[:i]) + value * 0.999) == i
+    assert len(FenwickTree([])) == 0
+
+
+def test_window_draws_follow_weights(catalog):
+    known = _ids(catalog, [2, 5])
+    sampler = RankWindowSampler(catalog, {}, known, window_size=10)
+    window = [rank for rank in range(1, 13) if 1000 + rank not in known]
+    _assert_close(_frequencies(sampler), _expected({1000 + rank: effective_weight(rank) for rank in window}))
+
+
+def test_window_draws_use_rank_penalties(catalog):
+    # Rank 1 demoted to effective rank 8 still sits in the window, with a smaller weight
+    sampler = RankWindowSampler(catalog, {1001: 7}, set(), window_size=5)
+    expected = {1002: 2, 1003: 3, 1004: 4, 1005: 5, 1006: 6}
+    _assert_close(_frequencies(sampler), _expected({cid: effective_weight(rank) for cid, rank in expected.items()}))
+
+
+def test_window_avoid_ids(catalog):
+    sampler = RankWindowSampler(catalog, {}, set(), window_size=5)
+    allowed = _ids(catalog, [4])
+    avoid = _ids(catalog, range(1, 6)) - allowed
+    assert {sampler.draw(avoid).id for _ in range(200)} == allowed
+    # With the whole window avoided, draws fall back to it rather than to nothing
+    assert {sampler.draw(_ids(catalog, range(1, 6))).id for _ in range(200)} <= _ids(catalog, range(1, 6))
+
+
+def test_window_refills_after_set_known(catalog):
+    sampler = RankWindowSampler(catalog, {}, set(), window_size=5, slack=3)
+    for rank in (1, 2, 3):
+        sampler.set_known(1000 + rank, True)
+    assert not sampler.is_stale()
+    assert set(_frequencies(sampler, 2000)) == _ids(catalog, range(4, 9))
+
+    sampler.set_known(1004, True)
+    assert sampler.is_stale()  # Only 4 unknown characters left in the pool
+    rebuilt = RankWindowSampler(catalog, {}, _ids(catalog, range(1, 5)), window_size=5, slack=3)
+    assert set(_frequencies(rebuilt, 2000)) == _ids(catalog, range(5, 10))
+
+    # Forgetting a character puts it straight back in the window
+    rebuilt.set_known(1004, False)
+    assert set(_frequencies(rebuilt, 2000)) == _ids(catalog, range(4, 9))
+
+
+def test_window_set_rank_penalty(catalog):
+    sampler = RankWindowSampler(catalog, {}, set(), window_size=5, slack=3)
+    # Demoted past the end of the pool: dropped in place
+    assert sampler.set_rank_penalty(1002, 100)
+    assert set(_frequencies(sampler, 2000)) == _ids(catalog, [1, 3, 4, 5, 6])
+    # Moved within the pool: its order changes, so the pool must be rebuilt
+    assert not sampler.set_rank_penalty(1001, 3)
+    rebuilt = RankWindowSampler(catalog, {1002: 100, 1001: 3}, set(), window_size=5, slack=3)
+    assert set(_frequencies(rebuilt, 2000)) == _ids(catalog, [1, 3, 4, 5, 6])
+    assert rebuilt.draw() is not None
+
+
+def test_known_draws_follow_weights(catalog):
+    known = _ids(catalog, [1, 3, 10, 50])
+    penalties = {1003: 20}
+    sampler = KnownSampler(catalog, penalties, known)
+    expected = {1001: 1, 1003: 23, 1010: 10, 1050: 50}
+    _assert_close(_frequencies(sampler), _expected({cid: effective_weight(rank) for cid, rank in expected.items()}))
+
+    assert {sampler.draw(_ids(catalog, [1, 3, 10])).id for _ in range(200)} == {1050}
+    assert {sampler.draw(known).id for _ in range(200)} <= known
+
+
+def test_known_sampler_updates(catalog):
+    penalties = {}
+    sampler = KnownSampler(catalog, penalties, _ids(catalog, [1, 2]))
+    sampler.set_known(1001, False)
+    sampler.set_known(1100, True)
+    assert set(_frequencies(sampler, 2000)) == {1002, 1100}
+
+    # The sampler reads penalties from the dict the scheduler state updates
+    penalties[1002] = 98
+    sampler.refresh_weight(1002)
+    _assert_close(_frequencies(sampler), _expected({1002: effective_weight(100), 1100: effective_weight(100)}))
+
+    sampler.set_known(1002, False)
+    sampler.set_known(1100, False)
+    assert sampler.draw() is None
@@ -0,0 +1,40 @@
+"""Draws and updates of a cached SchedulerState do not interleave."""
+import threading
+
+import models
+from models import get_next_characters, get_scheduler_state, scheduler_states
+
+
+def test_draws_hold_the_state_lock(app, client, monkeypatch):
+    pick = models._pick_character
+    held = []
+
+    def checked_pick(catalog, state, avoid_ids):
+        held.append(state.lock.locked())
+        return pick(catalog, state, avoid_ids)
+    monkeypatch.setattr(models, '_pick_character', checked_pick)
+
+    with app.app_context():
+        assert len(get_next_characters(client.user_id, 5)) == 5
+    assert held and all(held)
+
+
+def test_updates_wait_for_a_draw(app, client):
+    with app.app_context():
+        state = get_scheduler_state(client.user_id)
+        character_id = models.get_catalog().entries[0].id
+
+    with state.lock:
+        updates = [
+            threading.Thread(target=scheduler_states.record_review, args=(client.user_id, character_id, 2)),
+            threading.Thread(target=scheduler_states.set_rank_penalty, args=(client.user_id, character_id, 50)),
+        ]
+        for thread in updates:
+            thread.start()
+            thread.join(0.05)
+            assert thread.is_alive()
+        assert character_id not in state.familiarity
+    for thread in updates:
+        thread.join(1)
+        assert not thread.is_alive()
+    assert (state.familiarity[character_id], state.rank_penalties[character_id]) == (2, 50)
@@ -0,0 +1,98 @@
+"""Binary snapshots: export/import round trips and rejection of damaged files."""
+import io
+from datetime import datetime
+
+import pytest
+
+import progress_import
+import snapshot
+from catalog import Catalog, CatalogEntry
+from models import UserCharacterTuning, UserProgress, bulk_update_progress, db, get_catalog
+
+T0 = datetime(2024, 5, 1, 8, 30, 15, 123456)
+
+
+def _progress(user_id):
+    return {
+        row.character_id: (row.familiarity, row.review_count, row.know_count, row.unsure_count,
+                           row.dont_know_count, row.last_reviewed)
+        for row in UserProgress.query.filter_by(user_id=user_id)
+    }
+
+
+def _tuning(user_id):
+    return {row.character_id: row.rank_penalty for row in UserCharacterTuning.query.filter_by(user_id=user_id)}
+
+
+def _import(client, data):
+    return client.post('/api/import-progress', data=data, content_type=snapshot.MIMETYPE)
+
+
+@pytest.fixture
+def exported(app, client):
+    """A snapshot of a user with progress, tuning on a reviewed character and tuning on its own."""
+    with app.app_context():
+        ids = [entry.id for entry in get_catalog().top(5)]
+        assert bulk_update_progress(client.user_id, [(ids[0], 0, T0), (ids[0], 2, T0), (ids[1], 1, T0), (ids[2], 0, None)])
+        db.session.add(UserCharacterTuning(user_id=client.user_id, character_id=ids[1], rank_penalty=50))
+        db.session.add(UserCharacterTuning(user_id=client.user_id, character_id=ids[4], rank_penalty=100))
+        db.session.commit()
+        expected = _progress(client.user_id), _tuning(client.user_id)
+    response = client.get('/api/export-progress?format=binary')
+    assert response.headers['Content-Type'] == snapshot.MIMETYPE
+    return response.data, expected
+
+
+def test_round_trip(app, exported, other_client):
+    data, (progress, tuning) = exported
+    response = _import(other_client, data)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.get_json()['results']['success'] == 3
+    with app.app_context():
+        assert _progress(other_client.user_id) == progress
+        assert _tuning(other_client.user_id) == tuning
+
+
+def test_uploaded_file_is_detected(app, exported, other_client):
+    data, (progress, _) = exported
+    response = other_client.post('/api/import-progress', data={'file': (io.BytesIO(data), 'backup.bin')})
+    assert response.status_code == 200
+    with app.app_context():
+        assert _progress(other_client.user_id) == progress
+
+
+@pytest.mark.parametrize('damage, message', [
+    (lambda data: b'XXXX' + data[4:], 'Not a snapshot file'),
+    (lambda data: data[:4] + (snapshot.VERSION + 1).to_bytes(2, 'little') + data[6:], 'Unsupported snapshot version'),
+    (lambda data: data[:6] + (snapshot.RECORD.size + 4).to_bytes(2, 'little') + data[8:], 'record size'),
+    (lambda data: data[:-3], 'does not match its record count'),
+    (lambda data: data[:snapshot.HEADER.size - 1], 'truncated'),
+])
+def test_damaged_snapshots_are_rejected(app, exported, other_client, damage, message):
+    data, _ = exported
+    with pytest.raises(snapshot.SnapshotError, match=message):
+        list(snapshot.unpack(damage(data)))
+
+    response = _import(other_client, damage(data))
+    assert response.status_code == 400
+    assert 'Invalid snapshot' in response.get_json()['error']
+    with app.app_context():
+        assert _progress(other_client.user_id) == {}
+
+
+def test_records_are_matched_by_rank(app, exported, other_client, monkeypatch):
+    """A database whose character ids differ (e.g. seeded in another order) maps records by rank."""
+    data, (progress, _) = exported
+    with app.app_context():
+        entries = list(get_catalog())
+        # Every rank gets the id of the next character, as if the table had been loaded differently
+        shifted = Catalog(
+            CatalogEntry(entries[(i + 1) % len(entries)].id, e.hanzi, e.rank, e.frequency, e.pinyin, e.meaning)
+            for i, e in enumerate(entries)
+        )
+        shifted_id = {e.id: shifted.by_rank(e.rank).id for e in entries}
+    monkeypatch.setattr(progress_import, 'get_catalog', lambda: shifted)
+
+    assert _import(other_client, data).status_code == 200
+    with app.app_context():
+        assert _progress(other_client.user_id) == {shifted_id[character_id]: row for character_id, row in progress.items()}
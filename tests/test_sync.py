@@ -0,0 +1,80 @@
+"""/api/sync applies offline reviews once each, in the order they happened."""
+import app as app_module
+from models import ReviewEvent, UserProgress, get_user_stats
+
+
+def _event(event_id, character_id, familiarity, reviewed_at):
+    return {'id': event_id, 'character_id': character_id, 'familiarity': familiarity, 'reviewed_at': reviewed_at}
+
+
+def _row(app, user_id, character_id):
+    with app.app_context():
+        return UserProgress.query.filter_by(user_id=user_id, character_id=character_id).one()
+
+
+def test_retried_batch_counts_as_duplicates(app, client):
+    events = [_event('a1', 50, 2, '2024-05-01T08:00:00Z'), _event('a2', 51, 1, '2024-05-01T08:01:00Z')]
+    first = client.post('/api/sync', json={'events': events}).get_json()
+    assert (first['applied'], first['duplicates']) == (2, 0)
+
+    second = client.post('/api/sync', json={'events': events + [events[0]]}).get_json()
+    assert (second['applied'], second['duplicates']) == (0, 3)
+    assert second['familiarity'] == {'50': 2, '51': 1}
+
+    assert _row(app, client.user_id, 50).review_count == 1
+    with app.app_context():
+        stats = get_user_stats(client.user_id)
+        assert (stats.reviewed_count, stats.know_count, stats.unsure_count) == (2, 1, 1)
+        assert ReviewEvent.query.filter_by(user_id=client.user_id).count() == 2
+
+
+def test_events_are_applied_in_time_order(app, client):
+    response = client.post('/api/sync', json={'events': [
+        _event('b3', 60, 2, '2024-05-01T10:00:00Z'),
+        _event('b1', 60, 0, '2024-05-01T08:00:00Z'),
+        _event('b2', 60, 1, 1714554000000),  # 2024-05-01T09:00:00Z in epoch milliseconds
+    ]}).get_json()
+    assert response['applied'] == 3
+    assert response['familiarity'] == {'60': 2}
+
+    with app.app_context():
+        events = ReviewEvent.query.filter_by(user_id=client.user_id).order_by(ReviewEvent.reviewed_at).all()
+        assert [e.client_event_id for e in events] == ['b1', 'b2', 'b3']
+        assert [(e.previous_familiarity, e.familiarity) for e in events] == [(None, 0), (0, 1), (1, 2)]
+
+
+def test_late_offline_event_keeps_newer_answer(app, client):
+    assert client.post('/api/progress', json={'character_id': 70, 'familiarity': 2}).status_code == 200
+
+    response = client.post('/api/sync', json={'events': [_event('c1', 70, 0, '2020-01-01T00:00:00Z')]}).get_json()
+    assert response['applied'] == 1
+    assert response['familiarity'] == {'70': 2}
+
+    row = _row(app, client.user_id, 70)
+    assert (row.familiarity, row.review_count, row.dont_know_count) == (2, 2, 1)
+
+
+def test_bad_timestamps_are_rejected(client):
+    response = client.post('/api/sync', json={'events': [
+        _event('d1', 80, 2, 'yesterday'),
+        _event('d2', 80, 2, None),
+        _event('d3', 80, 2, [2024, 5, 1]),
+        _event('d4', 80, 2, 10 ** 20),
+        _event('d5', 80, 2, '2024-05-01T08:00:00'),
+    ]}).get_json()
+    assert response['rejected'] == ['d1', 'd2', 'd3', 'd4']
+    assert response['applied'] == 1
+
+
+def test_future_timestamps_are_capped(app, client):
+    client.post('/api/sync', json={'events': [_event('f1', 81, 2, '2999-01-01T00:00:00Z')]})
+    with app.app_context():
+        event = ReviewEvent.query.filter_by(user_id=client.user_id, client_event_id='f1').one()
+        assert event.reviewed_at.year < 2999
+
+
+def test_oversized_batch(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'SYNC_MAX_EVENTS', 3)
+    events = [_event(f'g{i}', 90 + i, 2, '2024-05-01T08:00:00Z') for i in range(4)]
+    assert client.post('/api/sync', json={'events': events}).status_code == 413
+    assert client.post('/api/sync', json={'events': events[:3]}).get_json()['applied'] == 3
@@ -0,0 +1,92 @@
+"""The write-behind queue: recovery of logs left by dead workers, and reads that see buffered reviews."""
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+import models
+import write_behind
+from models import ReviewEvent, UserProgress, bulk_update_progress, get_user_stats
+
+
+def _log_line(user_id, character_id, familiarity, reviewed_at, review_id):
+    return json.dumps({'u': user_id, 'c': character_id, 'f': familiarity, 't': reviewed_at, 'l': None,
+                       'i': review_id}) + '\n'
+
+
+def _queue(directory, apply=models._apply_buffered_reviews):
+    # Flushed by hand in these tests, never by the background thread
+    return write_behind.WriteBehindQueue(str(directory), apply, flush_interval_ms=3600 * 1000, max_events=10 ** 6)
+
+
+def test_orphaned_log_is_replayed(app, client, tmp_path):
+    user_id = client.user_id
+    with app.app_context():
+        # The dead worker had applied its first review before it crashed
+        assert models.sync_reviews(user_id, [('wb-1', 100, 2, datetime(2024, 5, 1, 8), None)])
+
+    with open(tmp_path / 'reviews-999999.log', 'w', encoding='utf-8') as f:
+        f.write(_log_line(user_id, 100, 2, '2024-05-01T08:00:00', 'wb-1'))
+        f.write(_log_line(user_id, 101, 1, '2024-05-01T08:01:00', 'wb-2'))
+        f.write(_log_line(user_id, 100, 0, '2024-05-01T08:02:00', 'wb-3'))
+        f.write('{"u": 1, "c": 10')  # Torn write
+    # A log still locked by a live worker is left alone
+    live = write_behind.WriteBehindQueue._open_locked(str(tmp_path / 'reviews-999998.log'))
+    live.write(_log_line(user_id, 102, 2, '2024-05-01T08:03:00', 'wb-4'))
+    live.flush()
+
+    queue = _queue(tmp_path)
+    try:
+        queue.start(app)
+        assert [review[4] for review in queue.pending_for(user_id)] == ['wb-1', 'wb-2', 'wb-3']
+        assert not os.path.exists(tmp_path / 'reviews-999999.log')
+        queue.flush()
+        assert queue.pending_for(user_id) == []
+    finally:
+        live.close()
+
+    with app.app_context():
+        rows = {row.character_id: row for row in UserProgress.query.filter_by(user_id=user_id)}
+        assert set(rows) == {100, 101}
+        assert (rows[100].familiarity, rows[100].review_count) == (0, 2)
+        assert ReviewEvent.query.filter_by(user_id=user_id).count() == 3
+    with open(queue._log_path, encoding='utf-8') as f:
+        assert f.read() == ''
+
+
+@pytest.fixture
+def buffered(app, tmp_path, monkeypatch):
+    """A started queue that models reads from; nothing reaches the database until flushed."""
+    flushing = {'on': False}
+    queue = _queue(tmp_path, lambda user_id, reviews: flushing['on'] and models._apply_buffered_reviews(user_id, reviews))
+    queue.start(app)
+    monkeypatch.setattr(models, 'review_queue', queue)
+    queue.flushing = flushing
+    return queue
+
+
+def test_reads_include_buffered_reviews(app, client, buffered):
+    user_id = client.user_id
+    with app.app_context():
+        assert bulk_update_progress(user_id, [(110, 2), (111, 2), (112, 0)])
+    buffered.submit(user_id, 110, 0)
+    buffered.submit(user_id, 113, 1)
+    buffered.submit(user_id, 113, 2)
+
+    def reads():
+        stats = client.get('/api/stats').get_json()
+        known = client.get('/api/characters/known').get_json()['characters']
+        return ((stats['reviewed_characters'], stats['know_count'], stats['unsure_count'], stats['dont_know_count']),
+                {character['id'] for character in known})
+
+    counts, known = reads()
+    assert counts == (4, 2, 0, 2)
+    assert known == {111}  # 110 moved out at once; 113 appears once flushed
+    with app.app_context():
+        # Nothing was written back
+        assert (get_user_stats(user_id).know_count, models.db.session.get(models.UserStats, user_id).know_count) == (2, 2)
+
+    buffered.flushing['on'] = True
+    buffered.flush()
+    assert reads() == ((4, 2, 0, 2), {111, 113})
@@ -0,0 +1,238 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+
+class WriteBehindQueue:
+    """Durable per-worker buffer of review submissions.
+
+    A review is appended to this worker's log file and fsynced before the
+    request returns; a background thread then applies the buffered reviews
+    to the database in bulk, per user, every `flush_interval_ms` or as soon
+    as `max_events` are waiting. Each log is held under an exclusive flock,
+    so on startup a worker can adopt the logs of workers that died before
+    flushing without touching the logs of live ones.
+
+    Every review carries a unique id, and `apply` must skip ids it has already
+    written: a worker that dies after applying a batch but before shrinking
+    its log replays that batch on the next start. A user's reviews that fail
+    `max_attempts` flushes in a row are moved to dead-letter.log in the same
+    line format instead of being retried forever.
+    """
+
+    def __init__(self, directory, apply, flush_interval_ms=500, max_events=200, max_attempts=10):
+        self.directory = directory
+        self.apply = apply  # apply(user_id, [(character_id, familiarity, reviewed_at, latency_ms, review_id), ...]) -> bool
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_events = max_events
+        self.max_attempts = max_attempts
+        self._pending = {}  # user_id -> [(character_id, familiarity, reviewed_at, latency_ms, review_id), ...]
+        self._pending_count = 0
+        self._attempts = {}  # user_id -> failed flushes in a row, only touched under _flush_lock
+        self._flushing = {}  # Batch being written by the flusher, still visible to pending_for
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._app = None
+        self._log = None
+        self._log_path = None
+        self._thread = None
+        self._flush_lock = threading.Lock()
+
+    def start(self, app):
+        """Open this worker's log, adopt orphaned logs and start the flusher thread."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._app = app
+            os.makedirs(self.directory, exist_ok=True)
+            self._log_path = os.path.join(self.directory, f'reviews-{os.getpid()}.log')
+            self._log = self._open_locked(self._log_path)
+            # A previous process with the same PID may have left reviews behind
+            self._log.seek(0)
+            self._enqueue([e for e in map(self._parse, self._log) if e is not None])
+            self._rewrite_log()
+            self._adopt_orphans()
+            self._thread = threading.Thread(target=self._run, name='write-behind-flusher', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+        print(f"Write-behind review queue started: {self._log_path}")
+
+    @staticmethod
+    def _open_locked(path, blocking=True):
+        import fcntl
+        f = open(path, 'a+', encoding='utf-8')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            f.close()
+            return None
+        return f
+
+    def _adopt_orphans(self):
+        """Move reviews from logs no live worker holds into this worker's queue."""
+        for path in sorted(glob.glob(os.path.join(self.directory, 'reviews-*.log'))):
+            if path == self._log_path:
+                continue
+            f = self._open_locked(path, blocking=False)
+            if f is None:
+                continue  # Still owned by a running worker
+            try:
+                f.seek(0)
+                entries = [e for e in map(self._parse, f) if e is not None]
+                self._append(entries)
+                os.remove(path)
+                if entries:
+                    print(f"Recovered {len(entries)} buffered reviews from {path}")
+            finally:
+                f.close()
+
+    @staticmethod
+    def _format(entries):
+        return ''.join(
+            json.dumps({'u': u, 'c': c, 'f': f, 't': t.isoformat(), 'l': l, 'i': i}) + '\n'
+            for u, c, f, t, l, i in entries
+        )
+
+    @staticmethod
+    def _parse(line):
+        try:
+            data = json.loads(line)
+            # Logs written before reviews had ids get fresh ones
+            review_id = data.get('i') or _new_review_id()
+            return data['u'], data['c'], data['f'], datetime.fromisoformat(data['t']), data.get('l'), review_id
+        except (ValueError, KeyError, TypeError):
+            return None  # Torn write from a crash mid-append
+
+    def _append(self, entries):
+        """Write entries to the log, fsync, then add them to the pending buffer. Caller holds _lock."""
+        if not entries:
+            return
+        self._log.write(self._format(entries))
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._enqueue(entries)
+
+    def _enqueue(self, entries):
+        """Add entries that are already on disk to the pending buffer. Caller holds _lock."""
+        for user_id, *review in entries:
+            self._pending.setdefault(user_id, []).append(tuple(review))
+        self._pending_count += len(entries)
+
+    def submit(self, user_id, character_id, familiarity, latency_ms=None):
+        """Durably queue one review. Returns once it is on disk."""
+        with self._lock:
+            self._append([(user_id, character_id, familiarity, datetime.utcnow(), latency_ms, _new_review_id())])
+            full = self._pending_count >= self.max_events
+        if full:
+            self._wakeup.set()
+
+    def pending_for(self, user_id):
+        """Reviews of a user that have not reached the database yet, oldest first."""
+        with self._lock:
+            return self._flushing.get(user_id, []) + self._pending.get(user_id, [])
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing write-behind queue: {e}")
+
+    def flush(self):
+        """Apply every pending review to the database."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                batch, self._pending, self._pending_count = self._pending, {}, 0
+                self._flushing = batch
+
+            failed = dict(batch)
+            try:
+                with self._app.app_context():
+                    for user_id, reviews in batch.items():
+                        if self.apply(user_id, reviews):
+                            del failed[user_id]
+                            self._attempts.pop(user_id, None)
+            finally:
+                self._requeue(failed)
+
+    def _requeue(self, failed):
+        with self._lock:
+            # Reviews submitted during the flush stay queued after the failed ones
+            for user_id, reviews in failed.items():
+                attempts = self._attempts.get(user_id, 0) + 1
+                if attempts >= self.max_attempts:
+                    self._dead_letter(user_id, reviews, attempts)
+                    self._attempts.pop(user_id, None)
+                    continue
+                self._attempts[user_id] = attempts
+                self._pending[user_id] = reviews + self._pending.get(user_id, [])
+            self._pending_count = sum(len(reviews) for reviews in self._pending.values())
+            self._flushing = {}
+            self._rewrite_log()
+
+    def _dead_letter(self, user_id, reviews, attempts):
+        """Append reviews that keep failing to dead-letter.log so they stop blocking the queue."""
+        path = os.path.join(self.directory, 'dead-letter.log')
+        f = self._open_locked(path)
+        try:
+            f.write(self._format((user_id, *review) for review in reviews))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        print(f"Moved {len(reviews)} reviews of user {user_id} to {path} after {attempts} failed flushes")
+
+    def _rewrite_log(self):
+        """Replace the log with one holding only the reviews still pending. Caller holds _lock.
+
+        The new log is written, fsynced and locked under a temporary name
+        before it is renamed over the old one, so a crash at any point leaves
+        either the old or the new log complete on disk.
+        """
+        temp_path = self._log_path + '.tmp'
+        log = self._open_locked(temp_path)
+        try:
+            log.seek(0)
+            log.truncate()
+            log.write(self._format(
+                (user_id, *review) for user_id, reviews in self._pending.items() for review in reviews
+            ))
+            log.flush()
+            os.fsync(log.fileno())
+            os.replace(temp_path, self._log_path)
+        except BaseException:
+            log.close()
+            raise
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self._log.close()
+        self._log = log
+
+
+def _new_review_id():
+    # Stored as ReviewEvent.client_event_id; the prefix keeps it apart from ids sent by offline clients
+    return 'wb-' + uuid.uuid4().hex
+
+
+def from_env(apply):
+    """Build the queue when WRITE_BEHIND=true, otherwise return None."""
+    if os.environ.get('WRITE_BEHIND', '').lower() not in ('1', 'true', 'yes'):
+        return None
+    return WriteBehindQueue(
+        directory=os.environ.get('WRITE_BEHIND_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'write_behind')),
+        apply=apply,
+        flush_interval_ms=int(os.environ.get('WRITE_BEHIND_FLUSH_MS', 500)),
+        max_events=int(os.environ.get('WRITE_BEHIND_MAX_EVENTS', 200)),
+        max_attempts=int(os.environ.get('WRITE_BEHIND_MAX_ATTEMPTS', 10)),
+    )